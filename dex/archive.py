@@ -0,0 +1,484 @@
+"""
+Usage: python3 archive.py -r <recording> [-z <level>] [-n <block_records>] [-d] <archive>
+       python3 archive.py [-f <flow_id>] [-t <start>:<end>] <archive>
+
+Append-only columnar archive of the decoded DEX events (see `events.py`).
+
+The archive is a sequence of blocks of up to `BLOCK_RECORDS` records. In a
+block, each field of `ARCHIVE_DTYPE` is stored as a column of fixed-width
+little-endian values, followed by the OSS data of the records. Columns can be
+compressed with zlib (`-z`).
+
+Each block starts with its number of records and the minimum and maximum of
+its time and Flow ID, also appended to an index (`<archive>.idx`) after the
+block is written. Queries, e.g. all records of a flow within a time window,
+only look at the index and map the matching blocks; other blocks are not
+read. The index is built again from the headers of the blocks if missing or
+behind the archive.
+
+The time of a record is its IOAM timestamp (seconds and microseconds) if the
+trace type has one, and the time of the archiving otherwise, in microseconds.
+
+With `-d`, the OSS schemas are interned (see `schemas.py`): records only hold
+a reference (`ossRef`) to their schema, written once in `<archive>.schemas`.
+
+With `-r`, the events of a recording are appended to the archive.
+Otherwise, the records matching `-f` and `-t` (in seconds) are printed.
+"""
+
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+import argparse
+import numpy as np
+
+import events
+import schemas
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# maximum number of records of a block
+BLOCK_RECORDS = 65536
+
+# zlib level of the columns, 0 for no compression
+COMPRESSION = 0
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# records, little-endian
+ARCHIVE_DTYPE = np.dtype([
+    ("time", "<u8"), ("namespace", "<u2"), ("extFlags", "u1"), ("traceType", "<u4"),
+    ("flowId", "<u4"), ("seqNum", "<u4"), ("hopLimNodeId", "<u4"), ("interfaces", "<u4"),
+    ("queueDepth", "<u4"), ("ossSchemaId", "<u4"), ("ossLen", "<u2"), ("ossRef", "<u4"),
+    ("hopLimNodeIdWide", "<u8"),
+])
+
+# OSS data, after the columns of `ARCHIVE_DTYPE`
+OSS_COLUMN = "ossData"
+
+FILE_MAGIC = b"DEXARCH1"
+BLOCK_MAGIC = b"DEXB"
+
+# magic, records, flags, columns, min and max of time, min and max of Flow ID
+BLOCK_HEADER = struct.Struct("<4sIIIQQII")
+
+# flags of a block
+FLAG_ZLIB = 0x1
+
+# entries of the index
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"), ("size", "<u8"), ("count", "<u4"), ("flags", "<u4"),
+    ("timeMin", "<u8"), ("timeMax", "<u8"), ("flowMin", "<u4"), ("flowMax", "<u4"),
+])
+INDEX_SUFFIX = ".idx"
+
+# schemas interned, reference, schema ID and length of the OSS data, followed by the data
+SCHEMAS_SUFFIX = ".schemas"
+SCHEMA_ENTRY = struct.Struct("<IIH")
+
+# columns are aligned, so that they can be used in place
+ALIGNMENT = 8
+
+# timestamp (seconds) and timestamp fraction (microseconds) in the trace type
+TRACE_TYPE_TIMESTAMP = 0x200000
+TRACE_TYPE_TIMESTAMP_FRAC = 0x100000
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def padding(size : int) -> int:
+    return -size % ALIGNMENT
+
+def to_records(evts : np.ndarray, batch : events.Batch = None, now : float = None, refs : np.ndarray = None) -> tuple:
+    """Return records (`ARCHIVE_DTYPE`) of `evts` and their OSS data, held by `batch`. OSS data of the events with `refs` is not kept."""
+
+    records = np.zeros(len(evts), dtype=ARCHIVE_DTYPE)
+    for field in ARCHIVE_DTYPE.names:
+        if field not in ("time", "ossRef"):
+            records[field] = evts[field]
+    if refs is not None:
+        records["ossRef"] = refs
+        records["ossLen"][refs != schemas.NO_REF] = 0
+
+    now = int((time.time() if now is None else now) * 1e6)
+    hasTime = (evts["traceType"] & TRACE_TYPE_TIMESTAMP) != 0
+    hasFrac = (evts["traceType"] & TRACE_TYPE_TIMESTAMP_FRAC) != 0
+    timestamp = evts["timestamp"].astype(np.uint64) * np.uint64(10**6) + np.where(hasFrac, evts["timestampFrac"], 0).astype(np.uint64)
+    records["time"] = np.where(hasTime, timestamp, np.uint64(now))
+
+    # OSS data is lost without the messages of the events
+    if batch is None:
+        records["ossLen"] = 0
+
+    lengths = records["ossLen"].astype(np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return records, np.empty(0, dtype=np.uint8)
+
+    # bytes of all OSS data at once
+    ends = np.cumsum(lengths)
+    positions = np.repeat(evts["ossOffset"].astype(np.int64) - (ends - lengths), lengths) + np.arange(total)
+    return records, batch.u8[positions]
+
+def encode_block(records : np.ndarray, oss : np.ndarray, level : int = COMPRESSION) -> tuple:
+    """Return block of `records` and their `oss` data, and its index entry (without offset)."""
+
+    flags = FLAG_ZLIB if level > 0 else 0
+    columns = [np.ascontiguousarray(records[field]).tobytes() for field in ARCHIVE_DTYPE.names] + [oss.tobytes()]
+    if flags & FLAG_ZLIB:
+        columns = [zlib.compress(c, level) for c in columns]
+
+    entry = np.zeros(1, dtype=INDEX_DTYPE)[0]
+    entry["count"] = len(records)
+    entry["flags"] = flags
+    entry["timeMin"], entry["timeMax"] = records["time"].min(), records["time"].max()
+    entry["flowMin"], entry["flowMax"] = records["flowId"].min(), records["flowId"].max()
+
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(records), flags, len(columns),
+                               int(entry["timeMin"]), int(entry["timeMax"]), int(entry["flowMin"]), int(entry["flowMax"]))
+    parts = [header, struct.pack(f"<{len(columns)}Q", *(len(c) for c in columns))]
+    for c in columns:
+        parts += [c, b"\0" * padding(len(c))]
+
+    block = b"".join(parts)
+    entry["size"] = len(block)
+    return block, entry
+
+class Writer:
+    """Append events to an archive, block by block."""
+
+    def __init__(self, path : str, level : int = COMPRESSION, blockRecords : int = BLOCK_RECORDS,
+                 dedup : bool = False, maxSchemas : int = schemas.MAX_SCHEMAS) -> None:
+        if blockRecords <= 0:
+            raise RuntimeError("Number of records of a block cannot be <= 0")
+
+        self.path = path
+        self.level = level
+        self.blockRecords = blockRecords
+
+        # index of previous runs is checked before appending
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            Reader(path).close()
+
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.index = open(path + INDEX_SUFFIX, "ab")
+
+        # references continue those of previous runs
+        self.schemas = None
+        self.schemaFile = None
+        if dedup:
+            self.schemas = schemas.SchemaCache(maxSchemas)
+            for ref, (schemaId, data) in read_schemas(path + SCHEMAS_SUFFIX).items():
+                self.schemas.add(ref, schemaId, data)
+            self.schemaFile = open(path + SCHEMAS_SUFFIX, "ab")
+
+        self.pending = []
+        self.pendingOss = []
+        self.nbPending = 0
+        self.blocks = 0
+        self.records = 0
+
+    def append(self, evts : np.ndarray, batch : events.Batch = None, now : float = None):
+        """Append `evts`, whose OSS data is held by `batch`. Full blocks are written at once."""
+
+        if len(evts) == 0:
+            return
+
+        refs = None
+        if self.schemas is not None:
+            refs, new = self.schemas.intern(evts, batch)
+            # schemas written before the records referencing them
+            if new:
+                self.schemaFile.write(b"".join(SCHEMA_ENTRY.pack(ref, schemaId, len(data)) + data for ref, schemaId, data in new))
+                self.schemaFile.flush()
+
+        records, oss = to_records(evts, batch, now, refs)
+        self.pending.append(records)
+        self.pendingOss.append(oss)
+        self.nbPending += len(records)
+        if self.nbPending >= self.blockRecords:
+            self.flush(full=True)
+
+    def flush(self, full : bool = False):
+        """Write pending records in blocks. If `full`, the last incomplete block is kept pending."""
+
+        if self.nbPending == 0:
+            return
+
+        records = np.concatenate(self.pending)
+        oss = np.concatenate(self.pendingOss)
+        ossEnds = np.cumsum(records["ossLen"], dtype=np.int64)
+
+        start = 0
+        while len(records) - start >= self.blockRecords or (not full and start < len(records)):
+            end = min(start + self.blockRecords, len(records))
+            ossStart = int(ossEnds[start - 1]) if start else 0
+            self.write_block(records[start:end], oss[ossStart:int(ossEnds[end - 1])])
+            start = end
+
+        ossStart = int(ossEnds[start - 1]) if start else 0
+        self.pending = [records[start:]]
+        self.pendingOss = [oss[ossStart:]]
+        self.nbPending = len(records) - start
+
+    def write_block(self, records : np.ndarray, oss : np.ndarray):
+        block, entry = encode_block(records, oss, self.level)
+        entry["offset"] = self.file.tell()
+        self.file.write(block)
+        self.file.flush()
+        # entry only written once its block is on disk
+        self.index.write(entry.tobytes())
+        self.index.flush()
+        self.blocks += 1
+        self.records += len(records)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index.close()
+        if self.schemaFile is not None:
+            self.schemaFile.close()
+
+def read_schemas(path : str) -> dict:
+    """Return reference -> schema ID and OSS data of the schemas interned in the file at `path`."""
+
+    result = {}
+    if not os.path.exists(path):
+        return result
+
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + SCHEMA_ENTRY.size <= len(data):
+        ref, schemaId, length = SCHEMA_ENTRY.unpack_from(data, offset)
+        offset += SCHEMA_ENTRY.size
+        if offset + length > len(data):
+            # entry interrupted while written
+            break
+        result[ref] = (schemaId, data[offset:offset + length])
+        offset += length
+    return result
+
+def scan_blocks(path : str, start : int = len(FILE_MAGIC)) -> np.ndarray:
+    """Return index entries of the blocks of the archive at `path` from offset `start`, read from their headers."""
+
+    entries = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = start
+        while offset + BLOCK_HEADER.size <= size:
+            f.seek(offset)
+            header = f.read(BLOCK_HEADER.size)
+            magic, count, flags, nbColumns, timeMin, timeMax, flowMin, flowMax = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC:
+                raise RuntimeError(f"Invalid block at offset {offset} of {path}")
+            lengths = struct.unpack(f"<{nbColumns}Q", f.read(8 * nbColumns))
+            blockSize = BLOCK_HEADER.size + 8 * nbColumns + sum(l + padding(l) for l in lengths)
+            if offset + blockSize > size:
+                # block interrupted while written
+                break
+            entries.append((offset, blockSize, count, flags, timeMin, timeMax, flowMin, flowMax))
+            offset += blockSize
+
+    return np.array(entries, dtype=INDEX_DTYPE)
+
+class Reader:
+    """Query the records of an archive, only mapping the blocks matching the query."""
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            self.file.close()
+            raise RuntimeError(f"{path} is not a DEX archive")
+
+        self.index = self.load_index()
+
+    def load_index(self) -> np.ndarray:
+        """Return index of the archive, completed from the headers of the blocks missing from the index file."""
+
+        indexPath = self.path + INDEX_SUFFIX
+        index = np.fromfile(indexPath, dtype=INDEX_DTYPE) if os.path.exists(indexPath) else np.empty(0, dtype=INDEX_DTYPE)
+
+        end = int(index["offset"][-1] + index["size"][-1]) if len(index) else len(FILE_MAGIC)
+        if end < os.path.getsize(self.path):
+            index = np.concatenate([index, scan_blocks(self.path, end)])
+            index.tofile(indexPath)
+        return index
+
+    def close(self):
+        self.file.close()
+
+    def select(self, flowId : int = None, start : float = None, end : float = None) -> np.ndarray:
+        """Return blocks which may hold records of `flowId` between `start` and `end` (in seconds)."""
+
+        match = np.ones(len(self.index), dtype=bool)
+        if flowId is not None:
+            match &= (self.index["flowMin"] <= flowId) & (self.index["flowMax"] >= flowId)
+        if start is not None:
+            match &= self.index["timeMax"] >= int(start * 1e6)
+        if end is not None:
+            match &= self.index["timeMin"] <= int(end * 1e6)
+        return np.flatnonzero(match)
+
+    def read_block(self, block : int, fields : list = None) -> tuple:
+        """Return `fields` (all if None) of the records of `block` and their OSS data, read in place if not compressed."""
+
+        entry = self.index[block]
+        offset, size, count = int(entry["offset"]), int(entry["size"]), int(entry["count"])
+
+        # mapping starts on a page boundary
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(self.file.fileno(), offset + size - aligned, access=mmap.ACCESS_READ, offset=aligned)
+        buf = memoryview(mapped)[offset - aligned:]
+
+        # blocks of older archives have fewer columns, the missing ones are zeros
+        nbColumns = BLOCK_HEADER.unpack_from(buf)[3]
+        lengths = struct.unpack_from(f"<{nbColumns}Q", buf, BLOCK_HEADER.size)
+        position = BLOCK_HEADER.size + 8 * nbColumns
+        names = [*ARCHIVE_DTYPE.names[:nbColumns - 1], OSS_COLUMN]
+        columns = {name: np.zeros(count, dtype=ARCHIVE_DTYPE[name]) for name in ARCHIVE_DTYPE.names[nbColumns - 1:]
+                   if fields is None or name in fields}
+        for name, length in zip(names, lengths):
+            if fields is None or name in fields or (name == OSS_COLUMN and "ossLen" in fields):
+                data = buf[position:position + length]
+                if entry["flags"] & FLAG_ZLIB:
+                    data = zlib.decompress(data)
+                dtype = ARCHIVE_DTYPE[name] if name != OSS_COLUMN else np.dtype(np.uint8)
+                columns[name] = np.frombuffer(data, dtype=dtype, count=count if name != OSS_COLUMN else -1)
+            position += length + padding(length)
+
+        oss = columns.pop(OSS_COLUMN, np.empty(0, dtype=np.uint8))
+        return columns, oss
+
+    def schemas(self) -> dict:
+        """Return reference -> schema ID and OSS data of the schemas interned in the archive."""
+
+        return read_schemas(self.path + SCHEMAS_SUFFIX)
+
+    def query(self, flowId : int = None, start : float = None, end : float = None, fields : list = None) -> tuple:
+        """
+        Return records (`fields` of `ARCHIVE_DTYPE`, all if None) of `flowId` between `start` and `end` (in seconds).
+
+        Return also the OSS data of the records, at `ossOffset` if `ossLen` is part of `fields`.
+        """
+
+        names = list(ARCHIVE_DTYPE.names) if fields is None else [f for f in ARCHIVE_DTYPE.names if f in fields]
+        needed = set(names) | {f for f, v in (("flowId", flowId), ("time", start if start is not None else end)) if v is not None}
+        if "ossLen" in names:
+            needed.add("ossLen")
+
+        dtype = [(name, ARCHIVE_DTYPE[name]) for name in names] + ([("ossOffset", "<u8")] if "ossLen" in names else [])
+        parts = []
+        ossParts = []
+        ossSize = 0
+        for block in self.select(flowId, start, end):
+            columns, oss = self.read_block(block, needed)
+            count = int(self.index[block]["count"])
+            match = np.ones(count, dtype=bool)
+            if flowId is not None:
+                match &= columns["flowId"] == flowId
+            if start is not None:
+                match &= columns["time"] >= int(start * 1e6)
+            if end is not None:
+                match &= columns["time"] <= int(end * 1e6)
+
+            selected = np.flatnonzero(match)
+            records = np.empty(len(selected), dtype=dtype)
+            for name in names:
+                records[name] = columns[name][selected]
+
+            if "ossLen" in names:
+                lengths = columns["ossLen"].astype(np.int64)
+                starts = np.cumsum(lengths) - lengths
+                lengths, starts = lengths[selected], starts[selected]
+                total = int(lengths.sum())
+                ossEnds = np.cumsum(lengths)
+                records["ossOffset"] = ossSize + ossEnds - lengths
+                ossParts.append(oss[np.repeat(starts - (ossEnds - lengths), lengths) + np.arange(total)])
+                ossSize += total
+
+            parts.append(records)
+
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        oss = np.concatenate(ossParts) if ossParts else np.empty(0, dtype=np.uint8)
+        return records, oss
+
+def parse_window(window : str) -> tuple:
+    """Return start and end of time window `window`, e.g. 1700000000:1700000060. Either can be empty."""
+
+    start, end = window.split(":")
+    return float(start) if start else None, float(end) if end else None
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="archive",
+        description="Archive DEX events and query the archive",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("archive", type=str, help="Archive")
+    parser.add_argument("-r", type=str, required=False, default=None, help="Append the events of a recording to the archive")
+    parser.add_argument("-z", type=int, required=False, default=COMPRESSION, help="zlib level of the columns, 0 for no compression")
+    parser.add_argument("-n", type=int, required=False, default=BLOCK_RECORDS, help="Maximum number of records of a block")
+    parser.add_argument("-d", action="store_true", help="Intern the OSS schemas")
+    parser.add_argument("-f", type=int, required=False, default=None, help="Flow ID of the records")
+    parser.add_argument("-t", type=str, required=False, default=":", help="Time window of the records, <start>:<end> in seconds")
+    args = parser.parse_args()
+
+    if args.z < 0 or args.z > 9:
+        print("<level> must be between 0 and 9")
+        sys.exit(-1)
+
+    if args.n <= 0:
+        print("<block_records> cannot be <= 0")
+        sys.exit(-1)
+
+    try:
+        window = parse_window(args.t)
+    except ValueError:
+        print(f"Invalid time window {args.t}, expected <start>:<end>")
+        sys.exit(-1)
+
+    return args.archive, args.r, args.z, args.n, args.d, args.f, window
+
+if __name__ == "__main__":
+    path, recording, level, blockRecords, dedup, flowId, (start, end) = check_arguments()
+
+    try:
+        if recording is not None:
+            writer = Writer(path, level, blockRecords, dedup)
+            batch = events.Batch()
+            for evts in events.replay(recording, batch):
+                writer.append(evts, batch)
+            writer.close()
+            print(f"Appended {writer.records} records in {writer.blocks} blocks")
+            if writer.schemas is not None:
+                print(schemas.format_stats(writer.schemas.stats()))
+            sys.exit(0)
+
+        reader = Reader(path)
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot open archive {path}: {e}")
+        sys.exit(-1)
+
+    blocks = reader.select(flowId, start, end)
+    records, oss = reader.query(flowId, start, end)
+    print(f"{len(records)} records in {len(blocks)} of {len(reader.index)} blocks, {len(oss)} bytes of OSS data")
+    for record in records[:10]:
+        print("  " + " ".join(f"{k}={record[k]}" for k in ARCHIVE_DTYPE.names))
+
+    reader.close()
+    sys.exit(0)
@@ -0,0 +1,312 @@
+"""
+Usage: python3 bench.py [-s <stage> ...] [-c <corpus> ...] [-b <batch_size>] [-n <nb_batches>] [-t <threshold>] [-o <history>] [-d]
+
+Benchmark the user space data path of DEX, offline, on synthetic events.
+
+For each corpus (trace type and extension flags, see `CORPORA`), batches of
+netlink messages are built as the kernel would send them, with the decode
+plans of `events.py`, and each stage processes them:
+- decode: decoding of the messages into events (`events.py`);
+- ipfix: encoding of the events into IPFIX messages (`ipfix.py`);
+- collect: decoding of these messages by the collector (`collector.py`);
+- flows: tracking of the sequence numbers of the flows (`flows.py`);
+- archive: appending the events to an archive (`archive.py`);
+- summary: statistics on the runs of the evaluation (`evaluation/summary.py`),
+  if pandas and scipy are installed.
+
+For each stage and corpus, the records per second, the latency percentiles
+of a batch and the peak of the bytes allocated to process a batch are
+measured. Results are appended to a history (`-o`, one JSON line per run),
+unless `-d`, and compared to the median of the last `BASELINE_RUNS` runs of
+the same machine and versions: the benchmark fails if the rate dropped, or
+the allocations grew, by more than the threshold `-t`.
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+
+import events
+import flows
+import ipfix
+import collector
+import archive
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# events of a batch
+BATCH_SIZE = 16384
+
+# batches measured for each stage and corpus, after a warm-up one
+NB_BATCHES = 20
+
+# relative regression of the rate or the allocations failing the benchmark
+THRESHOLD = 0.20
+
+# runs of the history the results are compared to
+BASELINE_RUNS = 5
+
+# history of the results
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bench", "history.jsonl")
+
+# number of flows of the synthetic events
+NB_FLOWS = 64
+
+# length of the OSS data of the corpora with OSS
+OSS_LEN = 8
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# name -> trace type, extension flags, OSS data
+CORPORA = {
+    "0x800000_NO_EXT": (0x800000, 0x00, False),
+    "0x800000_FLOW": (0x800000, events.EXT_FLAG_FLOW_ID, False),
+    "0x800000_FLOW_SEQ": (0x800000, events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM, False),
+    "0xf00000_FLOW_SEQ": (0xF00000, events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM, False),
+    "0x00e000_FLOW_SEQ": (0x00E000, events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM, False),
+    "0xfff002_FLOW_SEQ_OSS": (0xFFF002, events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM, True),
+}
+
+STAGES = ["decode", "ipfix", "collect", "flows", "archive", "summary"]
+
+# latency percentiles of a batch
+PERCENTILES = [50, 90, 99]
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def synthetic_batch(traceType : int, extFlags : int, oss : bool, size : int = BATCH_SIZE, seed : int = 0) -> events.Batch:
+    """Return batch of `size` messages, as sent by the kernel, with events of `NB_FLOWS` flows."""
+
+    plan = events.compile_plan(traceType, extFlags, OSS_LEN if oss else None)
+    rng = np.random.default_rng(seed)
+
+    # headers of the message, unavailable fields as set by the kernel
+    template = bytearray(plan.size)
+    struct.pack_into("=IHHII", template, 0, plan.size, 0, 0, 0, 0)
+    struct.pack_into("=BBH", template, events.NLMSGHDR_SIZE, events.IOAM6_EVENT_DEX, 1, 0)
+    for (attrType, offset, length), header in zip(plan.layout, plan.signature[1:]):
+        struct.pack_into("=I", template, offset - events.NLA_HDR_SIZE, int(header))
+        if attrType - events.IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID in events.UNAVAILABLE_BITS:
+            struct.pack_into("=I", template, offset, events.IOAM6_U32_UNAVAILABLE)
+        elif attrType == events.IOAM6_EVENT_ATTR_DEX_OSS_DATA:
+            template[offset:offset + length] = rng.integers(0, 256, length, dtype=np.uint8).tobytes()
+
+    raw = np.zeros((size, plan.stride), dtype=np.uint8)
+    raw[:, :4] = np.frombuffer(struct.pack("=I", plan.size), dtype=np.uint8)
+    raw[:, 4:4 + plan.size] = np.frombuffer(bytes(template), dtype=np.uint8)
+
+    records = np.ndarray(size, dtype=plan.dtype, buffer=raw, offset=4, strides=(plan.stride,))
+    index = np.arange(size)
+    for field in plan.dtype.names:
+        if field == "optionType":
+            records[field] = 2
+        elif field == "namespace":
+            records[field] = 123
+        elif field == "flowId":
+            records[field] = index % NB_FLOWS
+        elif field == "seqNum":
+            records[field] = index // NB_FLOWS + 1
+        else:
+            records[field] = rng.integers(0, np.iinfo(records.dtype[field]).max, size, dtype=records.dtype[field].newbyteorder("="))
+
+    batch = events.Batch(size)
+    batch.buffer[:raw.size] = raw.tobytes()
+    batch.starts[:size] = 4 + index * plan.stride
+    batch.count = size
+    batch.end = raw.size
+    return batch
+
+def synthetic_runs(size : int, seed : int = 0):
+    """Return `size` runs of the results store, for the summary stage."""
+
+    import pandas
+
+    rng = np.random.default_rng(seed)
+    return pandas.DataFrame({
+        "experiment": pandas.Categorical(rng.choice(["encap/data/data", "transit/data", "decap/data"], size)),
+        "freq": rng.choice([10**-5, 10**-3, 0.1, 1.0], size),
+        "traceType": rng.choice([0x800000, 0x400000, 0x8000], size).astype(np.uint32),
+        "pps": rng.normal(10**6, 10**4, size),
+    })
+
+def stages(batch : events.Batch, extFlags : int, tmpDir : str) -> dict:
+    """Return function processing `batch` and number of records it processes, for each stage."""
+
+    evts = events.decode(batch).copy()
+    exporter = ipfix.Exporter()
+    table = flows.FlowTable()
+    messages = [memoryview(m) for m in ipfix.Exporter().encode(evts, batch)]
+    receiver = collector.Collector()
+    writer = archive.Writer(os.path.join(tmpDir, "bench.dexa"), blockRecords=len(evts))
+
+    result = {
+        "decode": (lambda: events.decode(batch), len(evts)),
+        "ipfix": (lambda: exporter.encode(evts, batch), len(evts)),
+        "archive": (lambda: writer.append(evts, batch), len(evts)),
+    }
+
+    def collect():
+        for message in messages:
+            receiver.feed(message)
+        receiver.drain()
+    result["collect"] = (collect, len(evts))
+
+    # flows and sequence numbers are needed to track the flows
+    if extFlags == flows.EXT_FLAGS:
+        def track():
+            evts["seqNum"] += len(evts) // NB_FLOWS
+            table.update(evts, now=0)
+        result["flows"] = (track, len(evts))
+
+    try:
+        import summary
+        runs = synthetic_runs(len(evts))
+        result["summary"] = (lambda: summary.summarize(runs, ["experiment", "freq", "traceType"]), len(runs))
+    except ImportError:
+        pass
+
+    return result
+
+def measure(function, nbRecords : int, nbBatches : int = NB_BATCHES) -> dict:
+    """Return rate (records per second), latency percentiles (microseconds) and bytes allocated of `function`."""
+
+    function()
+    latencies = np.empty(nbBatches, dtype=np.int64)
+    for i in range(nbBatches):
+        start = time.perf_counter_ns()
+        function()
+        latencies[i] = time.perf_counter_ns() - start
+
+    # allocations are traced apart, tracing slows down the stage
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    function()
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    result = {"rate": nbRecords * nbBatches / (latencies.sum() / 1e9)}
+    result.update({f"p{p}": float(np.percentile(latencies, p) / 1e3) for p in PERCENTILES})
+    result["allocated"] = int(allocated)
+    return result
+
+def environment() -> dict:
+    """Return machine and versions the results are compared within."""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {
+        "machine": platform.node(), "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(), "numpy": np.__version__, "commit": commit,
+    }
+
+def read_history(path : str) -> list:
+    """Return previous runs in history at `path`."""
+
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+def regressions(results : dict, history : list, env : dict, batchSize : int, threshold : float) -> list:
+    """Return (benchmark, metric, baseline, value) of `results` worse than the baseline by more than `threshold`."""
+
+    same = [run for run in history if all(run["env"][k] == env[k] for k in ["machine", "processor", "python", "numpy"])
+            and run["batchSize"] == batchSize]
+    previous = same[-BASELINE_RUNS:]
+
+    found = []
+    for name, result in results.items():
+        rates = [run["results"][name]["rate"] for run in previous if name in run["results"]]
+        allocs = [run["results"][name]["allocated"] for run in previous if name in run["results"]]
+        if not rates:
+            continue
+        baseline = float(np.median(rates))
+        if result["rate"] < baseline * (1 - threshold):
+            found.append((name, "rate", baseline, result["rate"]))
+        baseline = float(np.median(allocs))
+        if result["allocated"] > baseline * (1 + threshold) and result["allocated"] - baseline > 4096:
+            found.append((name, "allocated", baseline, result["allocated"]))
+    return found
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="bench",
+        description="Benchmark the user space data path of DEX",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-s", type=str, nargs="+", required=False, default=STAGES, choices=STAGES, help="Stages")
+    parser.add_argument("-c", type=str, nargs="+", required=False, default=list(CORPORA), choices=list(CORPORA), help="Corpora")
+    parser.add_argument("-b", type=int, required=False, default=BATCH_SIZE, help="Events of a batch")
+    parser.add_argument("-n", type=int, required=False, default=NB_BATCHES, help="Batches measured")
+    parser.add_argument("-t", type=float, required=False, default=THRESHOLD, help="Relative regression failing the benchmark")
+    parser.add_argument("-o", type=str, required=False, default=HISTORY_FILE, help="History of the results")
+    parser.add_argument("-d", action="store_true", help="Do not append the results to the history")
+    args = parser.parse_args()
+
+    if args.b <= 0 or args.n <= 0:
+        print("<batch_size> and <nb_batches> cannot be <= 0")
+        sys.exit(-1)
+
+    if args.t <= 0:
+        print("<threshold> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.s, args.c, args.b, args.n, args.t, args.o, args.d
+
+if __name__ == "__main__":
+    selected, corpora, batchSize, nbBatches, threshold, historyFile, dryRun = check_arguments()
+
+    # statistics of the evaluation
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation"))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for corpus in corpora:
+            traceType, extFlags, oss = CORPORA[corpus]
+            batch = synthetic_batch(traceType, extFlags, oss, batchSize)
+            available = stages(batch, extFlags, tmpDir)
+            for stage in selected:
+                # summary does not depend on the corpus
+                if stage not in available or (stage == "summary" and corpus != corpora[0]):
+                    continue
+                name = f"{stage}/{corpus}" if stage != "summary" else stage
+                results[name] = measure(*available[stage], nbBatches)
+                r = results[name]
+                print(f"{name:<36} {r['rate']:>12,.0f} records/s  "
+                      + " ".join(f"p{p}={r[f'p{p}']:.0f}us" for p in PERCENTILES) + f"  allocated={r['allocated']:,}B")
+
+    env = environment()
+    history = read_history(historyFile)
+    found = regressions(results, history, env, batchSize, threshold)
+
+    if not dryRun:
+        os.makedirs(os.path.dirname(os.path.abspath(historyFile)), exist_ok=True)
+        with open(historyFile, "a") as f:
+            f.write(json.dumps({"time": time.time(), "env": env, "batchSize": batchSize, "results": results}) + "\n")
+
+    for name, metric, baseline, value in found:
+        print(f"REGRESSION {name}: {metric} {value:,.0f} vs {baseline:,.0f}")
+
+    sys.exit(1 if found else 0)
@@ -0,0 +1,585 @@
+"""
+Usage: python3 capture.py <capture> [-f <k/n>] [-n <max_flows>] [-w <output>] [-b <chunk_size>]
+
+Offline analysis of the IOAM DEX options in a capture (pcap or pcapng), e.g.
+of millions of packets at the egress of the DUT during a test.
+
+The capture is memory-mapped and processed by chunks of `-b` packets, so that
+memory is bounded whatever the size of the capture:
+- the records are located by following their headers; runs of records of the
+  same length, as sent by TRex, are located at once with NumPy;
+- in each chunk, the IPv6 Hop-by-Hop options of all packets are walked in
+  parallel (one option per step) to find the IOAM option (0x31) of type DEX;
+- the DEX headers (namespace, extension flags, trace type, Flow ID and
+  Sequence Number) are decoded into a structured array (`PACKET_DTYPE`);
+- pages of the capture already processed are released.
+
+The sequence numbers of each flow are checked with `FlowTable` (see
+`flows.py`), and the ratio of DEX packets among the IPv6 packets is compared
+to the frequency `-f` of the route (k/n). The kernel adds DEX to the first k
+packets of every n, so the lengths of the bursts of DEX packets and of the
+gaps between them are also checked against k and n - k. The DEX packets can
+be written to `-w` as raw `PACKET_DTYPE` records, e.g. read with
+`numpy.fromfile`.
+
+Supported link types: Ethernet (with a VLAN tag) and raw IPv6.
+"""
+
+import sys
+import mmap
+import struct
+import argparse
+import collections
+import numpy as np
+
+import events
+import flows
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# number of packets of a chunk, about 100 MB of the capture with MTU packets
+CHUNK_PACKETS = 1 << 16
+
+# maximum number of options walked in a Hop-by-Hop header
+MAX_OPTIONS = 8
+
+# records of the same length in a row before they are located at once, and
+# maximum number of records located at once
+RUN_MIN = 4
+RUN_MAX = 1 << 16
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# pcap: magic -> resolution of the timestamps
+PCAP_MAGICS = {0xA1B2C3D4: 1e-6, 0xA1B23C4D: 1e-9}
+PCAP_HEADER_LEN = 24
+PCAP_RECORD_LEN = 16
+
+# pcapng
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_EPB_LEN = 28
+PCAPNG_OPT_TSRESOL = 9
+
+# link types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_IPV6 = 229
+
+ETH_TYPE_IPV6 = 0x86DD
+ETH_TYPES_VLAN = (0x8100, 0x88A8)
+
+IPV6_HEADER_LEN = 40
+NH_HOP_BY_HOP = 0
+
+# IOAM option and DEX header
+IOAM_OPTION_TYPE = 0x31
+IOAM_DEX = 4
+PAD1 = 0
+IOAM_HEADER_LEN = 4
+DEX_HEADER_LEN = 8
+
+# decoded DEX packets, `index` is the position of the packet among the IPv6 packets of the capture
+PACKET_DTYPE = np.dtype([
+    ("index", "u8"), ("time", "f8"), ("length", "u4"),
+    ("namespace", "u2"), ("extFlags", "u1"), ("traceType", "u4"), ("flowId", "u4"), ("seqNum", "u4"),
+])
+
+# records of a chunk: offset of the data, captured and original lengths, time and link type of each packet
+Records = collections.namedtuple("Records", ["data", "caplen", "wirelen", "time", "linktype"])
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def read_uint(buf : np.ndarray, offsets : np.ndarray, size : int, big : bool = True) -> np.ndarray:
+    """Return unsigned integers of `size` bytes at `offsets` of `buf`."""
+
+    value = np.zeros(len(offsets), dtype=np.uint64)
+    for i in range(size):
+        byte = buf[offsets + (i if big else size - 1 - i)].astype(np.uint64)
+        value = (value << np.uint64(8)) | byte
+    return value
+
+class Capture:
+    """Memory-mapped pcap or pcapng file, read by chunks of records."""
+
+    def __init__(self, path : str) -> None:
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.mm, "madvise"):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.buf = np.frombuffer(self.mm, dtype=np.uint8)
+        self.size = len(self.mm)
+        self.skipped = 0
+        self.truncated = False
+
+        if self.size < 4:
+            raise RuntimeError(f"{path} is not a capture")
+
+        magic = self.mm[:4]
+        if struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+            self.format = "pcapng"
+        elif struct.unpack("<I", magic)[0] in PCAP_MAGICS or struct.unpack(">I", magic)[0] in PCAP_MAGICS:
+            self.format = "pcap"
+        else:
+            raise RuntimeError(f"{path} is neither a pcap nor a pcapng file")
+
+    def close(self):
+        # the view on the map must be released first
+        self.buf = None
+        self.mm.close()
+        self.file.close()
+
+    def release(self, end : int):
+        """Release the pages of the capture before `end`, already processed."""
+
+        end -= end % mmap.PAGESIZE
+        if end > 0 and hasattr(self.mm, "madvise"):
+            self.mm.madvise(mmap.MADV_DONTNEED, 0, end)
+
+    def run_length(self, pos : int, stride : int, fields : np.ndarray, limit : int) -> int:
+        """Return number of records from `pos`, at most `limit`, of `stride` bytes with the same `fields` bytes."""
+
+        n = min(limit, (self.size - pos) // stride)
+        candidates = pos + stride * np.arange(n)
+        same = np.all(self.buf[candidates[:, None] + fields] == self.buf[pos + fields], axis=1)
+        return n if same.all() else int(np.argmin(same))
+
+    def walk(self, pos : int, limit : int, header, fields : np.ndarray) -> tuple:
+        """
+        Return offsets of at most `limit` records from `pos` and the position after them.
+
+        `header(pos)` returns the length of the record at `pos` and whether it is a packet,
+        or None at the end. Records with the same `fields` bytes have the same length.
+        """
+
+        offsets, scalar = [], []
+        count, window, last, repeated = 0, RUN_MIN, None, 0
+
+        while count < limit:
+            record = header(pos)
+            if record is None:
+                break
+            length, isPacket = record
+
+            repeated = repeated + 1 if isPacket and length == last else 0
+            last = length if isPacket else None
+
+            if repeated >= RUN_MIN:
+                # packets of the same length in a row, located at once
+                wanted = min(window, limit - count)
+                n = self.run_length(pos, length, fields, wanted)
+                if scalar:
+                    offsets.append(np.array(scalar, dtype=np.int64))
+                    scalar = []
+                offsets.append(pos + length * np.arange(n, dtype=np.int64))
+                count += n
+                pos += n * length
+
+                # longer runs while the lengths stay the same
+                if n == wanted:
+                    window = min(2 * window, RUN_MAX)
+                else:
+                    window, last, repeated = RUN_MIN, None, 0
+                continue
+
+            if isPacket:
+                scalar.append(pos)
+                count += 1
+            pos += length
+
+        if scalar:
+            offsets.append(np.array(scalar, dtype=np.int64))
+        return (np.concatenate(offsets) if offsets else np.empty(0, dtype=np.int64)), pos
+
+    def chunks(self, size : int = CHUNK_PACKETS):
+        """Yield `Records` of at most `size` packets."""
+
+        if self.format == "pcap":
+            yield from self.pcap_chunks(size)
+        else:
+            yield from self.pcapng_chunks(size)
+
+    def pcap_chunks(self, size : int):
+        big = struct.unpack(">I", self.mm[:4])[0] in PCAP_MAGICS
+        order = ">" if big else "<"
+        resolution = PCAP_MAGICS[struct.unpack(order + "I", self.mm[:4])[0]]
+        linktype = struct.unpack_from(order + "I", self.mm, 20)[0] & 0xFFFF
+
+        def header(pos):
+            if pos + PCAP_RECORD_LEN > self.size:
+                return None
+            length = PCAP_RECORD_LEN + struct.unpack_from(order + "I", self.mm, pos + 8)[0]
+            if pos + length > self.size:
+                self.truncated = True
+                return None
+            return length, True
+
+        fields = np.arange(8, 12)
+        pos = PCAP_HEADER_LEN
+        while True:
+            offsets, pos = self.walk(pos, size, header, fields)
+            if len(offsets) == 0:
+                return
+
+            seconds = read_uint(self.buf, offsets, 4, big).astype(np.float64)
+            fraction = read_uint(self.buf, offsets + 4, 4, big).astype(np.float64)
+            yield Records(
+                offsets + PCAP_RECORD_LEN,
+                read_uint(self.buf, offsets + 8, 4, big).astype(np.int64),
+                read_uint(self.buf, offsets + 12, 4, big).astype(np.int64),
+                seconds + fraction * resolution,
+                np.full(len(offsets), linktype, dtype=np.int64),
+            )
+            self.release(pos)
+
+    def pcapng_chunks(self, size : int):
+        section = {"start": 0, "order": "<", "interfaces": []}
+
+        def header(pos):
+            if pos + 12 > self.size:
+                return None
+
+            # the type of the section header is the same in both byte orders
+            blockType = struct.unpack_from(section["order"] + "I", self.mm, pos)[0]
+            if blockType == PCAPNG_SHB:
+                if pos != section["start"]:
+                    # chunks are in a single section
+                    section["next"] = pos
+                    return None
+
+                # new section, with its own byte order and interfaces
+                magic = struct.unpack_from("<I", self.mm, pos + 8)[0]
+                section["order"] = "<" if magic == PCAPNG_BYTE_ORDER_MAGIC else ">"
+                section["interfaces"] = []
+
+            order = section["order"]
+
+            length = struct.unpack_from(order + "I", self.mm, pos + 4)[0]
+            if length < 12 or pos + length > self.size:
+                self.truncated = True
+                return None
+
+            if blockType == PCAPNG_IDB:
+                section["interfaces"].append(self.interface(pos, length, order))
+            elif blockType == PCAPNG_EPB:
+                return length, True
+            elif blockType != PCAPNG_SHB:
+                self.skipped += 1
+            return length, False
+
+        fields = np.arange(0, 12)
+        pos = 0
+        while True:
+            offsets, pos = self.walk(pos, size, header, fields)
+            big = section["order"] == ">"
+
+            if len(offsets):
+                interfaces = np.array(section["interfaces"] or [(LINKTYPE_ETHERNET, 1e-6)], dtype=np.float64)
+                iface = np.minimum(read_uint(self.buf, offsets + 8, 4, big).astype(np.int64), len(interfaces) - 1)
+                ticks = (read_uint(self.buf, offsets + 12, 4, big) << np.uint64(32)) | read_uint(self.buf, offsets + 16, 4, big)
+                yield Records(
+                    offsets + PCAPNG_EPB_LEN,
+                    read_uint(self.buf, offsets + 20, 4, big).astype(np.int64),
+                    read_uint(self.buf, offsets + 24, 4, big).astype(np.int64),
+                    ticks.astype(np.float64) * interfaces[iface, 1],
+                    interfaces[iface, 0].astype(np.int64),
+                )
+                self.release(pos)
+
+            if "next" in section:
+                section["start"] = section.pop("next")
+            elif len(offsets) == 0:
+                return
+
+    def interface(self, pos : int, length : int, order : str) -> tuple:
+        """Return link type and resolution of the timestamps of the interface described at `pos`."""
+
+        linktype = struct.unpack_from(order + "H", self.mm, pos + 8)[0]
+        resolution = 1e-6
+
+        # options after the link type, reserved and snaplen
+        opt, end = pos + 16, pos + length - 4
+        while opt + 4 <= end:
+            code, optLen = struct.unpack_from(order + "HH", self.mm, opt)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_TSRESOL and optLen >= 1:
+                value = self.mm[opt + 4]
+                resolution = 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+            opt += 4 + optLen + (-optLen % 4)
+
+        return linktype, resolution
+
+def decode(buf : np.ndarray, records : Records, base : int = 0) -> tuple:
+    """
+    Return DEX packets of `records` (`PACKET_DTYPE`), number of IPv6 packets and of truncated DEX options.
+
+    `base` is the number of IPv6 packets before the records.
+    """
+
+    last = len(buf) - 1
+    end = records.data + records.caplen
+
+    def byte(offsets):
+        return buf[np.minimum(offsets, last)].astype(np.int64)
+
+    # network header after Ethernet (and a VLAN tag), or directly
+    ethernet = records.linktype == LINKTYPE_ETHERNET
+    etherType = (byte(records.data + 12) << 8) | byte(records.data + 13)
+    vlan = ethernet & np.isin(etherType, ETH_TYPES_VLAN)
+    etherType = np.where(vlan, (byte(records.data + 16) << 8) | byte(records.data + 17), etherType)
+    ip = records.data + np.where(ethernet, np.where(vlan, 18, 14), 0)
+
+    raw = np.isin(records.linktype, (LINKTYPE_RAW, LINKTYPE_IPV6))
+    isIpv6 = ((ethernet & (etherType == ETH_TYPE_IPV6)) | raw) & (ip + IPV6_HEADER_LEN <= end)
+    isIpv6 &= (byte(ip) >> 4) == 6
+
+    # options of the Hop-by-Hop headers, walked in parallel
+    hbh = ip + IPV6_HEADER_LEN
+    candidates = np.flatnonzero(isIpv6 & (byte(ip + 6) == NH_HOP_BY_HOP) & (hbh + 8 <= end))
+    cursor = hbh[candidates] + 2
+    optEnd = np.minimum(hbh[candidates] + (byte(hbh[candidates] + 1) + 1) * 8, end[candidates])
+
+    found = np.full(len(candidates), -1, dtype=np.int64)
+    pending = np.arange(len(candidates))
+    for _ in range(MAX_OPTIONS):
+        pending = pending[cursor[pending] + 2 <= optEnd[pending]]
+        if len(pending) == 0:
+            break
+
+        optType = byte(cursor[pending])
+        isDex = (optType == IOAM_OPTION_TYPE) & (byte(cursor[pending] + 3) == IOAM_DEX)
+        found[pending[isDex]] = cursor[pending[isDex]]
+
+        pending, optType = pending[~isDex], optType[~isDex]
+        cursor[pending] += np.where(optType == PAD1, 1, 2 + byte(cursor[pending] + 1))
+
+    hit = found >= 0
+    packets, opt = candidates[hit], found[hit]
+
+    # DEX header, then Flow ID and Sequence Number if present
+    extFlags = byte(opt + 7)
+    hasFlow = (extFlags & events.EXT_FLAG_FLOW_ID) != 0
+    hasSeq = (extFlags & events.EXT_FLAG_SEQ_NUM) != 0
+    optLen = IOAM_HEADER_LEN + DEX_HEADER_LEN + 4 * (hasFlow.astype(np.int64) + hasSeq)
+    complete = (opt + optLen <= end[packets]) & (byte(opt + 1) + 2 >= optLen)
+
+    packets, opt, extFlags, hasFlow, hasSeq = packets[complete], opt[complete], extFlags[complete], hasFlow[complete], hasSeq[complete]
+    dex = np.zeros(len(packets), dtype=PACKET_DTYPE)
+    dex["index"] = base + np.cumsum(isIpv6)[packets] - 1
+    dex["time"] = records.time[packets]
+    dex["length"] = records.wirelen[packets]
+    dex["namespace"] = read_uint(buf, opt + 4, 2)
+    dex["extFlags"] = extFlags
+    dex["traceType"] = read_uint(buf, opt + 8, 3)
+    data = opt + IOAM_HEADER_LEN + DEX_HEADER_LEN
+    dex["flowId"] = np.where(hasFlow, read_uint(buf, np.minimum(data, last - 3), 4), 0)
+    dex["seqNum"] = np.where(hasSeq, read_uint(buf, np.minimum(data + 4 * hasFlow, last - 3), 4), 0)
+
+    return dex, int(isIpv6.sum()), int((~complete).sum())
+
+class Bursts:
+    """Lengths of the bursts of consecutive DEX packets and of the gaps between them, over consecutive batches."""
+
+    def __init__(self, freq : tuple = None) -> None:
+        """`freq` is the (k, n) frequency of the route, if known."""
+
+        self.freq = freq
+        self.last = None
+        self.current = 0
+        self.first = True
+        self.stats = {name: {"count": 0, "sum": 0, "min": None, "max": None, "conforming": 0} for name in ("burst", "gap")}
+
+    def account(self, name : str, lengths : np.ndarray, expected : int = None):
+        """Account `lengths` of bursts or gaps (`name`), conforming if equal to `expected`."""
+
+        if len(lengths) == 0:
+            return
+
+        stats = self.stats[name]
+        stats["count"] += len(lengths)
+        stats["sum"] += int(lengths.sum())
+        stats["min"] = int(lengths.min()) if stats["min"] is None else min(stats["min"], int(lengths.min()))
+        stats["max"] = int(lengths.max()) if stats["max"] is None else max(stats["max"], int(lengths.max()))
+        if expected is not None:
+            stats["conforming"] += int((lengths == expected).sum())
+
+    def update(self, indices : np.ndarray):
+        """Account DEX packets at `indices` (increasing) among the IPv6 packets."""
+
+        if len(indices) == 0:
+            return
+
+        indices = indices.astype(np.int64)
+        previous = np.empty(len(indices), dtype=np.int64)
+        previous[1:] = indices[:-1]
+        previous[0] = indices[0] - 1 if self.last is None else self.last
+
+        # bursts start after a gap of non DEX packets
+        starts = np.flatnonzero(indices - previous != 1)
+        gaps = indices[starts] - previous[starts] - 1
+
+        # the burst in progress ends at the first start, the last one goes on
+        lengths = np.diff(np.append(starts, len(indices)))
+        if len(starts):
+            ended = np.append(self.current + starts[0], lengths[:-1])
+            # the first burst of the capture may be partial
+            if self.first:
+                ended = ended[1:]
+            self.current = int(lengths[-1])
+        else:
+            ended = np.empty(0, dtype=np.int64)
+            self.current += len(indices)
+
+        k, n = self.freq if self.freq is not None else (None, None)
+        self.account("burst", ended, k)
+        self.account("gap", gaps, n - k if n is not None else None)
+        self.first &= len(starts) == 0
+        self.last = int(indices[-1])
+
+    def totals(self) -> dict:
+        """Return number, mean, min, max and fraction conforming to the frequency of the bursts and gaps."""
+
+        totals = {}
+        for name, stats in self.stats.items():
+            count = stats["count"]
+            totals[f"{name}s"] = count
+            totals[f"{name}Mean"] = f"{stats['sum'] / count:.3f}" if count else None
+            totals[f"{name}Min"] = stats["min"]
+            totals[f"{name}Max"] = stats["max"]
+            if self.freq is not None:
+                totals[f"{name}Conforming"] = f"{stats['conforming'] / count:.6f}" if count else None
+        return totals
+
+class Analysis:
+    """Counters, injection ratio, bursts and per-flow sequence numbers of the DEX packets of a capture."""
+
+    def __init__(self, freq : tuple = None, maxFlows : int = flows.MAX_FLOWS) -> None:
+        """`freq` is the (k, n) frequency of the route, if known."""
+
+        self.freq = freq
+        self.table = flows.FlowTable(maxFlows, idleTimeout=np.inf)
+        self.bursts = Bursts(freq)
+        self.packets = 0
+        self.ipv6 = 0
+        self.dex = 0
+        self.truncated = 0
+        self.evicted = collections.Counter()
+
+    def update(self, records : Records, dex : np.ndarray, nbIpv6 : int, nbTruncated : int):
+        self.packets += len(records.data)
+        self.ipv6 += nbIpv6
+        self.dex += len(dex)
+        self.truncated += nbTruncated
+
+        if len(dex):
+            self.bursts.update(dex["index"])
+            evicted = self.table.update(dex, now=float(dex["time"][-1]))
+            for name in ("received", "lost", "reordered", "duplicates", "late"):
+                self.evicted[name] += int(evicted[name].sum())
+
+    def injection(self) -> tuple:
+        """Return ratio of DEX packets among the IPv6 packets, and whether it matches the frequency."""
+
+        ratio = self.dex / self.ipv6 if self.ipv6 else 0.0
+        if self.freq is None:
+            return ratio, None
+
+        # k of every n packets carry DEX, whatever the first packet of the capture
+        k, n = self.freq
+        return ratio, abs(self.dex - self.ipv6 * k / n) <= k
+
+    def totals(self) -> dict:
+        """Return counters of the capture and of the flows, including the evicted flows."""
+
+        totals = self.table.totals()
+        for name, value in self.evicted.items():
+            totals[name] += value
+
+        ratio, matches = self.injection()
+        return {
+            "packets": self.packets, "ipv6": self.ipv6, "dex": self.dex, "truncated": self.truncated,
+            "ratio": f"{ratio:.6f}", **({"expected": f"{self.freq[0] / self.freq[1]:.6f}", "matches": matches} if self.freq else {}),
+            **totals, **self.bursts.totals(),
+        }
+
+def analyze(path : str, freq : tuple = None, maxFlows : int = flows.MAX_FLOWS, output : str = None,
+            chunkSize : int = CHUNK_PACKETS) -> Analysis:
+    """Analyze capture in `path`, writing the DEX packets to `output` if given."""
+
+    capture = Capture(path)
+    analysis = Analysis(freq, maxFlows)
+    out = open(output, "wb") if output is not None else None
+
+    try:
+        for records in capture.chunks(chunkSize):
+            dex, nbIpv6, nbTruncated = decode(capture.buf, records, analysis.ipv6)
+            analysis.update(records, dex, nbIpv6, nbTruncated)
+            if out is not None:
+                dex.tofile(out)
+    finally:
+        if out is not None:
+            out.close()
+        if capture.truncated:
+            print(f"Capture {path} is truncated")
+        capture.close()
+
+    return analysis
+
+def parse_freq(freq : str) -> tuple:
+    """Return (k, n) of frequency `freq`, e.g. 1/100."""
+
+    k, n = (int(x) for x in freq.split("/"))
+    if k <= 0 or n < k:
+        raise ValueError(f"Invalid frequency {freq}")
+    return k, n
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="capture",
+        description="Analyze the DEX packets of a capture",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("capture", type=str, help="pcap or pcapng file")
+    parser.add_argument("-f", type=str, required=False, default=None, help="Frequency k/n of the route")
+    parser.add_argument("-n", type=int, required=False, default=flows.MAX_FLOWS, help="Maximum number of flows")
+    parser.add_argument("-w", type=str, required=False, default=None, help="Write the DEX packets to a file")
+    parser.add_argument("-b", type=int, required=False, default=CHUNK_PACKETS, help="Number of packets of a chunk")
+    args = parser.parse_args()
+
+    try:
+        freq = parse_freq(args.f) if args.f is not None else None
+    except ValueError:
+        print(f"Invalid frequency {args.f}, expected k/n with 0 < k <= n")
+        sys.exit(-1)
+
+    if args.n <= 0 or args.b <= 0:
+        print("<max_flows> and <chunk_size> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.capture, freq, args.n, args.w, args.b
+
+if __name__ == "__main__":
+    path, freq, maxFlows, output, chunkSize = check_arguments()
+
+    try:
+        analysis = analyze(path, freq, maxFlows, output, chunkSize)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Cannot analyze {path}: {e}")
+        sys.exit(-1)
+
+    print(" ".join(f"{k}={v}" for k, v in analysis.totals().items()))
+    flows.print_lossy(analysis.table)
+    sys.exit(0)
@@ -0,0 +1,511 @@
+"""
+Usage: python3 collector.py [-l <port>] [-p udp|tcp] [-x <elements>]
+       python3 collector.py -t <duration> [-p udp|tcp] [-c <corpus>] [-b <batch_size>]
+
+IPFIX collector (RFC 7011) understanding the enterprise information elements
+of `ioam_dex.xml`, standing in for ipfixcol2 to test the exporters on a
+single machine.
+
+Messages are received over UDP or TCP with asyncio. On UDP, all datagrams
+waiting in the socket are read at once (up to `RECV_BATCH`, as recvmmsg
+would) into a reused buffer. On TCP, the stream is read by chunks and split
+into messages.
+
+Templates are cached per observation domain. Each data set is decoded at once
+into a NumPy structured array (network byte order): records of fixed length
+are a view of the set, as are records whose variable-length element (e.g. the
+OSS data) is the last one and has the same length in all records of the set.
+Records are gathered per template in columnar batches (`Columns`). Lost
+records are counted from the sequence numbers of the messages. The schemas
+interned by the exporter (see `schemas.py`), sent as options records, are
+kept per observation domain to resolve the `IOAM_OSS_REF` of the records.
+
+With `-t`, the throughput of the exporter of `ipfix.py` to the collector is
+measured on the loopback: synthetic events of the corpus `-c` (see
+`bench.py`) are encoded once, then sent as fast as possible by another
+process for `-t` seconds.
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ET
+import numpy as np
+
+import ipfix
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# port the collector listens on
+PORT = 4739
+
+# maximum number of datagrams read at once
+RECV_BATCH = 64
+
+# size of the receive buffer of the socket
+RCVBUF = 1 << 25
+
+# size of the chunks read on TCP
+STREAM_CHUNK = 1 << 20
+
+# period of the statistics, in seconds
+STATS_INTERVAL = 1
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+FIRST_DATA_SET_ID = 256
+
+# maximum size of a message
+MAX_MESSAGE = 65535
+
+# half of the sequence numbers, larger differences are reordered messages
+SEQ_HALF = 1 << 31
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def load_definitions(path : str = ipfix.ELEMENTS_FILE) -> tuple:
+    """Return PEN and elements (id -> name, data type) defined in the XML file at `path`."""
+
+    root = ET.parse(path).getroot()
+    pen = int(root.find("scope/pen").text)
+    elements = {int(e.find("id").text): (e.find("name").text, e.find("dataType").text) for e in root.findall("element")}
+
+    return pen, elements
+
+def field_dtype(dataType : str, length : int) -> str:
+    """Return dtype of an element of fixed `length` in the records."""
+
+    if dataType != "string" and length in (1, 2, 4, 8):
+        return f">u{length}"
+    return f"S{length}" if dataType == "string" else f"V{length}"
+
+class Template:
+    """Records of a template, decoded at once with NumPy."""
+
+    def __init__(self, templateId : int, specifiers : list, pen : int, elements : dict) -> None:
+        self.templateId = templateId
+        self.specifiers = specifiers
+        self.names = []
+        self.lengths = []
+        for id, length, enterprise in specifiers:
+            if enterprise == pen and id in elements:
+                name, dataType = elements[id]
+            else:
+                name, dataType = f"{enterprise}:{id}" if enterprise else str(id), "octetArray"
+            self.names.append(name)
+            self.lengths.append((length, dataType))
+
+        # fixed elements before the variable-length one, if any
+        variable = [i for i, (length, _) in enumerate(self.lengths) if length == ipfix.VARIABLE_LENGTH]
+        self.variable = self.names[variable[0]] if variable else None
+        last = variable[0] if variable else len(self.names)
+        self.general = len(variable) > 1 or (variable and variable[0] != len(self.names) - 1)
+        self.dtype = np.dtype([(name, field_dtype(dataType, length)) for name, (length, dataType) in zip(self.names[:last], self.lengths[:last])])
+        self.minSize = self.dtype.itemsize + (1 if variable else 0)
+
+        # options records of the schemas interned by the exporter
+        self.schemas = self.names == [ipfix.OSS_REF_ELEMENT, ipfix.OSS_ELEMENT]
+
+    def decode(self, data : memoryview) -> tuple:
+        """Decode records of a data set. Return records of the fixed elements, then lengths and data of the variable-length one."""
+
+        if self.variable is None:
+            count = len(data) // self.dtype.itemsize if self.dtype.itemsize else 0
+            return np.frombuffer(data, dtype=self.dtype, count=count).copy(), None, None
+
+        if self.general:
+            raise RuntimeError(f"Template {self.templateId} has variable-length elements before the last one")
+
+        raw = np.frombuffer(data, dtype=np.uint8)
+        prefix = self.dtype.itemsize
+        if len(raw) < self.minSize:
+            return np.empty(0, dtype=self.dtype), np.empty(0, dtype=np.uint16), np.empty(0, dtype=np.uint8)
+
+        # records of the same length are a view, as packed by the exporter
+        header, length = (3, int.from_bytes(raw[prefix + 1:prefix + 3], "big")) if raw[prefix] == ipfix.LONG_LENGTH else (1, int(raw[prefix]))
+        recordLen = prefix + header + length
+        count = len(raw) // recordLen
+        if len(raw) - count * recordLen < self.minSize:
+            lengthDtype = [("len", "u1")] if header == 1 else [("len", "u1"), ("longLen", ">u2")]
+            full = np.frombuffer(data, dtype=[("fixed", self.dtype), *lengthDtype, ("data", "u1", (length,))], count=count)
+            same = full["len"] == length if header == 1 else (full["len"] == ipfix.LONG_LENGTH) & (full["longLen"] == length)
+            if same.all():
+                return full["fixed"].copy(), np.full(count, length, dtype=np.uint16), full["data"].reshape(-1).copy()
+
+        # records of different lengths are walked
+        offsets, lengths, starts = [], [], []
+        offset = 0
+        while offset + self.minSize <= len(raw):
+            pos = offset + prefix
+            if raw[pos] == ipfix.LONG_LENGTH:
+                header, length = 3, int.from_bytes(raw[pos + 1:pos + 3], "big")
+            else:
+                header, length = 1, int(raw[pos])
+            if pos + header + length > len(raw):
+                break
+            offsets.append(offset)
+            starts.append(pos + header)
+            lengths.append(length)
+            offset = pos + header + length
+
+        offsets = np.array(offsets, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.uint16)
+        records = np.zeros(len(offsets), dtype=self.dtype)
+        if prefix:
+            records = raw[offsets[:, None] + np.arange(prefix)].view(self.dtype).reshape(-1)
+        index = np.repeat(np.array(starts, dtype=np.int64) - np.cumsum(lengths, dtype=np.int64) + lengths, lengths) + np.arange(int(lengths.sum()))
+        return records, lengths, raw[index]
+
+class Columns:
+    """Records of a template received since the last drain."""
+
+    def __init__(self, template : Template) -> None:
+        self.template = template
+        self.records = []
+        self.lengths = []
+        self.data = []
+        self.count = 0
+
+    def append(self, records : np.ndarray, lengths : np.ndarray, data : np.ndarray):
+        self.records.append(records)
+        if lengths is not None:
+            self.lengths.append(lengths)
+            self.data.append(data)
+        self.count += len(records)
+
+    def arrays(self) -> dict:
+        """Return element name -> column. The variable-length element is (lengths, offsets, data)."""
+
+        records = np.concatenate(self.records) if self.records else np.empty(0, dtype=self.template.dtype)
+        result = {name: records[name].astype(records.dtype[name].newbyteorder("=")) for name in records.dtype.names}
+        if self.template.variable is not None:
+            lengths = np.concatenate(self.lengths) if self.lengths else np.empty(0, dtype=np.uint16)
+            offsets = np.cumsum(lengths, dtype=np.uint64) - lengths
+            result[self.template.variable] = (lengths, offsets, np.concatenate(self.data) if self.data else np.empty(0, dtype=np.uint8))
+        return result
+
+class Collector:
+    """Decode IPFIX messages into columnar batches per template."""
+
+    def __init__(self, elementsFile : str = ipfix.ELEMENTS_FILE, keep : bool = True) -> None:
+        self.pen, self.elements = load_definitions(elementsFile)
+        self.keep = keep
+        self.templates = {}
+        self.schemas = {}
+        self.columns = {}
+        self.expected = {}
+        self.messages = 0
+        self.records = 0
+        self.bytes = 0
+        self.lost = 0
+        self.reordered = 0
+        self.unknown = 0
+        self.malformed = 0
+
+    def feed(self, message : memoryview):
+        """Decode a message."""
+
+        if len(message) < ipfix.MESSAGE_HEADER.size:
+            self.malformed += 1
+            return
+        version, length, _, seq, domain = ipfix.MESSAGE_HEADER.unpack_from(message)
+        if version != ipfix.IPFIX_VERSION or length > len(message):
+            self.malformed += 1
+            return
+
+        self.messages += 1
+        self.bytes += length
+        nbRecords = 0
+
+        offset = ipfix.MESSAGE_HEADER.size
+        while offset + ipfix.SET_HEADER.size <= length:
+            setId, setLen = ipfix.SET_HEADER.unpack_from(message, offset)
+            if setLen < ipfix.SET_HEADER.size or offset + setLen > length:
+                self.malformed += 1
+                break
+            data = message[offset + ipfix.SET_HEADER.size:offset + setLen]
+
+            if setId in (ipfix.TEMPLATE_SET_ID, ipfix.OPTIONS_TEMPLATE_SET_ID):
+                self.parse_templates(domain, data, setId == ipfix.OPTIONS_TEMPLATE_SET_ID)
+            elif setId >= FIRST_DATA_SET_ID:
+                template = self.templates.get((domain, setId))
+                if template is None:
+                    self.unknown += 1
+                else:
+                    records, lengths, varData = template.decode(data)
+                    nbRecords += len(records)
+                    if template.schemas:
+                        self.add_schemas(domain, records, lengths, varData)
+                    if self.keep:
+                        self.columns.setdefault((domain, setId), Columns(template)).append(records, lengths, varData)
+            offset += setLen
+
+        self.records += nbRecords
+        self.check_sequence(domain, seq, nbRecords)
+
+    def parse_templates(self, domain : int, data : memoryview, options : bool = False):
+        """Cache templates of a template set, or of an options template set if `options`."""
+
+        header = 6 if options else 4
+        offset = 0
+        while offset + header <= len(data):
+            templateId, nbFields = struct.unpack_from("!HH", data, offset)
+            offset += header
+            specifiers = []
+            for _ in range(nbFields):
+                id, length = struct.unpack_from("!HH", data, offset)
+                offset += 4
+                enterprise = 0
+                if id & ipfix.ENTERPRISE_BIT:
+                    enterprise = struct.unpack_from("!I", data, offset)[0]
+                    offset += 4
+                specifiers.append((id & ~ipfix.ENTERPRISE_BIT, length, enterprise))
+
+            # a template with the same id replaces the previous one
+            key = (domain, templateId)
+            if key in self.columns and self.columns[key].template.specifiers != specifiers:
+                self.columns.pop(key)
+            self.templates[key] = Template(templateId, specifiers, self.pen, self.elements)
+
+    def add_schemas(self, domain : int, records : np.ndarray, lengths : np.ndarray, data : np.ndarray):
+        """Keep schemas of options records: reference, then schema ID and OSS data."""
+
+        offsets = np.cumsum(lengths, dtype=np.int64) - lengths
+        for ref, offset, length in zip(records[ipfix.OSS_REF_ELEMENT], offsets, lengths):
+            blob = data[offset:offset + length].tobytes()
+            self.schemas[(domain, int(ref))] = (int.from_bytes(blob[:4], "big"), blob[4:])
+
+    def check_sequence(self, domain : int, seq : int, nbRecords : int):
+        """Count lost records, the sequence number being the number of records sent before the message."""
+
+        expected = self.expected.get(domain)
+        if expected is not None:
+            diff = (seq - expected) & 0xFFFFFFFF
+            if diff >= SEQ_HALF:
+                self.reordered += 1
+                return
+            self.lost += diff
+        self.expected[domain] = (seq + nbRecords) & 0xFFFFFFFF
+
+    def drain(self) -> dict:
+        """Return (observation domain, template id) -> columns of the records received since the last drain."""
+
+        result = {key: columns.arrays() for key, columns in self.columns.items() if columns.count}
+        self.columns = {}
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages, "records": self.records, "bytes": self.bytes, "templates": len(self.templates), "schemas": len(self.schemas),
+            "lost": self.lost, "reordered": self.reordered, "unknown": self.unknown, "malformed": self.malformed,
+        }
+
+class DatagramReader:
+    """Read all datagrams waiting in a UDP socket at once."""
+
+    def __init__(self, sock : socket.socket, collector : Collector) -> None:
+        self.sock = sock
+        self.collector = collector
+        self.buffer = bytearray(RECV_BATCH * MAX_MESSAGE)
+        self.view = memoryview(self.buffer)
+
+    def readable(self):
+        lengths = []
+        offset = 0
+        for _ in range(RECV_BATCH):
+            try:
+                size = self.sock.recv_into(self.view[offset:offset + MAX_MESSAGE])
+            except (BlockingIOError, InterruptedError):
+                break
+            lengths.append((offset, size))
+            offset += MAX_MESSAGE
+
+        for offset, size in lengths:
+            self.collector.feed(self.view[offset:offset + size])
+
+def udp_socket(port : int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    sock.bind(("::", port))
+    sock.setblocking(False)
+    return sock
+
+async def handle_stream(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, collector : Collector):
+    """Split the stream of an exporter into messages."""
+
+    pending = bytearray()
+    try:
+        while True:
+            chunk = await reader.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            pending += chunk
+
+            view = memoryview(pending)
+            offset = 0
+            while offset + ipfix.MESSAGE_HEADER.size <= len(pending):
+                length = struct.unpack_from("!H", pending, offset + 2)[0]
+                if length < ipfix.MESSAGE_HEADER.size:
+                    collector.malformed += 1
+                    return
+                if offset + length > len(pending):
+                    break
+                collector.feed(view[offset:offset + length])
+                offset += length
+            view.release()
+            del pending[:offset]
+    finally:
+        writer.close()
+
+async def serve(collector : Collector, port : int = PORT, protocol : str = "udp", duration : float = None, report = None):
+    """Run `collector` on `port` for `duration` seconds (forever if None), calling `report` every `STATS_INTERVAL`."""
+
+    loop = asyncio.get_running_loop()
+    if protocol == "udp":
+        sock = udp_socket(port)
+        loop.add_reader(sock.fileno(), DatagramReader(sock, collector).readable)
+    else:
+        server = await asyncio.start_server(lambda r, w: handle_stream(r, w, collector), host="::", port=port)
+
+    try:
+        end = loop.time() + duration if duration is not None else None
+        while end is None or loop.time() < end:
+            await asyncio.sleep(STATS_INTERVAL if end is None else min(STATS_INTERVAL, max(end - loop.time(), 0)))
+            if report is not None:
+                report(collector)
+    finally:
+        if protocol == "udp":
+            loop.remove_reader(sock.fileno())
+            sock.close()
+        else:
+            server.close()
+            await server.wait_closed()
+
+def send(messages : list, counts : list, port : int, protocol : str, duration : float, ready, result):
+    """Send `messages` (with `counts` records) to the collector on the loopback, in a loop for `duration` seconds."""
+
+    ready.wait()
+    if protocol == "udp":
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.connect(("::1", port))
+    else:
+        sock = socket.create_connection(("::1", port))
+
+    messages = [bytearray(m) for m in messages]
+    seq = 0
+    nbRecords = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for message, count in zip(messages, counts):
+            struct.pack_into("!I", message, 8, seq)
+            seq = (seq + count) & 0xFFFFFFFF
+            if protocol == "udp":
+                try:
+                    sock.send(message)
+                except OSError:
+                    continue
+            else:
+                sock.sendall(message)
+            nbRecords += count
+    sock.close()
+    result.put(nbRecords)
+
+def throughput(duration : float, protocol : str = "udp", corpus : str = None, batchSize : int = None, port : int = PORT) -> dict:
+    """Measure the records per second sent by the exporter and received by the collector, on the loopback."""
+
+    import bench
+    import events
+
+    traceType, extFlags, oss = bench.CORPORA[corpus or next(iter(bench.CORPORA))]
+    batch = bench.synthetic_batch(traceType, extFlags, oss, batchSize or bench.BATCH_SIZE)
+    exporter = ipfix.Exporter()
+    messages = exporter.encode(events.decode(batch), batch)
+
+    # records of each message, from the sequence numbers
+    seqs = [ipfix.MESSAGE_HEADER.unpack_from(m)[3] for m in messages] + [exporter.seq]
+    counts = [(b - a) & 0xFFFFFFFF for a, b in zip(seqs, seqs[1:])]
+
+    collector = Collector(keep=False)
+    ready = multiprocessing.Event()
+    result = multiprocessing.Queue()
+    sender = multiprocessing.Process(target=send, args=(messages, counts, port, protocol, duration, ready, result))
+    sender.start()
+
+    async def run():
+        task = asyncio.create_task(serve(collector, port, protocol, duration + 1))
+        await asyncio.sleep(0.2)
+        ready.set()
+        await task
+    start = time.monotonic()
+    asyncio.run(run())
+    elapsed = time.monotonic() - start - 0.2
+    sent = result.get()
+    sender.join()
+
+    stats = collector.stats()
+    stats.update({"sent": sent, "sentRate": sent / duration, "receivedRate": stats["records"] / min(elapsed, duration),
+                  "loss": 1 - stats["records"] / sent if sent else 0.0})
+    return stats
+
+def print_stats(collector : Collector):
+    stats = collector.stats()
+    collector.drain()
+    print(" ".join(f"{k}={v}" for k, v in stats.items()))
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="collector",
+        description="Collect IPFIX messages of DEX events",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-l", type=int, required=False, default=PORT, help="Port to listen on")
+    parser.add_argument("-p", type=str, required=False, default="udp", choices=["udp", "tcp"], help="Transport")
+    parser.add_argument("-x", type=str, required=False, default=ipfix.ELEMENTS_FILE, help="Definitions of the information elements")
+    parser.add_argument("-t", type=float, required=False, default=None, help="Measure throughput on the loopback for given seconds")
+    parser.add_argument("-c", type=str, required=False, default=None, help="Corpus of the throughput test (see bench.py)")
+    parser.add_argument("-b", type=int, required=False, default=None, help="Events encoded for the throughput test")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.x):
+        print(f"File {args.x} does not exist")
+        sys.exit(-1)
+
+    if args.t is not None and args.t <= 0:
+        print("<duration> cannot be <= 0")
+        sys.exit(-1)
+
+    if args.b is not None and args.b <= 0:
+        print("<batch_size> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.l, args.p, args.x, args.t, args.c, args.b
+
+if __name__ == "__main__":
+    port, protocol, elementsFile, duration, corpus, batchSize = check_arguments()
+
+    if duration is not None:
+        stats = throughput(duration, protocol, corpus, batchSize, port)
+        print(f"sent={stats['sentRate']:.0f} records/s received={stats['receivedRate']:.0f} records/s loss={stats['loss']:.2%}")
+        print(" ".join(f"{k}={stats[k]}" for k in ["messages", "records", "lost", "reordered", "unknown", "malformed"]))
+        sys.exit(0)
+
+    try:
+        asyncio.run(serve(Collector(elementsFile), port, protocol, report=print_stats))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
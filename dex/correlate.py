@@ -0,0 +1,336 @@
+"""
+Usage: python3 correlate.py [-w <window>] [-n <nb_nodes>] [-s <slice>] <archive> [<archive> ...]
+
+Correlate the DEX records exported by several nodes, to rebuild the path of
+each packet and the one-way delay of each hop.
+
+Records of the same packet share the namespace, Flow ID and Sequence Number
+of the DEX header (see `flows.py`). They are joined, in the order of their
+hop limit (bit 0 of the trace type, decremented by each hop), with their
+node ID (bits 0 or 8) and timestamp (bits 2 and 3, with synchronized clocks).
+
+Records wait in a bounded window: a packet is emitted once seen by `-n`
+nodes, or once older than the window `-w` (in seconds, in the time of the
+records). Memory is thus proportional to the window, not to the stream, and
+at most `MAX_PENDING` records wait. All records of a batch are joined at once
+with NumPy. For each packet, the engine emits:
+- its path, the nodes in the order of the hop limit;
+- the one-way delay of each hop between two consecutive exporting nodes;
+- missing hops, when the hop limit decreases by more than one between two
+  consecutive records, or when fewer than `-n` nodes exported the packet.
+
+The archives (see `archive.py`) of the nodes are read by time slices of `-s`
+seconds, only mapping the blocks of the slice.
+"""
+
+import sys
+import argparse
+import numpy as np
+
+import flows
+import archive
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# time records of a packet wait for the other nodes, in seconds
+WINDOW = 1.0
+
+# maximum number of records waiting, the oldest packets are emitted first beyond
+MAX_PENDING = 1 << 22
+
+# time slices of the archives read at once, in seconds
+SLICE = 1.0
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# records of the nodes, time in microseconds
+RECORD_DTYPE = np.dtype([
+    ("namespace", "u2"), ("flowId", "u4"), ("seqNum", "u4"),
+    ("node", "u8"), ("hopLimit", "u1"), ("time", "u8"), ("hasTime", "?"),
+])
+
+# packets, with their path in `nodes[pathStart:pathStart + pathLen]`
+PACKET_DTYPE = np.dtype([
+    ("namespace", "u2"), ("flowId", "u4"), ("seqNum", "u4"),
+    ("pathStart", "u8"), ("pathLen", "u4"), ("missing", "u4"), ("delay", "f8"),
+])
+
+# hops between two consecutive exporting nodes, delay in microseconds (NaN without timestamps)
+HOP_DTYPE = np.dtype([
+    ("namespace", "u2"), ("flowId", "u4"), ("seqNum", "u4"),
+    ("src", "u8"), ("dst", "u8"), ("delay", "f8"), ("missing", "u4"),
+])
+
+# unknown node of a missing hop
+NO_NODE = np.uint64(2**64 - 1)
+
+# bits of the trace type
+TRACE_TYPE_HOP_LIM_NODE_ID = 0x800000
+TRACE_TYPE_HOP_LIM_NODE_ID_WIDE = 0x008000
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def from_events(evts : np.ndarray, now : float = None) -> np.ndarray:
+    """Return records (`RECORD_DTYPE`) of decoded `evts`, see `events.py`. Events without timestamp are at `now` (seconds)."""
+
+    records = np.zeros(len(evts), dtype=RECORD_DTYPE)
+    for field in ["namespace", "flowId", "seqNum"]:
+        records[field] = evts[field]
+
+    wide = (evts["traceType"] & TRACE_TYPE_HOP_LIM_NODE_ID_WIDE) != 0
+    records["node"] = np.where(wide, evts["hopLimNodeIdWide"] & np.uint64(2**56 - 1), evts["hopLimNodeId"] & 0xFFFFFF)
+    records["hopLimit"] = np.where(wide, evts["hopLimNodeIdWide"] >> np.uint64(56), evts["hopLimNodeId"] >> 24)
+
+    records["hasTime"] = (evts["traceType"] & archive.TRACE_TYPE_TIMESTAMP) != 0
+    hasFrac = (evts["traceType"] & archive.TRACE_TYPE_TIMESTAMP_FRAC) != 0
+    timestamp = evts["timestamp"].astype(np.uint64) * np.uint64(10**6) + np.where(hasFrac, evts["timestampFrac"], 0).astype(np.uint64)
+    records["time"] = np.where(records["hasTime"], timestamp, np.uint64(int((now or 0) * 1e6)))
+    return records
+
+def from_archive(records : np.ndarray) -> np.ndarray:
+    """Return records (`RECORD_DTYPE`) of records of an archive (`archive.ARCHIVE_DTYPE`)."""
+
+    result = np.zeros(len(records), dtype=RECORD_DTYPE)
+    for field in ["namespace", "flowId", "seqNum", "time"]:
+        result[field] = records[field]
+    # wide node IDs are zero in blocks archived before they were kept
+    wide = (records["traceType"] & TRACE_TYPE_HOP_LIM_NODE_ID_WIDE) != 0
+    result["node"] = np.where(wide, records["hopLimNodeIdWide"] & np.uint64(2**56 - 1), records["hopLimNodeId"] & 0xFFFFFF)
+    result["hopLimit"] = np.where(wide, records["hopLimNodeIdWide"] >> np.uint64(56), records["hopLimNodeId"] >> 24)
+    result["hasTime"] = (records["traceType"] & archive.TRACE_TYPE_TIMESTAMP) != 0
+    return result
+
+class Correlation:
+    """Packets, their paths, hops and missing hops emitted by `Correlator`."""
+
+    def __init__(self, packets : np.ndarray, nodes : np.ndarray, hops : np.ndarray, missing : np.ndarray) -> None:
+        self.packets = packets
+        self.nodes = nodes
+        self.hops = hops
+        self.missing = missing
+
+    def path(self, packet : int) -> np.ndarray:
+        """Return nodes of the path of `packet`."""
+
+        start = int(self.packets["pathStart"][packet])
+        return self.nodes[start:start + int(self.packets["pathLen"][packet])]
+
+    @staticmethod
+    def concatenate(correlations : list) -> "Correlation":
+        offsets = np.cumsum([0] + [len(c.nodes) for c in correlations[:-1]], dtype=np.uint64)
+        packets = []
+        for c, offset in zip(correlations, offsets):
+            p = c.packets.copy()
+            p["pathStart"] += offset
+            packets.append(p)
+        return Correlation(np.concatenate(packets) if packets else np.empty(0, dtype=PACKET_DTYPE),
+                           np.concatenate([c.nodes for c in correlations]) if correlations else np.empty(0, dtype=np.uint64),
+                           np.concatenate([c.hops for c in correlations]) if correlations else np.empty(0, dtype=HOP_DTYPE),
+                           np.concatenate([c.missing for c in correlations]) if correlations else np.empty(0, dtype=HOP_DTYPE))
+
+def join(records : np.ndarray, nbNodes : int = None) -> Correlation:
+    """Join `records`, sorted by packet and decreasing hop limit, into packets, hops and missing hops."""
+
+    first = packet_starts(records)
+    starts = np.flatnonzero(first)
+    lengths = np.diff(np.append(starts, len(records)))
+    group = np.cumsum(first) - 1
+
+    # hops between consecutive records of a packet
+    pairs = np.flatnonzero(~first[1:])
+    src, dst = records[pairs], records[pairs + 1]
+    gaps = src["hopLimit"].astype(np.int64) - dst["hopLimit"].astype(np.int64)
+    hops = np.zeros(len(pairs), dtype=HOP_DTYPE)
+    for field in ["namespace", "flowId", "seqNum"]:
+        hops[field] = src[field]
+    hops["src"] = src["node"]
+    hops["dst"] = dst["node"]
+    hops["missing"] = np.maximum(gaps - 1, 0)
+    hops["delay"] = np.where(src["hasTime"] & dst["hasTime"], dst["time"].astype(np.float64) - src["time"].astype(np.float64), np.nan)
+
+    packets = np.zeros(len(starts), dtype=PACKET_DTYPE)
+    for field in ["namespace", "flowId", "seqNum"]:
+        packets[field] = records[field][starts]
+    packets["pathStart"] = starts
+    packets["pathLen"] = lengths
+    gapMissing = np.bincount(group[pairs], weights=hops["missing"], minlength=len(starts)).astype(np.int64)
+    missing = gapMissing
+    if nbNodes is not None:
+        missing = np.maximum(gapMissing, nbNodes - lengths)
+    packets["missing"] = missing
+    ends = starts + lengths - 1
+    timed = records["hasTime"][starts] & records["hasTime"][ends]
+    packets["delay"] = np.where(timed, records["time"][ends].astype(np.float64) - records["time"][starts].astype(np.float64), np.nan)
+
+    # missing hops found by the hop limit, then missing nodes after the last record
+    lost = hops[hops["missing"] > 0]
+    shortage = np.flatnonzero(missing > gapMissing)
+    tail = np.zeros(len(shortage), dtype=HOP_DTYPE)
+    for field in ["namespace", "flowId", "seqNum"]:
+        tail[field] = packets[field][shortage]
+    tail["src"] = records["node"][ends[shortage]]
+    tail["dst"] = NO_NODE
+    tail["delay"] = np.nan
+    tail["missing"] = (missing - gapMissing)[shortage]
+
+    return Correlation(packets, records["node"].copy(), hops, np.concatenate([lost, tail]))
+
+def packet_starts(records : np.ndarray) -> np.ndarray:
+    """Return mask of the first record of each packet in sorted `records`."""
+
+    first = flows.segment_starts(flows.flow_keys(records["namespace"], records["flowId"]))
+    first[1:] |= records["seqNum"][1:] != records["seqNum"][:-1]
+    return first
+
+def sort_records(records : np.ndarray) -> np.ndarray:
+    """Return `records` sorted by packet and decreasing hop limit."""
+
+    order = np.lexsort((-records["hopLimit"].astype(np.int16), records["seqNum"], records["flowId"], records["namespace"]))
+    return records[order]
+
+class Correlator:
+    """Join the records of the nodes in a bounded window."""
+
+    def __init__(self, window : float = WINDOW, nbNodes : int = None, maxPending : int = MAX_PENDING) -> None:
+        self.window = int(window * 1e6)
+        self.nbNodes = nbNodes
+        self.maxPending = maxPending
+        self.pending = np.empty(0, dtype=RECORD_DTYPE)
+        self.now = 0
+        self.packets = 0
+        self.incomplete = 0
+
+    def update(self, records : np.ndarray) -> Correlation:
+        """Add `records` of any node and return the packets complete or out of the window."""
+
+        if len(records):
+            self.now = max(self.now, int(records["time"].max()))
+            records = np.concatenate([self.pending, records])
+        else:
+            records = self.pending
+        records = sort_records(records)
+
+        first = packet_starts(records)
+        starts = np.flatnonzero(first)
+        lengths = np.diff(np.append(starts, len(records)))
+        firstTime = np.minimum.reduceat(records["time"], starts) if len(starts) else np.empty(0, dtype=np.uint64)
+
+        done = firstTime.astype(np.int64) < self.now - self.window
+        if self.nbNodes is not None:
+            done |= lengths >= self.nbNodes
+
+        # oldest packets are emitted when too many records wait
+        waiting = int(lengths[~done].sum())
+        if waiting > self.maxPending:
+            candidates = np.flatnonzero(~done)
+            oldest = candidates[np.argsort(firstTime[candidates], kind="stable")]
+            freed = np.cumsum(lengths[oldest])
+            done[oldest[:np.searchsorted(freed, waiting - self.maxPending) + 1]] = True
+
+        emitted = np.repeat(done, lengths)
+        self.pending = records[~emitted]
+        return self.emit(records[emitted])
+
+    def flush(self) -> Correlation:
+        """Return all waiting packets."""
+
+        records = sort_records(self.pending)
+        self.pending = np.empty(0, dtype=RECORD_DTYPE)
+        return self.emit(records)
+
+    def emit(self, records : np.ndarray) -> Correlation:
+        correlation = join(records, self.nbNodes)
+        self.packets += len(correlation.packets)
+        self.incomplete += int((correlation.packets["missing"] > 0).sum())
+        return correlation
+
+def read_archives(paths : list, sliceSize : float = SLICE):
+    """Yield records (`RECORD_DTYPE`) of all archives at `paths`, by time slices of `sliceSize` seconds."""
+
+    readers = [archive.Reader(path) for path in paths]
+    try:
+        indexes = [r.index for r in readers if len(r.index)]
+        if not indexes:
+            return
+        start = min(int(i["timeMin"].min()) for i in indexes)
+        end = max(int(i["timeMax"].max()) for i in indexes)
+        step = int(sliceSize * 1e6)
+
+        fields = ["time", "namespace", "flowId", "seqNum", "hopLimNodeId", "hopLimNodeIdWide", "traceType"]
+        for sliceStart in range(start, end + 1, step):
+            # bounds of the query are inclusive
+            parts = [r.query(start=sliceStart / 1e6, end=(sliceStart + step - 1) / 1e6, fields=fields)[0] for r in readers]
+            parts = [p[(p["time"] >= sliceStart) & (p["time"] < sliceStart + step)] for p in parts]
+            yield from_archive(np.concatenate(parts))
+    finally:
+        for r in readers:
+            r.close()
+
+def print_summary(correlations : Correlation, correlator : Correlator):
+    """Print packets, delays of the hops between each pair of nodes and missing hops."""
+
+    print(f"packets={correlator.packets} incomplete={correlator.incomplete} "
+          f"hops={len(correlations.hops)} missing={int(correlations.missing['missing'].sum())}")
+
+    hops = correlations.hops
+    if len(hops):
+        pairs, inverse = np.unique(np.stack([hops["src"], hops["dst"]], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for i, (src, dst) in enumerate(pairs):
+            delays = hops["delay"][inverse == i]
+            delays = delays[~np.isnan(delays)]
+            stats = f" delay p50={np.percentile(delays, 50):.1f}us p99={np.percentile(delays, 99):.1f}us" if len(delays) else ""
+            print(f"  {src:#x} -> {dst:#x}: {int((inverse == i).sum())} packets{stats}")
+
+    missing = correlations.missing
+    if len(missing):
+        after, counts = np.unique(missing["src"], return_counts=True)
+        for node, count in zip(after, counts):
+            print(f"  missing hops after {node:#x}: {count} packets")
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="correlate",
+        description="Rebuild paths and one-way delays from the DEX records of several nodes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("archives", type=str, nargs="+", help="Archives of the nodes")
+    parser.add_argument("-w", type=float, required=False, default=WINDOW, help="Time records of a packet wait for the other nodes, in seconds")
+    parser.add_argument("-n", type=int, required=False, default=None, help="Number of exporting nodes on the path")
+    parser.add_argument("-s", type=float, required=False, default=SLICE, help="Time slices of the archives read at once, in seconds")
+    args = parser.parse_args()
+
+    if args.w <= 0 or args.s <= 0:
+        print("<window> and <slice> cannot be <= 0")
+        sys.exit(-1)
+
+    if args.n is not None and args.n <= 0:
+        print("<nb_nodes> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.archives, args.w, args.n, args.s
+
+if __name__ == "__main__":
+    paths, window, nbNodes, sliceSize = check_arguments()
+    correlator = Correlator(window, nbNodes)
+
+    correlations = []
+    try:
+        for records in read_archives(paths, sliceSize):
+            correlations.append(correlator.update(records))
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot read archives: {e}")
+        sys.exit(-1)
+    correlations.append(correlator.flush())
+
+    print_summary(Correlation.concatenate(correlations), correlator)
+    sys.exit(0)
@@ -0,0 +1,447 @@
+"""
+Usage: python3 enrich.py [-c <config>] [-n] [-r <recording>]
+
+Enrich the DEX events (see `events.py`) with the names of their raw
+identifiers: node ID (bits 0 and 8 of the trace type), namespace ID, ingress
+and egress interface IDs (bits 1 and 9), namespace data and wide namespace
+data (bits 5 and 10).
+
+The names are held in memory in tables sorted by identifier, loaded from:
+- a static configuration (`-c`, JSON), e.g. for tests or for the other nodes:
+  {"nodes": {"1": "dut"}, "namespaces": {"123": "dex"},
+   "namespaceData": {"123": {"data": "0x1234", "wide": "0x12345678"}},
+   "interfaces": {"1": {"2": "ens6f1"}, "*": {"3": "lo"}}}
+  with the data and wide data of the namespaces (both optional), and the
+  interfaces per node ID, or for all nodes ("*");
+- the kernel, unless `-n`: the namespaces and their data (`ip ioam namespace
+  add 123 data 0x1234 wide 0x12345678`) dumped from the IOAM6 generic netlink
+  family, and the IOAM IDs of the node and of its interfaces (sysctl
+  `ioam6_id` and `ioam6_id_wide`) with the names of the links dumped with
+  rtnetlink.
+
+All events of a batch are joined at once with the tables (`np.searchsorted`),
+giving for each identifier the index of its name (-1 if unknown). The tables
+are only loaded again on events: links added, removed or renamed (rtnetlink
+notifications), configuration modified, or unknown namespaces in the events,
+at most every `MISS_REFRESH` seconds, as the kernel does not notify changes
+of the namespaces.
+
+With `-r`, the events of a recording are enriched and the number of events
+per name is printed. Otherwise, the tables are printed.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import numpy as np
+
+import events
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# minimum time between two loads of the tables caused by unknown namespaces, in seconds
+MISS_REFRESH = 10
+
+# sysctl of the IOAM IDs
+SYSCTL_DIR = "/proc/sys/net/ipv6"
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# linux/netlink.h
+NETLINK_ROUTE = 0
+NLM_F_DUMP = 0x300
+NLMSG_DONE = 3
+
+# linux/rtnetlink.h and linux/if_link.h
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTMGRP_LINK = 0x1
+IFLA_IFNAME = 3
+IFINFOMSG = struct.Struct("=BxHiII")
+
+# linux/ioam6_genl.h
+IOAM6_CMD_DUMP_NAMESPACES = 3
+IOAM6_ATTR_NS_ID = 1
+IOAM6_ATTR_NS_DATA = 2
+IOAM6_ATTR_NS_DATA_WIDE = 3
+
+# bits of the trace type
+TRACE_TYPE_HOP_LIM_NODE_ID = 0x800000
+TRACE_TYPE_INTERFACES = 0x400000
+TRACE_TYPE_NAMESPACE_DATA = 0x040000
+TRACE_TYPE_HOP_LIM_NODE_ID_WIDE = 0x008000
+TRACE_TYPE_INTERFACES_WIDE = 0x004000
+TRACE_TYPE_NAMESPACE_DATA_WIDE = 0x002000
+
+# index of the unknown identifiers
+UNKNOWN = -1
+
+# node of the interfaces of all nodes, above the node IDs (at most 56 bits)
+ALL_NODES = 2**64 - 1
+
+# names of the enriched fields
+ENRICHED_DTYPE = np.dtype([
+    ("node", "i4"), ("namespace", "i4"), ("namespaceData", "i4"), ("namespaceDataWide", "i4"),
+    ("ingress", "i4"), ("egress", "i4"),
+])
+
+# table of the names of each enriched field
+FIELD_TABLES = {
+    "node": "nodes", "namespace": "namespaces", "namespaceData": "namespaceData", "namespaceDataWide": "namespaceDataWide",
+    "ingress": "interfaces", "egress": "interfaces",
+}
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Table:
+    """Names of identifiers, sorted by identifier."""
+
+    def __init__(self, entries : dict) -> None:
+        keys = np.array(sorted(entries), dtype=np.uint64)
+        self.keys = keys
+        # the last name is for the unknown identifiers
+        self.names = np.array([entries[int(k)] for k in keys] + [""], dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, keys : np.ndarray) -> np.ndarray:
+        """Return index of the name of each of `keys`, `UNKNOWN` if unknown."""
+
+        if len(self.keys) == 0:
+            return np.full(len(keys), UNKNOWN, dtype=np.int32)
+
+        index = np.searchsorted(self.keys, keys).astype(np.int32)
+        np.minimum(index, len(self.keys) - 1, out=index)
+        index[self.keys[index] != keys] = UNKNOWN
+        return index
+
+class InterfaceTable:
+    """Names of interfaces, by node ID and interface ID."""
+
+    def __init__(self, entries : dict) -> None:
+        # node IDs are replaced by their index among the nodes with interfaces, the interface ID fits in 32 bits
+        self.nodes = Table({node: "" for node, _ in entries})
+        self.table = Table({int(interface_key(self.nodes.lookup(np.array([n], dtype=np.uint64)), np.array([i]))[0]): v
+                            for (n, i), v in entries.items()})
+        self.keys = np.array(sorted(entries), dtype=np.uint64).reshape(-1, 2)
+        self.names = self.table.names
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def lookup(self, node : np.ndarray, interface : np.ndarray) -> np.ndarray:
+        """Return index of the name of each interface of `node`, `UNKNOWN` if unknown."""
+
+        nodeIndex = self.nodes.lookup(node.astype(np.uint64))
+        index = self.table.lookup(interface_key(nodeIndex, interface))
+        index[nodeIndex == UNKNOWN] = UNKNOWN
+        return index
+
+class Enriched:
+    """Index of the names of the identifiers of events, in the tables they were joined with."""
+
+    def __init__(self, indexes : np.ndarray, tables : dict) -> None:
+        self.indexes = indexes
+        self.tables = tables
+
+    def names(self, field : str) -> np.ndarray:
+        """Return names of `field` (see `ENRICHED_DTYPE`), empty if unknown."""
+
+        return self.tables[FIELD_TABLES[field]].names[self.indexes[field]]
+
+def interface_key(nodeIndex : np.ndarray, interface : np.ndarray) -> np.ndarray:
+    return (nodeIndex.astype(np.uint64) << np.uint64(32)) | (interface.astype(np.uint64) & np.uint64(0xFFFFFFFF))
+
+def config_int(value) -> int:
+    return int(value, 0) if isinstance(value, str) else value
+
+def load_config(path : str) -> dict:
+    """
+    Return names (table -> identifier -> name) of the configuration at `path`.
+
+    Return also data and wide data of the namespaces ("namespaceData": namespace ID -> (data, wide)), None if not given.
+    """
+
+    with open(path) as f:
+        config = json.load(f)
+
+    tables = {
+        "nodes": {int(k, 0): v for k, v in config.get("nodes", {}).items()},
+        "namespaces": {int(k, 0): v for k, v in config.get("namespaces", {}).items()},
+        "interfaces": {},
+        "namespaceData": {int(k, 0): (config_int(v.get("data")), config_int(v.get("wide"))) for k, v in config.get("namespaceData", {}).items()},
+    }
+    for node, interfaces in config.get("interfaces", {}).items():
+        nodeId = ALL_NODES if node == "*" else int(node, 0)
+        for k, v in interfaces.items():
+            tables["interfaces"][(nodeId, int(k, 0))] = v
+    return tables
+
+def netlink_dump(protocol : int, msgType : int, payload : bytes, family : str = None) -> list:
+    """Return payloads of the messages of a netlink dump. The type is the id of generic netlink `family` if given."""
+
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+    try:
+        sock.bind((0, 0))
+        if family is not None:
+            msgType = events.resolve_family(sock, family)[0]
+        sock.send(struct.pack("=IHHII", events.NLMSGHDR_SIZE + len(payload), msgType, events.NLM_F_REQUEST | NLM_F_DUMP, 2, 0) + payload)
+
+        messages = []
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + events.NLMSGHDR_SIZE <= len(data):
+                length, kind = struct.unpack_from("=IH", data, offset)
+                if kind == NLMSG_DONE:
+                    return messages
+                if kind == events.NLMSG_ERROR:
+                    error = -struct.unpack_from("=i", data, offset + events.NLMSGHDR_SIZE)[0]
+                    raise RuntimeError(f"Netlink dump failed: {os.strerror(error)}")
+                messages.append(data[offset + events.NLMSGHDR_SIZE:offset + length])
+                offset += (length + 3) & ~3
+    finally:
+        sock.close()
+
+def dump_namespaces() -> dict:
+    """Return data and wide data of the IOAM namespaces of the kernel, by namespace ID."""
+
+    namespaces = {}
+    request = struct.pack("=BBH", IOAM6_CMD_DUMP_NAMESPACES, 1, 0)
+    for message in netlink_dump(events.NETLINK_GENERIC, 0, request, events.IOAM6_GENL_NAME):
+        attrs = dict(events.iter_attrs(message, events.GENLMSGHDR_SIZE, len(message)))
+        if IOAM6_ATTR_NS_ID not in attrs:
+            continue
+        data = struct.unpack_from("=I", attrs[IOAM6_ATTR_NS_DATA])[0] if IOAM6_ATTR_NS_DATA in attrs else None
+        wide = struct.unpack_from("=Q", attrs[IOAM6_ATTR_NS_DATA_WIDE])[0] if IOAM6_ATTR_NS_DATA_WIDE in attrs else None
+        namespaces[struct.unpack_from("=H", attrs[IOAM6_ATTR_NS_ID])[0]] = (data, wide)
+    return namespaces
+
+def dump_links() -> dict:
+    """Return names of the links of the kernel, by index."""
+
+    links = {}
+    for message in netlink_dump(NETLINK_ROUTE, RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+        index = IFINFOMSG.unpack_from(message)[2]
+        attrs = dict(events.iter_attrs(message, IFINFOMSG.size, len(message)))
+        if IFLA_IFNAME in attrs:
+            links[index] = attrs[IFLA_IFNAME].rstrip(b"\x00").decode()
+    return links
+
+def read_sysctl(path : str) -> int:
+    with open(os.path.join(SYSCTL_DIR, path)) as f:
+        return int(f.read())
+
+def load_kernel(hostname : str = None) -> dict:
+    """Return names (table -> identifier -> name) of the node and its interfaces, and data of the namespaces of the kernel."""
+
+    hostname = hostname or socket.gethostname()
+    node, nodeWide = read_sysctl("ioam6_id"), read_sysctl("ioam6_id_wide")
+    tables = {"nodes": {node: hostname, nodeWide: hostname}, "interfaces": {}}
+
+    # short and wide interface IDs are found with the short and wide node IDs
+    for name in dump_links().values():
+        try:
+            tables["interfaces"][(node, read_sysctl(f"conf/{name}/ioam6_id"))] = name
+            tables["interfaces"][(nodeWide, read_sysctl(f"conf/{name}/ioam6_id_wide"))] = name
+        except (OSError, ValueError):
+            continue
+
+    tables["namespaces"] = dump_namespaces()
+    return tables
+
+class Enricher:
+    """Join events with the names of their identifiers."""
+
+    def __init__(self, configPath : str = None, kernel : bool = True) -> None:
+        self.configPath = configPath
+        self.kernel = kernel
+        self.configTime = None
+        self.watcher = None
+        self.lastRefresh = 0
+        self.tables = {}
+        self.refreshes = 0
+
+        if kernel:
+            # notifications of the links, read without blocking
+            self.watcher = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            self.watcher.bind((0, RTMGRP_LINK))
+            self.watcher.setblocking(False)
+
+        self.refresh()
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def refresh(self):
+        """Load the tables again, from the configuration and the kernel."""
+
+        names = {"nodes": {}, "namespaces": {}, "interfaces": {}, "namespaceData": {}}
+        if self.configPath is not None:
+            self.configTime = os.path.getmtime(self.configPath)
+            names = load_config(self.configPath)
+        namespaceData = names["namespaceData"]
+
+        if self.kernel:
+            try:
+                kernel = load_kernel()
+            except (OSError, RuntimeError) as e:
+                print(f"Cannot load the tables from the kernel: {e}")
+                kernel = {"nodes": {}, "namespaces": {}, "interfaces": {}}
+            # names of the configuration take precedence
+            for table in ["nodes", "interfaces"]:
+                names[table] = {**kernel[table], **names[table]}
+            namespaceData = {**kernel["namespaces"], **namespaceData}
+        for ns in namespaceData:
+            names["namespaces"].setdefault(ns, f"ns{ns}")
+
+        tables = {
+            "nodes": Table(names["nodes"]),
+            "namespaces": Table(names["namespaces"]),
+            "interfaces": InterfaceTable(names["interfaces"]),
+        }
+
+        # namespace data and wide data designate their namespace, in separate tables
+        data, dataWide = {}, {}
+        for ns, (short, wide) in namespaceData.items():
+            name = names["namespaces"][ns]
+            if short is not None:
+                data[short] = name
+            if wide is not None:
+                dataWide[wide] = name
+        tables["namespaceData"] = Table(data)
+        tables["namespaceDataWide"] = Table(dataWide)
+
+        self.tables = tables
+        self.lastRefresh = time.monotonic()
+        self.refreshes += 1
+
+    def poll(self) -> bool:
+        """Load the tables again if links or the configuration changed. Return True if loaded."""
+
+        changed = False
+        if self.watcher is not None:
+            try:
+                while True:
+                    data = self.watcher.recv(65536)
+                    kind = struct.unpack_from("=IH", data)[1]
+                    changed |= kind in (RTM_NEWLINK, RTM_DELLINK)
+            except BlockingIOError:
+                pass
+
+        if self.configPath is not None and os.path.getmtime(self.configPath) != self.configTime:
+            changed = True
+
+        if changed:
+            self.refresh()
+        return changed
+
+    def enrich(self, evts : np.ndarray) -> Enriched:
+        """Return index of the names of the identifiers of `evts`."""
+
+        self.poll()
+        tables = self.tables
+        indexes = np.full(len(evts), UNKNOWN, dtype=ENRICHED_DTYPE)
+        traceType = evts["traceType"]
+
+        wide = (traceType & TRACE_TYPE_HOP_LIM_NODE_ID_WIDE) != 0
+        node = np.where(wide, evts["hopLimNodeIdWide"] & np.uint64(2**56 - 1), evts["hopLimNodeId"] & 0xFFFFFF).astype(np.uint64)
+        hasNode = wide | ((traceType & TRACE_TYPE_HOP_LIM_NODE_ID) != 0)
+        indexes["node"] = np.where(hasNode, tables["nodes"].lookup(node), UNKNOWN)
+
+        indexes["namespace"] = tables["namespaces"].lookup(evts["namespace"].astype(np.uint64))
+
+        for field, bit in [("namespaceData", TRACE_TYPE_NAMESPACE_DATA), ("namespaceDataWide", TRACE_TYPE_NAMESPACE_DATA_WIDE)]:
+            indexes[field] = np.where((traceType & bit) != 0, tables[field].lookup(evts[field].astype(np.uint64)), UNKNOWN)
+
+        wide = (traceType & TRACE_TYPE_INTERFACES_WIDE) != 0
+        hasInterfaces = wide | ((traceType & TRACE_TYPE_INTERFACES) != 0)
+        ingress = np.where(wide, evts["interfacesWide"] >> np.uint64(32), evts["interfaces"] >> 16).astype(np.uint64)
+        egress = np.where(wide, evts["interfacesWide"] & np.uint64(0xFFFFFFFF), evts["interfaces"] & 0xFFFF).astype(np.uint64)
+        for field, interface in [("ingress", ingress), ("egress", egress)]:
+            # interfaces of the node first, then of all nodes
+            index = tables["interfaces"].lookup(node, interface)
+            unknown = index == UNKNOWN
+            index[unknown] = tables["interfaces"].lookup(np.full(int(unknown.sum()), ALL_NODES, dtype=np.uint64), interface[unknown])
+            indexes[field] = np.where(hasInterfaces, index, UNKNOWN)
+
+        # the kernel does not notify new namespaces
+        if self.kernel and (indexes["namespace"] == UNKNOWN).any() and time.monotonic() - self.lastRefresh >= MISS_REFRESH:
+            self.refresh()
+
+        return Enriched(indexes, tables)
+
+def print_tables(enricher : Enricher):
+    for name, table in enricher.tables.items():
+        print(f"{name}: {len(table)} entries")
+        # interfaces are keyed by node ID and interface ID
+        for key, value in zip(table.keys[:10], table.names[:10]):
+            print(f"  {'/'.join(f'{int(k):#x}' for k in np.atleast_1d(key))}: {value}")
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="enrich",
+        description="Enrich DEX events with the names of their identifiers",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-c", type=str, required=False, default=None, help="Static configuration of the names (JSON)")
+    parser.add_argument("-n", action="store_true", help="Do not load the names from the kernel")
+    parser.add_argument("-r", type=str, required=False, default=None, help="Recording of events to enrich")
+    args = parser.parse_args()
+
+    if args.c is not None and not os.path.isfile(args.c):
+        print(f"File {args.c} does not exist")
+        sys.exit(-1)
+
+    return args.c, not args.n, args.r
+
+if __name__ == "__main__":
+    configPath, kernel, recording = check_arguments()
+
+    try:
+        enricher = Enricher(configPath, kernel)
+    except (OSError, ValueError) as e:
+        print(f"Cannot load the tables: {e}")
+        sys.exit(-1)
+
+    if recording is None:
+        print_tables(enricher)
+        enricher.close()
+        sys.exit(0)
+
+    counts = {field: {} for field in ENRICHED_DTYPE.names}
+    batch = events.Batch()
+    nbEvents = 0
+    elapsed = 0
+    for evts in events.replay(recording, batch):
+        start = time.perf_counter()
+        enriched = enricher.enrich(evts)
+        elapsed += time.perf_counter() - start
+        nbEvents += len(evts)
+        for field in ENRICHED_DTYPE.names:
+            index, count = np.unique(enriched.indexes[field], return_counts=True)
+            for name, c in zip(enriched.tables[FIELD_TABLES[field]].names[index], count):
+                counts[field][name] = counts[field].get(name, 0) + int(c)
+    enricher.close()
+
+    print(f"Enriched {nbEvents} events in {elapsed * 1e3:.1f}ms ({nbEvents / elapsed if elapsed else 0:.0f} events/s)")
+    for field, names in counts.items():
+        print(f"{field}: " + " ".join(f"{name or '<unknown>'}={count}" for name, count in sorted(names.items())))
+    sys.exit(0)
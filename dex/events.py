@@ -0,0 +1,668 @@
+"""
+Usage: sudo python3 events.py [-w <recording>] [-r <recording>] [-b <batch_size>]
+       python3 events.py -l <trace_type> [<trace_type> ...]
+
+Consume the IOAM6_EVENT_DEX events multicast by the patched kernel on the
+`ioam6_events` group of the `IOAM6` generic netlink family.
+
+At 100% of injection, the kernel produces about 500k events per second, so
+no Python object is created per event:
+- the socket is drained in batches into a single preallocated buffer, with
+  a large receive buffer;
+- messages of a batch sharing the same layout (same attributes) are decoded
+  at once, with NumPy views on the buffer, into a preallocated structured
+  array (`EVENT_DTYPE`);
+- overruns of the socket (ENOBUFS) are counted in `Metrics`.
+
+The attributes of a message only depend on its trace type, extension flags
+and length of OSS data. For each of them, a decode plan (`Plan`) is compiled
+once: offsets of the attributes, headers expected in the messages and a
+NumPy dtype of the whole message. Messages matching the plan of the previous
+batch are then decoded in a single pass, without parsing any attribute, and
+the fields the kernel always leaves unavailable (e.g. bits 4, 7 and 11 to 21
+of the trace type) are not read. `-l` prints the plans of trace types.
+
+Batches can be written to a recording (`-w`) and replayed later without
+kernel (`-r`), e.g. to test the consumers of the events.
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import argparse
+import numpy as np
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# receive buffer of the socket
+RCVBUF_SIZE = 64 * 1024 * 1024
+
+# maximum number of events in a batch
+BATCH_SIZE = 16384
+
+# maximum size of a single netlink message
+MAX_MSG_SIZE = 8192
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# linux/netlink.h
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+NLM_F_REQUEST = 0x01
+NLMSG_ERROR = 2
+NLA_TYPE_MASK = 0x3FFF
+
+# asm-generic/socket.h, not exported by `socket`
+SO_RCVBUFFORCE = 33
+
+# linux/genetlink.h
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+# linux/ioam6_genl.h (patched)
+IOAM6_GENL_NAME = "IOAM6"
+IOAM6_GENL_EV_GRP_NAME = "ioam6_events"
+IOAM6_EVENT_DEX = 2
+IOAM6_ATTR_PAD = 7
+
+IOAM6_EVENT_ATTR_OPTION_TYPE = 5
+IOAM6_EVENT_ATTR_DEX_NAMESPACE = 6
+IOAM6_EVENT_ATTR_DEX_FLOW_ID = 7
+IOAM6_EVENT_ATTR_DEX_SEQ_NUM = 8
+IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID = 9
+IOAM6_EVENT_ATTR_DEX_OSS_SCID = 31
+IOAM6_EVENT_ATTR_DEX_OSS_DATA = 32
+
+# sizes of struct nlmsghdr, struct genlmsghdr and struct nlattr
+NLMSGHDR_SIZE = 16
+GENLMSGHDR_SIZE = 4
+NLA_HDR_SIZE = 4
+
+# decoded events
+EVENT_DTYPE = np.dtype([
+    ("namespace", "u2"), ("optionType", "u1"), ("extFlags", "u1"), ("traceType", "u4"),
+    ("flowId", "u4"), ("seqNum", "u4"),
+    ("hopLimNodeId", "u4"), ("interfaces", "u4"), ("timestamp", "u4"), ("timestampFrac", "u4"),
+    ("transit", "u4"), ("namespaceData", "u4"), ("queueDepth", "u4"), ("checksum", "u4"),
+    ("hopLimNodeIdWide", "u8"), ("interfacesWide", "u8"), ("namespaceDataWide", "u8"),
+    ("bufferOccupancy", "u4"), ("ossSchemaId", "u4"), ("ossOffset", "u4"), ("ossLen", "u2"),
+], align=True)
+
+# attribute -> (field, kind), in the order of the bits of the trace type
+# host: host byte order (header fields), be: network byte order (IOAM data)
+ATTRIBUTES = {
+    IOAM6_EVENT_ATTR_OPTION_TYPE: ("optionType", "u1"),
+    IOAM6_EVENT_ATTR_DEX_NAMESPACE: ("namespace", "host16"),
+    IOAM6_EVENT_ATTR_DEX_FLOW_ID: ("flowId", "host32"),
+    IOAM6_EVENT_ATTR_DEX_SEQ_NUM: ("seqNum", "host32"),
+    9: ("hopLimNodeId", "be32"),
+    10: ("interfaces", "be32"),
+    11: ("timestamp", "be32"),
+    12: ("timestampFrac", "be32"),
+    13: ("transit", "be32"),
+    14: ("namespaceData", "be32"),
+    15: ("queueDepth", "be32"),
+    16: ("checksum", "be32"),
+    17: ("hopLimNodeIdWide", "be64"),
+    18: ("interfacesWide", "be64"),
+    19: ("namespaceDataWide", "be64"),
+    20: ("bufferOccupancy", "be32"),
+    **{bit: (None, None) for bit in range(21, 31)},  # undefined bits 12-21
+    IOAM6_EVENT_ATTR_DEX_OSS_SCID: ("ossSchemaId", "be32"),
+    IOAM6_EVENT_ATTR_DEX_OSS_DATA: ("ossOffset", "oss"),
+}
+
+# extension flags of the flow id and the sequence number
+EXT_FLAG_FLOW_ID = 0x80
+EXT_FLAG_SEQ_NUM = 0x40
+
+# bits of the trace type (0 is the most significant) always filled with IOAM6_U32_UNAVAILABLE by the kernel,
+# 64-bit wide, and of the OSS
+IOAM6_U32_UNAVAILABLE = 0xFFFFFFFF
+UNAVAILABLE_BITS = [4, 7, 11, *range(12, 22)]
+WIDE_BITS = [8, 9, 10]
+OSS_BIT = 22
+
+HOST = "<" if sys.byteorder == "little" else ">"
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Metrics:
+    """Counters of a consumer."""
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.messages = 0
+        self.events = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.overruns = 0
+
+    def __str__(self) -> str:
+        return (f"batches={self.batches} messages={self.messages} events={self.events} "
+                f"skipped={self.skipped} bytes={self.bytes} overruns={self.overruns}")
+
+class Plan:
+    """
+    Decode plan of the messages with a given trace type, extension flags and length of OSS data.
+
+    Built by `compile_plan`, in the order in which `ioam6_event_put_dex` puts the attributes.
+    """
+
+    def __init__(self, traceType : int, extFlags : int, ossLen : int = None, pad64 : bool = False) -> None:
+        """`ossLen` is None if the namespace has no schema, `pad64` if 64-bit attributes are aligned with `IOAM6_ATTR_PAD`."""
+
+        self.traceType = traceType
+        self.extFlags = extFlags
+        self.ossLen = ossLen
+
+        # attributes (type, offset of payload, length of payload), as returned by `parse_layout`
+        self.layout = []
+        offset = NLMSGHDR_SIZE + GENLMSGHDR_SIZE
+
+        def put(attrType : int, length : int):
+            nonlocal offset
+            self.layout.append((attrType, offset + NLA_HDR_SIZE, length))
+            offset += NLA_HDR_SIZE + ((length + 3) & ~3)
+
+        put(IOAM6_EVENT_ATTR_OPTION_TYPE, 1)
+        put(IOAM6_EVENT_ATTR_DEX_NAMESPACE, 2)
+        if extFlags & EXT_FLAG_FLOW_ID:
+            put(IOAM6_EVENT_ATTR_DEX_FLOW_ID, 4)
+        if extFlags & EXT_FLAG_SEQ_NUM:
+            put(IOAM6_EVENT_ATTR_DEX_SEQ_NUM, 4)
+        for bit in range(OSS_BIT):
+            if not traceType & (0x800000 >> bit):
+                continue
+            if bit in WIDE_BITS:
+                # padded if the payload would not be 8-aligned
+                if pad64 and offset % 8 == 0:
+                    put(IOAM6_ATTR_PAD, 0)
+                put(IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID + bit, 8)
+            else:
+                put(IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID + bit, 4)
+        if traceType & (0x800000 >> OSS_BIT) and ossLen is not None:
+            put(IOAM6_EVENT_ATTR_DEX_OSS_SCID, 4)
+            put(IOAM6_EVENT_ATTR_DEX_OSS_DATA, ossLen)
+        self.size = offset
+
+        # length of the message and headers of the attributes, as returned by `signature`
+        self.words = np.array([0] + [o - NLA_HDR_SIZE for _, o, _ in self.layout], dtype=np.int64)
+        headers = [struct.pack("=I", self.size)] + [struct.pack("=HH", NLA_HDR_SIZE + l, t) for t, _, l in self.layout]
+        self.signature = np.frombuffer(b"".join(headers), dtype=HOST + "u4")
+
+        # whole message as a record, fields not available are left out
+        names, formats, offsets = [], [], []
+        self.unavailable = []
+        self.ossOffset = None
+        for attrType, offset, length in self.layout:
+            field, kind = ATTRIBUTES.get(attrType, (None, None))
+            if attrType == IOAM6_ATTR_PAD and length == 0:
+                continue
+            if attrType - IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID in UNAVAILABLE_BITS:
+                if field is not None:
+                    self.unavailable.append(field)
+            elif kind == "oss":
+                self.ossOffset = offset
+            elif field is not None:
+                names.append(field)
+                formats.append({"u1": "u1", "host16": HOST + "u2", "host32": HOST + "u4", "be32": ">u4", "be64": ">u8"}[kind])
+                offsets.append(offset)
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": self.size})
+
+        # distance between consecutive messages of the plan in a batch
+        self.stride = 4 + ((self.size + 3) & ~3)
+
+    def __str__(self) -> str:
+        names = ["pad" if t == IOAM6_ATTR_PAD and l == 0 else ATTRIBUTES.get(t, (None, None))[0] or f"bit{t - IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID}"
+                 for t, _, l in self.layout]
+        attrs = " ".join(f"{name}@{o}" for name, (_, o, _) in zip(names, self.layout))
+        return (f"traceType={self.traceType:#08x} extFlags={self.extFlags:#04x} ossLen={self.ossLen} size={self.size}: {attrs}"
+                + (f" (unavailable: {' '.join(self.unavailable)})" if self.unavailable else ""))
+
+    def match(self, batch : "Batch", starts : np.ndarray) -> np.ndarray:
+        """Return mask of the messages at `starts` matching the plan, i.e. with its length and headers."""
+
+        match = np.ones(len(starts), dtype=bool)
+        for word, expected in zip(self.words, self.signature):
+            match &= batch.host32[(starts + word) // 4] == expected
+        return match
+
+    def decode(self, batch : "Batch", starts : np.ndarray, dst):
+        """Decode messages at `starts`, all matching the plan, into events at `dst` (indices or slice)."""
+
+        if len(starts) > 1 and (np.diff(starts) == self.stride).all():
+            # consecutive messages, read in place
+            records = np.ndarray(len(starts), dtype=self.dtype, buffer=batch.buffer, offset=int(starts[0]), strides=(self.stride,))
+        else:
+            records = batch.u8[starts[:, None] + np.arange(self.size)].view(self.dtype)[:, 0]
+
+        events = batch.events
+        for field in self.dtype.names:
+            events[field][dst] = records[field]
+        for field in self.unavailable:
+            events[field][dst] = IOAM6_U32_UNAVAILABLE
+        if self.ossOffset is not None:
+            events["ossOffset"][dst] = starts + self.ossOffset
+            events["ossLen"][dst] = self.ossLen
+        events["traceType"][dst] = self.traceType
+        events["extFlags"][dst] = self.extFlags
+
+# compiled plans, by trace type, extension flags, length of OSS data and padding
+PLANS = {}
+
+def compile_plan(traceType : int, extFlags : int = EXT_FLAG_FLOW_ID | EXT_FLAG_SEQ_NUM, ossLen : int = None, pad64 : bool = False) -> Plan:
+    """Return decode plan of the messages with `traceType`, `extFlags` and `ossLen` bytes of OSS data, compiled once."""
+
+    key = (traceType, extFlags, ossLen, pad64)
+    if key not in PLANS:
+        PLANS[key] = Plan(*key)
+    return PLANS[key]
+
+def layout_plan(layout : list) -> Plan:
+    """Return decode plan of the messages with `layout` (see `parse_layout`). None if the layout is not the one of a plan."""
+
+    traceType = 0
+    extFlags = 0
+    ossLen = None
+    pad64 = False
+    for attrType, _, length in layout:
+        if attrType == IOAM6_ATTR_PAD and length == 0:
+            pad64 = True
+        elif attrType == IOAM6_EVENT_ATTR_DEX_FLOW_ID:
+            extFlags |= EXT_FLAG_FLOW_ID
+        elif attrType == IOAM6_EVENT_ATTR_DEX_SEQ_NUM:
+            extFlags |= EXT_FLAG_SEQ_NUM
+        elif attrType >= IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID and attrType <= IOAM6_EVENT_ATTR_DEX_OSS_SCID:
+            traceType |= 0x800000 >> (attrType - IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID)
+        elif attrType == IOAM6_EVENT_ATTR_DEX_OSS_DATA:
+            ossLen = length
+
+    plan = compile_plan(traceType, extFlags, ossLen, pad64)
+    return plan if plan.layout == layout else None
+
+class Batch:
+    """
+    Preallocated buffer receiving netlink messages and their decoded events.
+
+    The buffer holds records `[u32 length][message, padded to 4 bytes]`, which
+    is also the format of the recordings.
+    """
+
+    def __init__(self, size : int = BATCH_SIZE) -> None:
+        self.size = size
+        # up to `size` messages of up to `MAX_MSG_SIZE` bytes, 8-aligned
+        self.buffer = bytearray(size * 256 + MAX_MSG_SIZE * 2)
+        self.view = memoryview(self.buffer)
+        self.u8 = np.frombuffer(self.buffer, dtype=np.uint8)
+        self.host16 = self.u8.view(HOST + "u2")
+        self.host32 = self.u8.view(HOST + "u4")
+        self.be32 = self.u8.view(">u4")
+        self.starts = np.zeros(size, dtype=np.int64)
+        self.events = np.zeros(size, dtype=EVENT_DTYPE)
+        # plan of the last messages decoded, tried first on the next batch
+        self.plan = None
+        self.clear()
+
+    def clear(self):
+        self.end = 0
+        self.count = 0
+
+    def room(self) -> bool:
+        """Return True if the batch can hold another message of `MAX_MSG_SIZE` bytes."""
+
+        return self.count < self.size and self.end + NLA_HDR_SIZE + MAX_MSG_SIZE <= len(self.buffer)
+
+    def commit(self, length : int):
+        """Record message of `length` bytes just written after the current end of the batch."""
+
+        struct.pack_into("=I", self.buffer, self.end, length)
+        self.starts[self.count] = self.end + 4
+        self.count += 1
+        self.end += 4 + ((length + 3) & ~3)
+
+    def records(self) -> memoryview:
+        """Return the records of the batch, as written in a recording."""
+
+        return self.view[:self.end]
+
+    def oss(self, event) -> bytes:
+        """Return OSS data of decoded `event`, only valid until the batch is cleared."""
+
+        return bytes(self.view[event["ossOffset"]:event["ossOffset"] + event["ossLen"]])
+
+def parse_layout(batch : Batch, start : int) -> list:
+    """Return attributes (type, offset of payload, length of payload) of message at `start`."""
+
+    length = int(batch.host32[start // 4])
+    offset = start + NLMSGHDR_SIZE + GENLMSGHDR_SIZE
+    end = start + length
+
+    layout = []
+    while offset + NLA_HDR_SIZE <= end:
+        nlaLen, nlaType = struct.unpack_from("=HH", batch.buffer, offset)
+        if nlaLen < NLA_HDR_SIZE:
+            break
+        layout.append((nlaType & NLA_TYPE_MASK, offset + NLA_HDR_SIZE - start, nlaLen - NLA_HDR_SIZE))
+        offset += (nlaLen + 3) & ~3
+
+    return layout
+
+def signature(batch : Batch, starts : np.ndarray, layout : list) -> np.ndarray:
+    """Return, for each message at `starts`, its length and headers of the attributes of `layout`."""
+
+    words = [0] + [offset - NLA_HDR_SIZE for _, offset, _ in layout]
+    return batch.host32[(starts[:, None] + np.array(words, dtype=np.int64)[None, :]) // 4]
+
+def fill(batch : Batch, starts : np.ndarray, dst : np.ndarray, layout : list):
+    """Decode messages at `starts`, all with `layout`, into events at `dst`."""
+
+    events = batch.events
+    traceType = 0
+    extFlags = 0
+
+    for attrType, offset, length in layout:
+        field, kind = ATTRIBUTES.get(attrType, (None, None))
+
+        if attrType == IOAM6_ATTR_PAD and length == 0:
+            # IOAM6_ATTR_PAD aligning 64-bit attributes, same number as the flow id
+            continue
+        if attrType >= IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID and attrType <= IOAM6_EVENT_ATTR_DEX_OSS_SCID:
+            traceType |= 0x800000 >> (attrType - IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID)
+        if attrType == IOAM6_EVENT_ATTR_DEX_FLOW_ID:
+            extFlags |= EXT_FLAG_FLOW_ID
+        if attrType == IOAM6_EVENT_ATTR_DEX_SEQ_NUM:
+            extFlags |= EXT_FLAG_SEQ_NUM
+        if field is None:
+            continue
+
+        positions = starts + offset
+        if kind == "u1":
+            events[field][dst] = batch.u8[positions]
+        elif kind == "host16":
+            events[field][dst] = batch.host16[positions // 2]
+        elif kind == "host32":
+            events[field][dst] = batch.host32[positions // 4]
+        elif kind == "be32":
+            events[field][dst] = batch.be32[positions // 4]
+        elif kind == "be64":
+            high = batch.be32[positions // 4].astype(np.uint64)
+            low = batch.be32[positions // 4 + 1].astype(np.uint64)
+            events[field][dst] = (high << np.uint64(32)) | low
+        elif kind == "oss":
+            events["ossOffset"][dst] = positions
+            events["ossLen"][dst] = length
+
+    events["traceType"][dst] = traceType
+    events["extFlags"][dst] = extFlags
+
+def decode(batch : Batch, familyId : int = None) -> np.ndarray:
+    """
+    Decode the DEX events of all messages in `batch`.
+
+    Messages that are not DEX events (or not from `familyId` if given) are skipped.
+    Return view on the decoded events, in the order of reception.
+    """
+
+    starts = batch.starts[:batch.count]
+    valid = batch.u8[starts + NLMSGHDR_SIZE] == IOAM6_EVENT_DEX
+    if familyId is not None:
+        valid &= batch.host16[(starts + 4) // 2] == familyId
+    starts = starts[valid]
+
+    events = batch.events[:len(starts)]
+    events.view(np.uint8).fill(0)
+
+    # decode together all messages with the plan of the previous batch, then with the layout of the first remaining one
+    remaining = np.arange(len(starts))
+    plan = batch.plan
+    while len(remaining):
+        if plan is None:
+            layout = parse_layout(batch, int(starts[remaining[0]]))
+            plan = layout_plan(layout)
+            # attributes of a plan, but not its length, e.g. bytes after the attributes
+            if plan is not None and not plan.match(batch, starts[remaining[:1]])[0]:
+                plan = None
+            if plan is None:
+                sig = signature(batch, starts[remaining], layout)
+                same = (sig == sig[0]).all(axis=1)
+                fill(batch, starts[remaining[same]], remaining[same], layout)
+                remaining = remaining[~same]
+                continue
+
+        same = plan.match(batch, starts[remaining])
+        if same.all() and len(remaining) == len(starts):
+            # homogeneous batch
+            plan.decode(batch, starts, slice(0, len(starts)))
+            batch.plan = plan
+            break
+        if same.any():
+            plan.decode(batch, starts[remaining[same]], remaining[same])
+            batch.plan = plan
+            remaining = remaining[~same]
+        plan = None
+
+    return events
+
+class EventSocket:
+    """Generic netlink socket subscribed to the IOAM6 events."""
+
+    def __init__(self, rcvbuf : int = RCVBUF_SIZE) -> None:
+        self.rcvbuf = rcvbuf
+        self.sock = None
+        self.familyId = None
+        self.metrics = Metrics()
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sock.bind((0, 0))
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, self.rcvbuf)
+        except PermissionError:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+        self.familyId, groups = resolve_family(self.sock, IOAM6_GENL_NAME)
+        if IOAM6_GENL_EV_GRP_NAME not in groups:
+            raise RuntimeError(f"Group {IOAM6_GENL_EV_GRP_NAME} not found in family {IOAM6_GENL_NAME}")
+
+        self.sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, groups[IOAM6_GENL_EV_GRP_NAME])
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def receive(self, batch : Batch) -> int:
+        """
+        Wait for messages and drain the socket into `batch`, until it is empty or the batch is full.
+
+        Return number of messages received.
+        """
+
+        batch.clear()
+        flags = 0
+
+        while batch.room():
+            try:
+                length = self.sock.recv_into(batch.view[batch.end + 4:], MAX_MSG_SIZE, flags)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # events were dropped by the kernel, socket can be read again
+                self.metrics.overruns += 1
+                continue
+
+            batch.commit(length)
+            self.metrics.bytes += length
+            flags = socket.MSG_DONTWAIT
+
+        self.metrics.batches += 1
+        self.metrics.messages += batch.count
+        return batch.count
+
+    def consume(self, batch : Batch) -> np.ndarray:
+        """Receive next batch and return its decoded events."""
+
+        self.receive(batch)
+        events = decode(batch, self.familyId)
+        self.metrics.events += len(events)
+        self.metrics.skipped += batch.count - len(events)
+        return events
+
+def resolve_family(sock : socket.socket, name : str) -> tuple:
+    """Return id and multicast groups (name -> id) of generic netlink family `name`."""
+
+    nameAttr = name.encode() + b"\x00"
+    attrLen = NLA_HDR_SIZE + len(nameAttr)
+    payload = struct.pack("=BBH", CTRL_CMD_GETFAMILY, 1, 0)
+    payload += struct.pack("=HH", attrLen, CTRL_ATTR_FAMILY_NAME) + nameAttr + b"\x00" * (-attrLen % 4)
+    sock.send(struct.pack("=IHHII", NLMSGHDR_SIZE + len(payload), GENL_ID_CTRL, NLM_F_REQUEST, 1, 0) + payload)
+
+    data = sock.recv(MAX_MSG_SIZE)
+    _, msgType = struct.unpack_from("=IH", data)
+    if msgType == NLMSG_ERROR:
+        error = -struct.unpack_from("=i", data, NLMSGHDR_SIZE)[0]
+        raise RuntimeError(f"Family {name} not found: {os.strerror(error)}")
+
+    familyId = None
+    groups = {}
+    for attrType, value in iter_attrs(data, NLMSGHDR_SIZE + GENLMSGHDR_SIZE, len(data)):
+        if attrType == CTRL_ATTR_FAMILY_ID:
+            familyId = struct.unpack_from("=H", value)[0]
+        elif attrType == CTRL_ATTR_MCAST_GROUPS:
+            for _, group in iter_attrs(value, 0, len(value)):
+                attrs = dict(iter_attrs(group, 0, len(group)))
+                groups[attrs[CTRL_ATTR_MCAST_GRP_NAME].rstrip(b"\x00").decode()] = struct.unpack_from("=I", attrs[CTRL_ATTR_MCAST_GRP_ID])[0]
+
+    return familyId, groups
+
+def iter_attrs(data : bytes, offset : int, end : int):
+    """Iterate over (type, payload) of the netlink attributes in `data[offset:end]`."""
+
+    while offset + NLA_HDR_SIZE <= end:
+        nlaLen, nlaType = struct.unpack_from("=HH", data, offset)
+        if nlaLen < NLA_HDR_SIZE:
+            return
+        yield nlaType & NLA_TYPE_MASK, data[offset + NLA_HDR_SIZE:offset + nlaLen]
+        offset += (nlaLen + 3) & ~3
+
+def replay(path : str, batch : Batch):
+    """Replay recording at `path` into `batch`. Yield decoded events of each batch."""
+
+    with open(path, "rb") as f:
+        while True:
+            # records are read in bulk, in the same format as in the batch
+            batch.clear()
+            size = f.readinto(batch.view[:len(batch.buffer) - MAX_MSG_SIZE])
+
+            starts = []
+            end = 0
+            unpack = struct.Struct("=I").unpack_from
+            while len(starts) < batch.size and end + 4 <= size:
+                length = unpack(batch.buffer, end)[0]
+                if end + 4 + length > size:
+                    break
+                starts.append(end + 4)
+                end += 4 + ((length + 3) & ~3)
+
+            batch.count = len(starts)
+            batch.end = end
+            batch.starts[:batch.count] = starts
+
+            if batch.count == 0:
+                if size > 0:
+                    raise RuntimeError(f"Truncated recording {path}")
+                return
+
+            # incomplete record is read again with next batch
+            f.seek(batch.end - size, os.SEEK_CUR)
+            yield decode(batch)
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="events",
+        description="Consume IOAM DEX events of the kernel",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-w", type=str, required=False, default=None, help="Write received messages to recording")
+    parser.add_argument("-r", type=str, required=False, default=None, help="Replay recording instead of listening to the kernel")
+    parser.add_argument("-b", type=int, required=False, default=BATCH_SIZE, help="Maximum number of events in a batch")
+    parser.add_argument("-l", type=str, nargs="+", required=False, default=None, help="Print the decode plans of trace types, e.g. 0x800000")
+    args = parser.parse_args()
+
+    if args.b <= 0:
+        print("<batch_size> cannot be <= 0")
+        sys.exit(-1)
+
+    try:
+        traceTypes = [int(t, 16) for t in args.l] if args.l is not None else None
+    except ValueError:
+        print("<trace_type> must be hexadecimal")
+        sys.exit(-1)
+
+    return args.w, args.r, args.b, traceTypes
+
+if __name__ == "__main__":
+    recording, replayPath, batchSize, traceTypes = check_arguments()
+    batch = Batch(batchSize)
+
+    if traceTypes is not None:
+        for traceType in traceTypes:
+            print(compile_plan(traceType))
+        sys.exit(0)
+
+    if replayPath is not None:
+        total = 0
+        for events in replay(replayPath, batch):
+            total += len(events)
+        print(f"Replayed {total} events")
+        sys.exit(0)
+
+    consumer = EventSocket()
+    try:
+        consumer.open()
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot listen to IOAM6 events: {e}")
+        sys.exit(-1)
+
+    output = open(recording, "wb") if recording is not None else None
+    last = time.monotonic()
+    try:
+        while True:
+            consumer.consume(batch)
+            if output is not None:
+                output.write(batch.records())
+
+            now = time.monotonic()
+            if now - last >= 1:
+                print(consumer.metrics)
+                last = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        consumer.close()
+        if output is not None:
+            output.close()
+
+    sys.exit(0)
@@ -0,0 +1,524 @@
+"""
+Usage: sudo python3 fanout.py [-r <recording> | -g <nb_batches>] [-s <sink>[:<policy>] ...]
+                              [-c <host>:<port>] [-a <archive>] [-d] [-k <nb_slots>] [-b <batch_size>]
+
+Fan out the DEX events (see `events.py`) to several sinks running in their
+own processes: IPFIX export, flow table, on-disk archive and live metrics.
+
+Each batch of events is decoded once, directly into a slot of a ring in
+shared memory, and read in place by all sinks. The ring has one writer (the
+decoding process) and one read cursor per sink, so there is no lock:
+- the writer stamps a slot with its sequence number once written, then
+  publishes it by incrementing the write cursor;
+- a sink announces the slot it is reading, checks that the slot is still
+  valid, and checks after reading that the writer did not start the next
+  batch in it (counted as overwritten, which the handshake below prevents).
+
+Memory is bounded by the number of slots `-k`. When a sink lags behind by
+the whole ring, its backpressure policy decides:
+- block: the writer waits for the sink, e.g. to not lose any event in the
+  archive (the kernel then drops events, see the overruns of `events.py`);
+- drop: the sink skips the oldest batches it did not read yet;
+- sample: like drop, and the sink only reads one batch of every
+  `SAMPLE_EVERY`, e.g. for live metrics.
+The writer never reuses the slot a sink is reading: it invalidates the slot
+first, then waits for the sinks which announced it before.
+A sink whose process ends, e.g. on an error, is marked dead and no longer
+waited for.
+
+Batches, events, dropped and sampled out batches, and lag (number of
+batches published and not read yet) are counted for each sink in the ring.
+Synthetic batches (`-g`) allow to test the sinks without kernel.
+With `-d`, the IPFIX and archive sinks intern the OSS schemas (see `schemas.py`).
+"""
+
+import sys
+import time
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+import events
+import flows
+import archive
+import ipfix
+import schemas
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# number of batches in the ring
+NB_SLOTS = 8
+
+# sinks and their backpressure policy
+SINKS = ["ipfix:drop", "flows:block", "metrics:sample"]
+
+# sinks with the sample policy read one batch of every `SAMPLE_EVERY`
+SAMPLE_EVERY = 8
+
+# sleep while waiting for the ring, in seconds
+POLL_INTERVAL = 0.0005
+
+# period of the metrics, in seconds
+METRICS_PERIOD = 1
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+POLICIES = ["block", "drop", "sample"]
+
+# counters of the ring
+WRITE, CLOSED, STALLS, PUBLISHED = range(4)
+RING_FIELDS = 4
+
+# counters of each sink
+NEXT, HELD, BATCHES, EVENTS, DROPPED, SAMPLED, OVERWRITTEN, MAX_LAG, DEAD = range(9)
+SINK_FIELDS = 9
+
+# no slot held by the sink
+NONE = -1
+
+# alignment of the arrays in the shared memory
+ALIGNMENT = 64
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def align(offset : int) -> int:
+    return (offset + ALIGNMENT - 1) & ~(ALIGNMENT - 1)
+
+class Slot:
+    """Batch of events read in place in the ring, with the raw messages holding their OSS data (see `events.Batch.oss`)."""
+
+    def __init__(self, seq : int, evts : np.ndarray, u8 : np.ndarray) -> None:
+        self.seq = seq
+        self.events = evts
+        self.u8 = u8
+
+class Ring:
+    """Ring of batches of events in shared memory, with one writer and one read cursor per sink."""
+
+    def __init__(self, policies : list, nbSlots : int = NB_SLOTS, batchSize : int = events.BATCH_SIZE, name : str = None) -> None:
+        """Create the ring, or attach to ring `name` created with the same parameters."""
+
+        for policy in policies:
+            if policy not in POLICIES:
+                raise RuntimeError(f"Invalid policy {policy}, must be one of {POLICIES}")
+        if nbSlots < 2:
+            raise RuntimeError("Ring needs at least 2 slots")
+
+        self.policies = policies
+        self.nbSlots = nbSlots
+        self.batchSize = batchSize
+        self.dataSize = len(events.Batch(batchSize).buffer)
+
+        # counters, slots (sequence number, number of events, length of messages), events and messages
+        nbCounters = RING_FIELDS + SINK_FIELDS * len(policies)
+        layout = [("counters", np.int64, nbCounters), ("slots", np.int64, 4 * nbSlots),
+                  ("events", events.EVENT_DTYPE, nbSlots * batchSize), ("data", np.uint8, nbSlots * self.dataSize)]
+        offsets = []
+        size = 0
+        for _, dtype, count in layout:
+            offsets.append(size)
+            size = align(size + np.dtype(dtype).itemsize * count)
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+
+        arrays = {key: np.ndarray(count, dtype=dtype, buffer=self.shm.buf, offset=offset)
+                  for (key, dtype, count), offset in zip(layout, offsets)}
+        self.counters = arrays["counters"][:RING_FIELDS]
+        self.sinks = arrays["counters"][RING_FIELDS:].reshape(len(policies), SINK_FIELDS)
+        # sequence number of the batch published in each slot (NONE while invalidated), and of
+        # the batch being written in it, stamped once no sink holds the slot
+        self.seqs, self.stamps, self.counts, self.lengths = arrays["slots"].reshape(4, nbSlots)
+        self.events = arrays["events"].reshape(nbSlots, batchSize)
+        self.data = arrays["data"].reshape(nbSlots, self.dataSize)
+
+        if self.owner:
+            arrays["counters"].fill(0)
+            self.sinks[:, HELD] = NONE
+            self.seqs.fill(NONE)
+            self.stamps.fill(NONE)
+        self.reserved = None
+        self.workers = None
+
+    def spec(self) -> tuple:
+        """Return arguments attaching another process to the ring."""
+
+        return self.policies, self.nbSlots, self.batchSize, self.name
+
+    def close(self):
+        """Detach from the ring, and free it if created by this process."""
+
+        self.counters = self.sinks = self.seqs = self.stamps = self.counts = self.lengths = self.events = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def lag(self, sink : int) -> int:
+        """Return number of batches published and not read yet by `sink`."""
+
+        return int(self.counters[WRITE] - self.sinks[sink, NEXT])
+
+    # writer
+
+    def watch(self, workers : list):
+        """Mark dead the sinks whose process in `workers` (one per sink) ended, while waiting for them."""
+
+        self.workers = workers
+
+    def leave(self, sink : int):
+        """Mark `sink` dead, the writer no longer waits for it."""
+
+        self.sinks[sink, DEAD] = 1
+        self.sinks[sink, HELD] = NONE
+
+    def check_workers(self):
+        if self.workers is None:
+            return
+        for sink, worker in enumerate(self.workers):
+            if not self.sinks[sink, DEAD] and not worker.is_alive():
+                self.leave(sink)
+
+    def read_by_block_sinks(self, reused : int) -> bool:
+        """Return True if the sinks with the block policy read batch `reused`."""
+
+        for sink, policy in enumerate(self.policies):
+            if policy == "block" and not self.sinks[sink, DEAD] and self.sinks[sink, NEXT] <= reused:
+                return False
+        return True
+
+    def released(self, reused : int) -> bool:
+        """Return True if no sink holds batch `reused`."""
+
+        for sink in range(len(self.policies)):
+            if not self.sinks[sink, DEAD] and self.sinks[sink, HELD] == reused:
+                return False
+        return True
+
+    def wait(self, condition, reused : int) -> bool:
+        """Wait until `condition(reused)`. Return True if it had to wait."""
+
+        if condition(reused):
+            return False
+        while not condition(reused):
+            self.check_workers()
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def reserve(self, batch : events.Batch = None) -> np.ndarray:
+        """
+        Wait for the slot of the next batch and return its events.
+
+        If given, `batch` decodes its next events directly into the slot.
+        """
+
+        seq = int(self.counters[WRITE])
+        slot = seq % self.nbSlots
+        reused = seq - self.nbSlots
+
+        # slot invalidated before waiting for the sinks holding it, which announce it before checking it
+        stalled = reused >= 0 and self.wait(self.read_by_block_sinks, reused)
+        self.seqs[slot] = NONE
+        stalled |= reused >= 0 and self.wait(self.released, reused)
+        if stalled:
+            self.counters[STALLS] += 1
+        self.stamps[slot] = seq
+
+        self.reserved = slot
+        if batch is not None:
+            batch.events = self.events[slot]
+        return self.events[slot]
+
+    def publish(self, evts : np.ndarray, batch : events.Batch = None):
+        """Publish `evts` to the sinks, copied in the slot unless decoded into it. `batch` holds their OSS data."""
+
+        if self.reserved is None:
+            self.reserve()
+        slot = self.reserved
+        seq = int(self.counters[WRITE])
+
+        if len(evts) > self.batchSize:
+            raise RuntimeError(f"Batch of {len(evts)} events larger than the slots of the ring")
+        if not np.shares_memory(evts, self.events[slot]):
+            self.events[slot][:len(evts)] = evts
+
+        length = 0
+        if batch is not None and len(evts) and evts["ossLen"].any():
+            length = batch.end
+            self.data[slot][:length] = batch.u8[:length]
+
+        self.counts[slot] = len(evts)
+        self.lengths[slot] = length
+        self.seqs[slot] = seq
+        self.counters[PUBLISHED] += len(evts)
+        self.counters[WRITE] = seq + 1
+        self.reserved = None
+
+    def finish(self):
+        """Tell the sinks that no more batches will be published."""
+
+        self.counters[CLOSED] = 1
+
+    # sinks
+
+    def read(self, sink : int):
+        """Yield the batches read by `sink`, as `Slot`, until the writer is done and the ring is drained."""
+
+        counters = self.sinks[sink]
+        policy = self.policies[sink]
+
+        while True:
+            seq = int(counters[NEXT])
+            write = int(self.counters[WRITE])
+            if seq >= write:
+                if self.counters[CLOSED]:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            counters[MAX_LAG] = max(int(counters[MAX_LAG]), write - seq)
+
+            # oldest batches are skipped, the slot being written next is left to the writer
+            if policy != "block" and write - seq >= self.nbSlots:
+                counters[DROPPED] += write - seq - self.nbSlots + 1
+                seq = write - self.nbSlots + 1
+                counters[NEXT] = seq
+
+            if policy == "sample" and seq % SAMPLE_EVERY:
+                counters[SAMPLED] += 1
+                counters[NEXT] = seq + 1
+                continue
+
+            slot = seq % self.nbSlots
+            counters[HELD] = seq
+            if self.seqs[slot] != seq:
+                # reused by the writer before the sink held it
+                counters[HELD] = NONE
+                counters[DROPPED] += 1
+                counters[NEXT] = seq + 1
+                continue
+
+            count = int(self.counts[slot])
+            yield Slot(seq, self.events[slot][:count], self.data[slot])
+
+            # the slot is only invalidated while held, written once released
+            if self.stamps[slot] != seq:
+                counters[OVERWRITTEN] += 1
+            counters[BATCHES] += 1
+            counters[EVENTS] += count
+            counters[HELD] = NONE
+            counters[NEXT] = seq + 1
+
+    def stats(self) -> list:
+        """Return counters of each sink."""
+
+        return [{
+            "policy": policy, "batches": int(counters[BATCHES]), "events": int(counters[EVENTS]),
+            "dropped": int(counters[DROPPED]), "sampled": int(counters[SAMPLED]), "overwritten": int(counters[OVERWRITTEN]),
+            "lag": self.lag(sink), "maxLag": int(counters[MAX_LAG]), "dead": bool(counters[DEAD]),
+        } for sink, (policy, counters) in enumerate(zip(self.policies, self.sinks))]
+
+class FlowsSink:
+    """Track the sequence numbers of the flows, see `flows.py`."""
+
+    def __init__(self, options : dict) -> None:
+        self.table = flows.FlowTable()
+
+    def __call__(self, slot : Slot):
+        self.table.update(slot.events)
+
+    def close(self):
+        flows.print_flows(self.table)
+
+class IpfixSink:
+    """Export the events to an IPFIX collector, see `ipfix.py`."""
+
+    def __init__(self, options : dict) -> None:
+        self.exporter = ipfix.Exporter(options["collector"], dedup=options["dedup"])
+        self.exporter.open()
+
+    def __call__(self, slot : Slot):
+        self.exporter.export(slot.events, slot)
+
+    def close(self):
+        self.exporter.close()
+        print(f"Exported {self.exporter.records} records in {self.exporter.messages} messages ({self.exporter.refused} refused)")
+        if self.exporter.schemas is not None:
+            print(f"ipfix schemas: {schemas.format_stats(self.exporter.schemas.stats())}")
+
+class ArchiveSink:
+    """Append the events to an archive, see `archive.py`."""
+
+    def __init__(self, options : dict) -> None:
+        self.writer = archive.Writer(options["archive"], dedup=options["dedup"])
+
+    def __call__(self, slot : Slot):
+        self.writer.append(slot.events, slot)
+
+    def close(self):
+        self.writer.close()
+        print(f"Archived {self.writer.records} records in {self.writer.blocks} blocks")
+        if self.writer.schemas is not None:
+            print(f"archive schemas: {schemas.format_stats(self.writer.schemas.stats())}")
+
+class MetricsSink:
+    """Print the rate of the events read every `METRICS_PERIOD` seconds."""
+
+    def __init__(self, options : dict) -> None:
+        self.events = 0
+        self.last = time.monotonic()
+
+    def __call__(self, slot : Slot):
+        self.events += len(slot.events)
+        now = time.monotonic()
+        if now - self.last >= METRICS_PERIOD:
+            print(f"metrics: {self.events / (now - self.last):.0f} events/s (sampled)")
+            self.events = 0
+            self.last = now
+
+    def close(self):
+        pass
+
+SINK_TYPES = {"flows": FlowsSink, "ipfix": IpfixSink, "archive": ArchiveSink, "metrics": MetricsSink}
+
+def run_sink(spec : tuple, sink : int, kind : str, options : dict):
+    """Read the batches of `sink` of the ring attached with `spec` (see `Ring.spec`), in a process of its own."""
+
+    ring = Ring(*spec)
+    handler = None
+    done = False
+    try:
+        handler = SINK_TYPES[kind](options)
+        for slot in ring.read(sink):
+            handler(slot)
+        done = True
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # the writer no longer waits for a sink which failed
+        if not done:
+            ring.leave(sink)
+        if handler is not None:
+            handler.close()
+        ring.close()
+
+def synthetic_batch(seq : int, size : int = events.BATCH_SIZE, nbFlows : int = 64) -> np.ndarray:
+    """Return batch `seq` of `size` synthetic events, on `nbFlows` flows with consecutive sequence numbers."""
+
+    index = seq * size + np.arange(size, dtype=np.int64)
+    evts = np.zeros(size, dtype=events.EVENT_DTYPE)
+    evts["namespace"] = 123
+    evts["traceType"] = 0x800000
+    evts["extFlags"] = events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM
+    evts["flowId"] = index % nbFlows
+    evts["seqNum"] = index // nbFlows + 1
+    evts["hopLimNodeId"] = (64 << 24) | 1
+    return evts
+
+def parse_sinks(sinks : list) -> list:
+    """Return (kind, policy) of `sinks`, e.g. ipfix:drop."""
+
+    parsed = []
+    for sink in sinks:
+        kind, _, policy = sink.partition(":")
+        if kind not in SINK_TYPES:
+            raise ValueError(f"Unknown sink {kind}, must be one of {list(SINK_TYPES)}")
+        policy = policy or "block"
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid policy {policy}, must be one of {POLICIES}")
+        parsed.append((kind, policy))
+    return parsed
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="fanout",
+        description="Fan out DEX events to several sinks through shared memory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-r", type=str, required=False, default=None, help="Replay recording instead of listening to the kernel")
+    parser.add_argument("-g", type=int, required=False, default=None, help="Publish synthetic batches instead of listening to the kernel")
+    parser.add_argument("-s", type=str, nargs="+", required=False, default=SINKS, help="Sinks, with their policy (block, drop or sample)")
+    parser.add_argument("-c", type=str, required=False, default=f"[{ipfix.COLLECTOR[0]}]:{ipfix.COLLECTOR[1]}", help="IPFIX collector")
+    parser.add_argument("-a", type=str, required=False, default="events.dexa", help="Archive of the archive sink")
+    parser.add_argument("-d", action="store_true", help="Intern the OSS schemas in the IPFIX and archive sinks")
+    parser.add_argument("-k", type=int, required=False, default=NB_SLOTS, help="Number of batches in the ring")
+    parser.add_argument("-b", type=int, required=False, default=events.BATCH_SIZE, help="Maximum number of events in a batch")
+    args = parser.parse_args()
+
+    try:
+        sinks = parse_sinks(args.s)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+
+    if args.k < 2 or args.b <= 0:
+        print("<nb_slots> cannot be < 2 and <batch_size> cannot be <= 0")
+        sys.exit(-1)
+
+    if args.g is not None and args.g <= 0:
+        print("<nb_batches> cannot be <= 0")
+        sys.exit(-1)
+
+    host, port = args.c.rsplit(":", 1)
+    options = {"collector": (host.strip("[]"), int(port)), "archive": args.a, "dedup": args.d}
+    return args.r, args.g, sinks, options, args.k, args.b
+
+if __name__ == "__main__":
+    recording, nbSynthetic, sinks, options, nbSlots, batchSize = check_arguments()
+
+    ring = Ring([policy for _, policy in sinks], nbSlots, batchSize)
+    workers = [multiprocessing.Process(target=run_sink, args=(ring.spec(), i, kind, options)) for i, (kind, _) in enumerate(sinks)]
+    for worker in workers:
+        worker.start()
+    ring.watch(workers)
+
+    batch = events.Batch(batchSize)
+    consumer = None
+    start = time.monotonic()
+    try:
+        if nbSynthetic is not None:
+            for seq in range(nbSynthetic):
+                ring.publish(synthetic_batch(seq, batchSize))
+        elif recording is not None:
+            replay = events.replay(recording, batch)
+            while True:
+                ring.reserve(batch)
+                evts = next(replay, None)
+                if evts is None:
+                    break
+                ring.publish(evts, batch)
+        else:
+            consumer = events.EventSocket()
+            consumer.open()
+            while True:
+                ring.reserve(batch)
+                ring.publish(consumer.consume(batch), batch)
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot listen to IOAM6 events: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if consumer is not None:
+            consumer.close()
+        ring.finish()
+        for worker in workers:
+            worker.join()
+
+    elapsed = time.monotonic() - start
+    print(f"published={int(ring.counters[PUBLISHED])} batches={int(ring.counters[WRITE])} stalls={int(ring.counters[STALLS])} "
+          f"rate={ring.counters[PUBLISHED] / elapsed:.0f} events/s")
+    for (kind, _), stats in zip(sinks, ring.stats()):
+        print(f"  {kind}: " + " ".join(f"{k}={v}" for k, v in stats.items()))
+
+    ring.close()
+    sys.exit(0)
@@ -0,0 +1,388 @@
+"""
+Usage: sudo python3 flows.py [-r <recording>] [-t <idle_timeout>] [-n <max_flows>]
+
+Track the sequence numbers of the DEX flows (see `events.py`), to find where
+DEX packets are lost.
+
+The kernel stamps the Flow ID and a Sequence Number, incremented for each
+DEX packet of the flow, in the extension flags data. For each flow (namespace
+and Flow ID), the table keeps the highest sequence number received and a
+window of the last `WINDOW` sequence numbers, and counts the lost, reordered
+and duplicated packets:
+- a gap in the sequence numbers is counted as lost;
+- a packet older than the highest sequence number, not seen yet, is reordered
+  (and no longer lost);
+- a packet already seen is a duplicate;
+- a packet older than the window cannot be checked and is counted as late
+  (and reordered).
+
+The flows are stored in preallocated arrays (at most `-n` flows), indexed by
+an open addressing hash table, and all events of a batch are processed at
+once. Flows idle for more than `-t` seconds are evicted. When the table is
+full, the least recently seen flows are evicted first.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+import events
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# maximum number of flows
+MAX_FLOWS = 1 << 20
+
+# flows idle for longer are evicted, in seconds
+IDLE_TIMEOUT = 60
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# number of sequence numbers in the window of a flow
+WINDOW = 64
+
+# extension flags required to track a flow
+EXT_FLAGS = events.EXT_FLAG_FLOW_ID | events.EXT_FLAG_SEQ_NUM
+
+# multiplier of the Fibonacci hashing
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+EMPTY = -1
+
+# state of a flow
+# `last` is the highest sequence number, unwrapped to 64 bits
+# bit i of `window` is set if sequence number `last - i` was received
+FLOW_DTYPE = np.dtype([
+    ("key", "u8"), ("namespace", "u2"), ("flowId", "u4"), ("last", "i8"), ("window", "u8"),
+    ("firstSeen", "f8"), ("lastSeen", "f8"),
+    ("received", "u8"), ("lost", "i8"), ("reordered", "u8"), ("duplicates", "u8"), ("late", "u8"),
+])
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def flow_keys(namespace : np.ndarray, flowId : np.ndarray) -> np.ndarray:
+    """Return key of the flows."""
+
+    return (namespace.astype(np.uint64) << np.uint64(32)) | flowId.astype(np.uint64)
+
+def segment_starts(groups : np.ndarray) -> np.ndarray:
+    """Return mask of the first element of each run of equal values in sorted `groups`."""
+
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    return first
+
+class FlowTable:
+    """Per-flow sequence number tracking in bounded memory."""
+
+    def __init__(self, maxFlows : int = MAX_FLOWS, idleTimeout : float = IDLE_TIMEOUT) -> None:
+        self.maxFlows = maxFlows
+        self.idleTimeout = idleTimeout
+
+        # at most half of the slots are used
+        self.bits = max(4, int(2 * maxFlows - 1).bit_length())
+        self.mask = (1 << self.bits) - 1
+        self.slots = np.full(1 << self.bits, EMPTY, dtype=np.int64)
+
+        # flows are stored contiguously in the first `count` rows
+        self.rows = np.zeros(maxFlows, dtype=FLOW_DTYPE)
+        self.count = 0
+
+        self.evicted = 0
+        self.ignored = 0
+
+    def flows(self) -> np.ndarray:
+        """Return view on the tracked flows."""
+
+        return self.rows[:self.count]
+
+    def hash(self, keys : np.ndarray) -> np.ndarray:
+        return ((keys * HASH_MULTIPLIER) >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def lookup(self, keys : np.ndarray) -> np.ndarray:
+        """Return row of each of the `keys`, -1 if not found."""
+
+        rows = np.full(len(keys), EMPTY, dtype=np.int64)
+        slots = self.hash(keys)
+        pending = np.arange(len(keys))
+
+        while len(pending):
+            current = self.slots[slots[pending]]
+            found = current != EMPTY
+            match = found.copy()
+            match[found] = self.rows["key"][current[found]] == keys[pending[found]]
+            rows[pending[match]] = current[match]
+
+            # keep probing after other keys, stop on empty slots
+            pending = pending[found & ~match]
+            slots[pending] = (slots[pending] + 1) & self.mask
+
+        return rows
+
+    def place(self, rows : np.ndarray):
+        """Add `rows`, whose keys are not in the hash table yet, to the hash table."""
+
+        slots = self.hash(self.rows["key"][rows])
+        pending = np.arange(len(rows))
+
+        while len(pending):
+            free = self.slots[slots[pending]] == EMPTY
+
+            # when several rows end on the same free slot, the first one takes it
+            candidates = pending[free]
+            _, first = np.unique(slots[candidates], return_index=True)
+            winners = candidates[first]
+            self.slots[slots[winners]] = rows[winners]
+
+            placed = np.zeros(len(rows), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            slots[pending] = (slots[pending] + 1) & self.mask
+
+    def insert(self, keys : np.ndarray) -> np.ndarray:
+        """Add new flows with unique `keys`. Return their rows."""
+
+        rows = np.arange(self.count, self.count + len(keys))
+        self.rows[rows] = np.zeros(1, dtype=FLOW_DTYPE)
+        self.rows["key"][rows] = keys
+        self.count += len(keys)
+        self.place(rows)
+        return rows
+
+    def rebuild(self, keep : np.ndarray):
+        """Keep the flows of `keep` (mask on the flows) and rebuild the hash table."""
+
+        kept = self.rows[:self.count][keep]
+        self.rows[:len(kept)] = kept
+        self.count = len(kept)
+        self.slots.fill(EMPTY)
+        self.place(np.arange(self.count))
+
+    def evict(self, now : float = None) -> np.ndarray:
+        """Evict the flows idle for more than the idle timeout. Return their state."""
+
+        now = time.monotonic() if now is None else now
+        flows = self.flows()
+        idle = now - flows["lastSeen"] > self.idleTimeout
+        if not idle.any():
+            return np.empty(0, dtype=FLOW_DTYPE)
+
+        evicted = flows[idle].copy()
+        self.rebuild(~idle)
+        self.evicted += len(evicted)
+        return evicted
+
+    def make_room(self, needed : int) -> np.ndarray:
+        """Evict the least recently seen flows until `needed` flows can be added. Return their state."""
+
+        excess = self.count + needed - self.maxFlows
+        if excess <= 0:
+            return np.empty(0, dtype=FLOW_DTYPE)
+
+        flows = self.flows()
+        oldest = np.argpartition(flows["lastSeen"], excess - 1)[:excess] if excess < self.count else np.arange(self.count)
+        keep = np.ones(self.count, dtype=bool)
+        keep[oldest] = False
+
+        evicted = flows[~keep].copy()
+        self.rebuild(keep)
+        self.evicted += len(evicted)
+        return evicted
+
+    def update(self, evts : np.ndarray, now : float = None) -> np.ndarray:
+        """
+        Account the events of a batch, in the order of reception.
+
+        Events without Flow ID and Sequence Number are ignored.
+        Return state of the flows evicted to make room for new flows.
+        """
+
+        now = time.monotonic() if now is None else now
+        tracked = (evts["extFlags"] & EXT_FLAGS) == EXT_FLAGS
+        self.ignored += len(evts) - int(tracked.sum())
+        evts = evts[tracked]
+        if len(evts) == 0:
+            return np.empty(0, dtype=FLOW_DTYPE)
+
+        keys = flow_keys(evts["namespace"], evts["flowId"])
+        uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+        if len(uniqueKeys) > self.maxFlows:
+            raise RuntimeError(f"Batch has {len(uniqueKeys)} flows, more than the table")
+
+        # flows that do not fit are evicted, new flows are added
+        rows = self.lookup(uniqueKeys)
+        evicted = self.make_room(int((rows == EMPTY).sum()))
+        if len(evicted):
+            rows = self.lookup(uniqueKeys)
+        isNew = rows == EMPTY
+        rows[isNew] = self.insert(uniqueKeys[isNew])
+
+        state = self.rows
+        seq = evts["seqNum"].astype(np.int64)
+
+        # new flows start just before their first sequence number received
+        if isNew.any():
+            newRows = rows[isNew]
+            firstIndex = np.full(len(uniqueKeys), len(evts))
+            np.minimum.at(firstIndex, inverse, np.arange(len(evts)))
+            state["namespace"][newRows] = evts["namespace"][firstIndex[isNew]]
+            state["flowId"][newRows] = evts["flowId"][firstIndex[isNew]]
+            state["last"][newRows] = seq[firstIndex[isNew]] - 1
+            state["firstSeen"][newRows] = now
+
+        # unwrap the sequence numbers relative to the highest one of the flow
+        flowRows = rows[inverse]
+        oldLast = state["last"][flowRows]
+        ext = oldLast + ((seq - oldLast) & 0xFFFFFFFF).astype(np.uint32).view(np.int32).astype(np.int64)
+
+        # highest sequence number received before each event, per flow
+        order = np.argsort(inverse, kind="stable")
+        flowSorted = inverse[order]
+        extSorted = ext[order]
+        first = segment_starts(flowSorted)
+        bias = extSorted.min() - 1
+        packed = (flowSorted.astype(np.int64) << 40) | (extSorted - bias)
+        runMax = np.maximum.accumulate(packed)
+        before = np.empty(len(packed), dtype=np.int64)
+        before[1:] = runMax[:-1]
+        before = (before & ((1 << 40) - 1)) + bias
+        before[first] = oldLast[order][first]
+        before = np.maximum(before, oldLast[order])
+
+        isNewMax = extSorted > before
+        gaps = np.where(isNewMax, extSorted - before - 1, 0)
+
+        # duplicates inside the batch: same sequence number already received earlier
+        dupOrder = np.lexsort((order, extSorted, flowSorted))
+        dupSorted = np.zeros(len(order), dtype=bool)
+        same = (flowSorted[dupOrder][1:] == flowSorted[dupOrder][:-1]) & (extSorted[dupOrder][1:] == extSorted[dupOrder][:-1])
+        dupSorted[dupOrder[1:][same]] = True
+
+        # older packets, not duplicated in the batch, checked against the window of the previous batches
+        oldLastSorted = oldLast[order]
+        windowSorted = state["window"][rows[flowSorted]]
+        older = ~isNewMax & ~dupSorted
+        offset = oldLastSorted - extSorted
+        inWindow = older & (offset >= 0) & (offset < WINDOW)
+        seenBefore = np.zeros(len(order), dtype=bool)
+        shift = np.clip(offset, 0, WINDOW - 1).astype(np.uint64)
+        seenBefore[inWindow] = ((windowSorted[inWindow] >> shift[inWindow]) & np.uint64(1)).astype(bool)
+
+        duplicates = dupSorted | seenBefore
+        reordered = older & ~seenBefore
+        late = older & (offset >= WINDOW)
+
+        # per flow counters
+        nbFlows = len(uniqueKeys)
+        received = np.bincount(flowSorted, minlength=nbFlows)
+        lost = np.bincount(flowSorted, weights=gaps, minlength=nbFlows) - np.bincount(flowSorted, weights=reordered, minlength=nbFlows)
+        state["received"][rows] += received.astype(np.uint64)
+        state["lost"][rows] += lost.astype(np.int64)
+        state["reordered"][rows] += np.bincount(flowSorted, weights=reordered, minlength=nbFlows).astype(np.uint64)
+        state["duplicates"][rows] += np.bincount(flowSorted, weights=duplicates, minlength=nbFlows).astype(np.uint64)
+        state["late"][rows] += np.bincount(flowSorted, weights=late, minlength=nbFlows).astype(np.uint64)
+
+        # new highest sequence number and window
+        newLast = np.maximum(state["last"][rows], np.maximum.reduceat(extSorted, np.flatnonzero(first)))
+        delta = newLast - state["last"][rows]
+        window = np.where(delta < WINDOW, state["window"][rows] << np.clip(delta, 0, WINDOW - 1).astype(np.uint64), np.uint64(0))
+        window[delta >= WINDOW] = 0
+
+        recent = (newLast[flowSorted] - extSorted >= 0) & (newLast[flowSorted] - extSorted < WINDOW)
+        bits = np.zeros(len(order), dtype=np.uint64)
+        bits[recent] = np.uint64(1) << (newLast[flowSorted] - extSorted)[recent].astype(np.uint64)
+        np.bitwise_or.at(window, flowSorted, bits)
+
+        state["last"][rows] = newLast
+        state["window"][rows] = window
+        state["lastSeen"][rows] = now
+
+        return evicted
+
+    def totals(self) -> dict:
+        """Return counters summed over the tracked flows."""
+
+        flows = self.flows()
+        return {
+            "flows": self.count, "evicted": self.evicted,
+            "received": int(flows["received"].sum()), "lost": int(flows["lost"].sum()),
+            "reordered": int(flows["reordered"].sum()), "duplicates": int(flows["duplicates"].sum()),
+            "late": int(flows["late"].sum()),
+        }
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="flows",
+        description="Track sequence numbers of DEX flows",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-r", type=str, required=False, default=None, help="Replay recording instead of listening to the kernel")
+    parser.add_argument("-t", type=float, required=False, default=IDLE_TIMEOUT, help="Idle timeout of the flows, in seconds")
+    parser.add_argument("-n", type=int, required=False, default=MAX_FLOWS, help="Maximum number of flows")
+    args = parser.parse_args()
+
+    if args.t <= 0 or args.n <= 0:
+        print("<idle_timeout> and <max_flows> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.r, args.t, args.n
+
+def print_flows(table : FlowTable, nbFlows : int = 10):
+    """Print totals and the flows with most losses."""
+
+    print(" ".join(f"{k}={v}" for k, v in table.totals().items()))
+    print_lossy(table, nbFlows)
+
+def print_lossy(table : FlowTable, nbFlows : int = 10):
+    """Print the `nbFlows` flows with most losses."""
+
+    flows = table.flows()
+    for flow in flows[np.argsort(-flows["lost"])[:nbFlows]]:
+        if flow["lost"] <= 0:
+            break
+        print(f"  ns={flow['namespace']} flow={flow['flowId']:#010x} received={flow['received']} lost={flow['lost']} "
+              f"reordered={flow['reordered']} duplicates={flow['duplicates']} late={flow['late']}")
+
+if __name__ == "__main__":
+    recording, idleTimeout, maxFlows = check_arguments()
+    table = FlowTable(maxFlows, idleTimeout)
+    batch = events.Batch()
+
+    if recording is not None:
+        for evts in events.replay(recording, batch):
+            table.update(evts)
+        print_flows(table)
+        sys.exit(0)
+
+    consumer = events.EventSocket()
+    try:
+        consumer.open()
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot listen to IOAM6 events: {e}")
+        sys.exit(-1)
+
+    last = time.monotonic()
+    try:
+        while True:
+            table.update(consumer.consume(batch))
+            now = time.monotonic()
+            if now - last >= 1:
+                table.evict(now)
+                print_flows(table)
+                last = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        consumer.close()
+
+    sys.exit(0)
@@ -0,0 +1,436 @@
+"""
+Usage: python3 ipfix.py -r <recording> [-c <host>:<port>] [-m <mtu>] [-d]
+       python3 ipfix.py -l <port>
+
+Encode DEX events (see `events.py`) into IPFIX messages (RFC 7011), with the
+enterprise information elements defined in `ioam_dex.xml`.
+
+The elements are compiled once per trace type into a template and a fixed
+record layout (NumPy dtype in network byte order). All records of a trace
+type are then packed at once and split into messages filling the MTU.
+Templates are only sent again every `TEMPLATE_REFRESH` seconds.
+
+With `-d`, the OSS schemas are interned (see `schemas.py`): records carry a
+reference (`IOAM_OSS_REF`) instead of `IOAM_OSS`, and each schema is sent
+once, as an options record (`IOAM_OSS_REF` scope and `IOAM_OSS`).
+
+With `-r`, the events of a recording are exported to the collector given by `-c`.
+With `-l`, a sink counts the messages and records received on a UDP port.
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+
+import events
+import schemas
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# definitions of the information elements
+ELEMENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ioam_dex.xml")
+
+# default collector
+COLLECTOR = ("::1", 4739)
+
+# MTU of the path to the collector
+MTU = 1500
+
+# period of retransmission of the templates, in seconds
+TEMPLATE_REFRESH = 60
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+IPFIX_VERSION = 10
+TEMPLATE_SET_ID = 2
+OPTIONS_TEMPLATE_SET_ID = 3
+FIRST_TEMPLATE_ID = 256
+ENTERPRISE_BIT = 0x8000
+VARIABLE_LENGTH = 65535
+
+# options template of the schemas interned
+SCHEMA_TEMPLATE_ID = 65535
+
+# variable length on 3 bytes beyond
+LONG_LENGTH = 255
+
+# IPv6 + UDP headers
+IP_UDP_OVERHEAD = 48
+
+# version, length, export time, sequence number, observation domain
+MESSAGE_HEADER = struct.Struct("!HHIII")
+SET_HEADER = struct.Struct("!HH")
+
+# element name -> event field and type in the records
+# the id of the elements of the IOAM data is the bit of the trace type
+ELEMENT_FIELDS = {
+    "IOAM_TYPE": ("traceType", ">u4"),
+    "IOAM_HOP_LIM_NODE_ID": ("hopLimNodeId", ">u4"),
+    "IOAM_TIMESTAMP": ("timestamp", ">u4"),
+    "IOAM_TIMESTAMP_FRAC": ("timestampFrac", ">u4"),
+    "IOAM_NAMESPACE": ("namespaceData", ">u4"),
+    "IOAM_HOP_LIM_NODE_ID_WIDE": ("hopLimNodeIdWide", ">u8"),
+    "IOAM_NAMESPACE_WIDE": ("namespaceDataWide", ">u8"),
+    "IOAM_OSS": ("oss", None),
+    "IOAM_OSS_REF": ("ossRef", ">u4"),
+}
+
+# element present in all records
+TYPE_ELEMENT = "IOAM_TYPE"
+
+# elements of the schemas interned
+OSS_ELEMENT = "IOAM_OSS"
+OSS_REF_ELEMENT = "IOAM_OSS_REF"
+
+# trace type has 24 bits
+TRACE_TYPE_BITS = 24
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def load_elements(path : str = ELEMENTS_FILE) -> tuple:
+    """Return PEN and elements (name -> id) defined in the XML file at `path`."""
+
+    root = ET.parse(path).getroot()
+    pen = int(root.find("scope/pen").text)
+    elements = {e.find("name").text: int(e.find("id").text) for e in root.findall("element")}
+
+    return pen, elements
+
+class Layout:
+    """Template and record layout of the events with a given trace type."""
+
+    def __init__(self, traceType : int, templateId : int, pen : int, elements : dict, dedup : bool = False) -> None:
+        """With `dedup`, records have a reference to their schema instead of their OSS data."""
+
+        self.traceType = traceType
+        self.templateId = templateId
+
+        # elements of the record: type first, then data fields in the order of the bits
+        names = [TYPE_ELEMENT]
+        for name, id in sorted(elements.items(), key=lambda e: e[1]):
+            if name != TYPE_ELEMENT and id < TRACE_TYPE_BITS and traceType & (0x800000 >> id):
+                names.append(OSS_REF_ELEMENT if dedup and name == OSS_ELEMENT else name)
+
+        self.fields = []
+        specifiers = b""
+        for name in names:
+            if name not in ELEMENT_FIELDS:
+                raise RuntimeError(f"No event field for element {name}")
+            field, dtype = ELEMENT_FIELDS[name]
+            length = np.dtype(dtype).itemsize if dtype is not None else VARIABLE_LENGTH
+            specifiers += struct.pack("!HHI", elements[name] | ENTERPRISE_BIT, length, pen)
+            if dtype is not None:
+                self.fields.append((field, dtype))
+
+        # OSS is the last bit of the trace type, the variable part is at the end of the record
+        self.oss = OSS_ELEMENT in names
+        self.dtype = np.dtype(self.fields)
+        self.template = struct.pack("!HH", templateId, len(names)) + specifiers
+
+    def pack(self, events : np.ndarray, batch : "events.Batch" = None, refs : np.ndarray = None) -> list:
+        """Pack `events` into records, with the references `refs` to their schema. Return list of (record length, records)."""
+
+        records = np.empty(len(events), dtype=self.dtype)
+        for field, _ in self.fields:
+            # trace type as in the DEX header, followed by the reserved byte
+            if field == "traceType":
+                records[field] = events[field] << 8
+            else:
+                records[field] = refs if field == "ossRef" else events[field]
+
+        if not self.oss:
+            return [(self.dtype.itemsize, records.tobytes())]
+
+        # records with the same length of OSS data are packed together
+        packed = []
+        for ossLen in np.unique(events["ossLen"]):
+            same = events["ossLen"] == ossLen
+            group = events[same]
+            # length on 1 byte, or 255 and length on 2 bytes from 255 (RFC 7011)
+            length = 4 + int(ossLen)
+            prefix = [("len", "u1")] if length < LONG_LENGTH else [("len", "u1"), ("longLen", ">u2")]
+            tail = np.empty(len(group), dtype=prefix + [("schema", ">u4"), ("data", "u1", (int(ossLen),))])
+            if length < LONG_LENGTH:
+                tail["len"] = length
+            else:
+                tail["len"] = LONG_LENGTH
+                tail["longLen"] = length
+            tail["schema"] = group["ossSchemaId"]
+            if ossLen:
+                tail["data"] = batch.u8[group["ossOffset"][:, None].astype(np.int64) + np.arange(ossLen)]
+
+            full = np.empty(len(group), dtype=[("fixed", self.dtype), ("tail", tail.dtype)])
+            full["fixed"] = records[same]
+            full["tail"] = tail
+            packed.append((full.dtype.itemsize, full.tobytes()))
+
+        return packed
+
+class Exporter:
+    """Export DEX events to an IPFIX collector over UDP."""
+
+    def __init__(self, collector : tuple = COLLECTOR, mtu : int = MTU, domain : int = 0,
+                 elementsFile : str = ELEMENTS_FILE, dedup : bool = False, maxSchemas : int = schemas.MAX_SCHEMAS) -> None:
+        self.collector = collector
+        self.maxSize = mtu - IP_UDP_OVERHEAD
+        self.domain = domain
+        self.pen, self.elements = load_elements(elementsFile)
+        self.layouts = {}
+        self.sentTemplates = {}
+        self.seq = 0
+        self.sock = None
+        self.messages = 0
+        self.records = 0
+        self.refused = 0
+        self.schemas = schemas.SchemaCache(maxSchemas) if dedup else None
+
+    def open(self):
+        family = socket.AF_INET6 if ":" in self.collector[0] else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.connect(self.collector)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def layout(self, traceType : int) -> Layout:
+        """Return layout of `traceType`, compiled once."""
+
+        if traceType not in self.layouts:
+            templateId = FIRST_TEMPLATE_ID + len(self.layouts)
+            self.layouts[traceType] = Layout(traceType, templateId, self.pen, self.elements, self.schemas is not None)
+        return self.layouts[traceType]
+
+    def template_set(self, setId : int, templateId : int, template : bytes, now : float) -> bytes:
+        """Return set of `template`, if not sent for `TEMPLATE_REFRESH` seconds."""
+
+        if now - self.sentTemplates.get(templateId, -TEMPLATE_REFRESH) < TEMPLATE_REFRESH:
+            return b""
+        self.sentTemplates[templateId] = now
+        return SET_HEADER.pack(setId, SET_HEADER.size + len(template)) + template
+
+    def encode_schemas(self, new : list, now : float) -> list:
+        """Encode schemas `new` (see `schemas.SchemaCache.intern`) as options records."""
+
+        # scope is the reference, then schema ID and OSS data as IOAM_OSS
+        template = struct.pack("!HHHHHIHHI", SCHEMA_TEMPLATE_ID, 2, 1,
+                               self.elements[OSS_REF_ELEMENT] | ENTERPRISE_BIT, 4, self.pen,
+                               self.elements[OSS_ELEMENT] | ENTERPRISE_BIT, VARIABLE_LENGTH, self.pen)
+
+        records = []
+        for ref, schemaId, data in new:
+            length = 4 + len(data)
+            prefix = struct.pack("!IB", ref, length) if length < LONG_LENGTH else struct.pack("!IBH", ref, LONG_LENGTH, length)
+            records.append(prefix + struct.pack("!I", schemaId) + data)
+
+        messages = []
+        while records:
+            sets = self.template_set(OPTIONS_TEMPLATE_SET_ID, SCHEMA_TEMPLATE_ID, template, now)
+            room = self.maxSize - MESSAGE_HEADER.size - len(sets) - SET_HEADER.size
+            count = 0
+            size = 0
+            while count < len(records) and size + len(records[count]) <= room:
+                size += len(records[count])
+                count += 1
+            if count == 0:
+                raise RuntimeError(f"Schema of {len(records[0])} bytes does not fit in MTU")
+
+            data = b"".join(records[:count])
+            sets += SET_HEADER.pack(SCHEMA_TEMPLATE_ID, SET_HEADER.size + len(data)) + data
+            messages.append(self.message(sets, count))
+            records = records[count:]
+
+        return messages
+
+    def message(self, sets : bytes, nbRecords : int) -> bytes:
+        """Build message containing `sets` with `nbRecords` data records."""
+
+        header = MESSAGE_HEADER.pack(IPFIX_VERSION, MESSAGE_HEADER.size + len(sets), int(time.time()), self.seq, self.domain)
+        self.seq = (self.seq + nbRecords) & 0xFFFFFFFF
+        return header + sets
+
+    def encode(self, evts : np.ndarray, batch : "events.Batch" = None) -> list:
+        """Encode `evts` into messages, filled up to the MTU. `batch` holds their OSS data."""
+
+        messages = []
+        now = time.monotonic()
+
+        # schemas are sent before the records referencing them
+        refs = None
+        if self.schemas is not None:
+            refs, new = self.schemas.intern(evts, batch)
+            messages += self.encode_schemas(new, now)
+
+        for traceType in np.unique(evts["traceType"]):
+            layout = self.layout(int(traceType))
+            template = self.template_set(TEMPLATE_SET_ID, layout.templateId, layout.template, now)
+
+            same = evts["traceType"] == traceType
+            for recordLen, records in layout.pack(evts[same], batch, refs[same] if refs is not None else None):
+                nbRecords = len(records) // recordLen
+                offset = 0
+                while offset < nbRecords:
+                    room = self.maxSize - MESSAGE_HEADER.size - len(template) - SET_HEADER.size
+                    count = min(nbRecords - offset, room // recordLen)
+                    if count <= 0:
+                        raise RuntimeError(f"Records of {recordLen} bytes do not fit in MTU")
+
+                    data = records[offset * recordLen:(offset + count) * recordLen]
+                    sets = template + SET_HEADER.pack(layout.templateId, SET_HEADER.size + len(data)) + data
+                    messages.append(self.message(sets, count))
+
+                    template = b""
+                    offset += count
+
+        return messages
+
+    def export(self, evts : np.ndarray, batch : "events.Batch" = None):
+        """Encode and send `evts` to the collector."""
+
+        for message in self.encode(evts, batch):
+            try:
+                self.sock.send(message)
+            except ConnectionRefusedError:
+                # ICMP port unreachable of a previous message, e.g. collector not running yet
+                self.refused += 1
+                continue
+            self.messages += 1
+        self.records += len(evts)
+
+def parse_templates(data : bytes, offset : int, end : int, options : bool) -> dict:
+    """Return lengths of the fields (`VARIABLE_LENGTH` if variable) of each template of the set in `data[offset:end]`."""
+
+    templates = {}
+    while offset + 4 <= end:
+        templateId, nbFields = struct.unpack_from("!HH", data, offset)
+        offset += 6 if options else 4
+        lengths = []
+        for _ in range(nbFields):
+            id, length = struct.unpack_from("!HH", data, offset)
+            lengths.append(length)
+            offset += 8 if id & ENTERPRISE_BIT else 4
+        templates[templateId] = lengths
+    return templates
+
+def count_records(lengths : list, data : bytes, offset : int, end : int) -> int:
+    """Return number of records with fields of `lengths` in `data[offset:end]`, walked if some are variable-length."""
+
+    if VARIABLE_LENGTH not in lengths:
+        return (end - offset) // sum(lengths) if sum(lengths) else 0
+
+    nbRecords = 0
+    while True:
+        for length in lengths:
+            if length == VARIABLE_LENGTH:
+                if offset >= end:
+                    return nbRecords
+                length = data[offset]
+                offset += 1
+                if length == LONG_LENGTH:
+                    if offset + 2 > end:
+                        return nbRecords
+                    length = struct.unpack_from("!H", data, offset)[0]
+                    offset += 2
+            offset += length
+        # the remaining bytes are padding
+        if offset > end:
+            return nbRecords
+        nbRecords += 1
+
+def count_message(data : bytes, templates : dict) -> int:
+    """Return number of data records of message `data`, adding its templates to `templates`."""
+
+    nbRecords = 0
+    offset = MESSAGE_HEADER.size
+    while offset + SET_HEADER.size <= len(data):
+        setId, setLen = SET_HEADER.unpack_from(data, offset)
+        if setLen < SET_HEADER.size:
+            break
+        end = min(offset + setLen, len(data))
+        if setId in (TEMPLATE_SET_ID, OPTIONS_TEMPLATE_SET_ID):
+            templates.update(parse_templates(data, offset + SET_HEADER.size, end, setId == OPTIONS_TEMPLATE_SET_ID))
+        elif setId in templates:
+            nbRecords += count_records(templates[setId], data, offset + SET_HEADER.size, end)
+        offset += setLen
+    return nbRecords
+
+def sink(port : int):
+    """Count IPFIX messages and data records, including options records, received on UDP `port`. See `collector.py` to decode them."""
+
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.bind(("::", port))
+    templates = {}
+    nbMessages = 0
+    nbRecords = 0
+    last = time.monotonic()
+
+    sock.settimeout(1)
+
+    while True:
+        if time.monotonic() - last >= 1:
+            print(f"messages={nbMessages} records={nbRecords} templates={len(templates)}")
+            last = time.monotonic()
+
+        try:
+            data = sock.recv(65535)
+        except socket.timeout:
+            continue
+        nbMessages += 1
+        nbRecords += count_message(data, templates)
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="ipfix",
+        description="Export DEX events with IPFIX",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-r", type=str, required=False, default=None, help="Recording of events to export")
+    parser.add_argument("-c", type=str, required=False, default=f"[{COLLECTOR[0]}]:{COLLECTOR[1]}", help="Collector")
+    parser.add_argument("-m", type=int, required=False, default=MTU, help="MTU")
+    parser.add_argument("-l", type=int, required=False, default=None, help="Run sink on given UDP port")
+    parser.add_argument("-d", action="store_true", help="Intern the OSS schemas")
+    args = parser.parse_args()
+
+    if args.r is None and args.l is None:
+        print("One of <recording> or <port> is required")
+        sys.exit(-1)
+
+    host, port = args.c.rsplit(":", 1)
+    return args.r, (host.strip("[]"), int(port)), args.m, args.l, args.d
+
+if __name__ == "__main__":
+    recording, collector, mtu, port, dedup = check_arguments()
+
+    if port is not None:
+        try:
+            sink(port)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    exporter = Exporter(collector, mtu, dedup=dedup)
+    exporter.open()
+    batch = events.Batch()
+    for evts in events.replay(recording, batch):
+        exporter.export(evts, batch)
+    exporter.close()
+
+    print(f"Exported {exporter.records} records in {exporter.messages} messages ({exporter.refused} refused)")
+    if exporter.schemas is not None:
+        print(schemas.format_stats(exporter.schemas.stats()))
+    sys.exit(0)
@@ -0,0 +1,183 @@
+"""
+Usage: python3 schemas.py -r <recording> [-m <max_schemas>]
+
+Interning of the Opaque State Snapshots (OSS) of the DEX events.
+
+When bit 22 of the trace type is set, the kernel attaches the whole schema of
+the namespace (schema ID and OSS data) to every event, although it rarely
+changes. The archive (`archive.py`) and the IPFIX exporter (`ipfix.py`) can
+instead intern the schemas by schema ID and hash of the data in a bounded
+cache (`SchemaCache`): each record then only carries a reference to the
+schema, whose data is written or sent once, the first time it is seen (or
+seen again after being evicted from the cache).
+
+The distinct schemas of a batch are found at once with NumPy, so that only
+they are hashed and looked up in the cache.
+
+With `-r`, the events of a recording are interned and the hit rate and the
+bytes saved are printed.
+"""
+
+import sys
+import hashlib
+import argparse
+from collections import OrderedDict
+import numpy as np
+
+import events
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# maximum number of schemas in the cache, the least recently used are evicted
+MAX_SCHEMAS = 4096
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# size of the hash of the OSS data
+DIGEST_SIZE = 8
+
+# reference of the events without schema
+NO_REF = 0
+
+# size of a reference, replacing the schema ID and OSS data of an event
+REF_SIZE = 4
+
+# OSS in the trace type
+TRACE_TYPE_OSS = 0x800000 >> events.OSS_BIT
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def schema_key(schemaId : int, data : bytes) -> tuple:
+    return schemaId, hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+class SchemaCache:
+    """Bounded cache of the schemas, by schema ID and hash of the OSS data."""
+
+    def __init__(self, maxSchemas : int = MAX_SCHEMAS) -> None:
+        if maxSchemas <= 0:
+            raise RuntimeError("Number of schemas of the cache cannot be <= 0")
+
+        self.maxSchemas = maxSchemas
+        self.refs = OrderedDict()
+        self.nextRef = 1
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def intern(self, evts : np.ndarray, batch) -> tuple:
+        """
+        Return reference of the schema of each of `evts` (`NO_REF` without OSS), whose OSS data is held by `batch`.
+
+        Return also the schemas not in the cache before, to be written or sent once: list of (reference, schema ID, OSS data).
+        """
+
+        refs = np.full(len(evts), NO_REF, dtype=np.uint32)
+        new = []
+        withOss = np.flatnonzero((evts["traceType"] & TRACE_TYPE_OSS) != 0)
+        if len(withOss) == 0:
+            return refs, new
+
+        lengths = evts["ossLen"][withOss]
+        for length in np.unique(lengths):
+            selected = withOss[lengths == length]
+            length = int(length)
+
+            # schema ID and OSS data of each event as one row, distinct rows hashed once
+            rows = np.empty((len(selected), 4 + length), dtype=np.uint8)
+            rows[:, :4] = evts["ossSchemaId"][selected].astype("<u4").view(np.uint8).reshape(-1, 4)
+            if length:
+                rows[:, 4:] = batch.u8[evts["ossOffset"][selected].astype(np.int64)[:, None] + np.arange(length)]
+            distinct, inverse = np.unique(rows.view(f"V{4 + length}").reshape(-1), return_inverse=True)
+
+            distinctRefs = np.empty(len(distinct), dtype=np.uint32)
+            for i, row in enumerate(distinct):
+                data = row.tobytes()
+                schemaId = int.from_bytes(data[:4], "little")
+                key = schema_key(schemaId, data[4:])
+                ref = self.refs.get(key)
+                if ref is None:
+                    ref = self.insert(key)
+                    new.append((ref, schemaId, data[4:]))
+                    self.bytesOut += 4 + length
+                else:
+                    self.refs.move_to_end(key)
+                    self.hits += 1
+                distinctRefs[i] = ref
+
+            refs[selected] = distinctRefs[inverse.reshape(-1)]
+            # all other events of the batch with the schema are hits
+            self.hits += len(selected) - len(distinct)
+            self.lookups += len(selected)
+            self.bytesIn += len(selected) * (4 + length)
+            self.bytesOut += len(selected) * REF_SIZE
+
+        return refs, new
+
+    def add(self, ref : int, schemaId : int, data : bytes):
+        """Add schema already written or sent with `ref`, e.g. by a previous run."""
+
+        self.refs[schema_key(schemaId, data)] = ref
+        self.nextRef = max(self.nextRef, ref + 1)
+        if len(self.refs) > self.maxSchemas:
+            self.refs.popitem(last=False)
+
+    def insert(self, key : tuple) -> int:
+        ref = self.nextRef
+        self.nextRef += 1
+        self.refs[key] = ref
+        if len(self.refs) > self.maxSchemas:
+            self.refs.popitem(last=False)
+            self.evictions += 1
+        return ref
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups, "hits": self.hits, "hitRate": self.hits / self.lookups if self.lookups else 0.0,
+            "schemas": len(self.refs), "evictions": self.evictions, "bytesSaved": self.bytesIn - self.bytesOut,
+        }
+
+def format_stats(stats : dict) -> str:
+    return (f"lookups={stats['lookups']} hits={stats['hits']} hitRate={stats['hitRate']:.2%} "
+            f"schemas={stats['schemas']} evictions={stats['evictions']} bytesSaved={stats['bytesSaved']}")
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="schemas",
+        description="Intern the OSS schemas of DEX events",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-r", type=str, required=True, help="Recording of events")
+    parser.add_argument("-m", type=int, required=False, default=MAX_SCHEMAS, help="Maximum number of schemas in the cache")
+    args = parser.parse_args()
+
+    if args.m <= 0:
+        print("<max_schemas> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.r, args.m
+
+if __name__ == "__main__":
+    recording, maxSchemas = check_arguments()
+
+    cache = SchemaCache(maxSchemas)
+    batch = events.Batch()
+    try:
+        for evts in events.replay(recording, batch):
+            cache.intern(evts, batch)
+    except (OSError, RuntimeError) as e:
+        print(f"Cannot replay {recording}: {e}")
+        sys.exit(-1)
+
+    print(format_stats(cache.stats()))
+    sys.exit(0)
@@ -0,0 +1,134 @@
+"""
+Usage: python3 -m unittest discover -s dex/tests
+
+Check the decoding of recorded netlink messages (see `events.py`), built with
+the layout of the kernel by `bench.synthetic_batch`.
+"""
+
+import os
+import sys
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import events
+import bench
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def messages(batch : events.Batch) -> list:
+    """Return the messages of `batch`."""
+
+    return [bytes(batch.view[s:s + int(batch.host32[s // 4])]) for s in batch.starts[:batch.count]]
+
+def record(message : bytes) -> bytes:
+    """Return `message` as a record of a recording."""
+
+    return struct.pack("=I", len(message)) + message + b"\x00" * (-len(message) % 4)
+
+def reference(message : bytes) -> dict:
+    """Return fields of `message`, decoded attribute by attribute."""
+
+    formats = {"u1": "B", "host16": "=H", "host32": "=I", "be32": "!I", "be64": "!Q"}
+    fields = {"traceType": 0, "extFlags": 0}
+    for attrType, payload in events.iter_attrs(message, events.NLMSGHDR_SIZE + events.GENLMSGHDR_SIZE, len(message)):
+        if events.IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID <= attrType <= events.IOAM6_EVENT_ATTR_DEX_OSS_SCID:
+            fields["traceType"] |= 0x800000 >> (attrType - events.IOAM6_EVENT_ATTR_DEX_DATA_HOP_LIM_NODE_ID)
+        if attrType == events.IOAM6_EVENT_ATTR_DEX_FLOW_ID:
+            fields["extFlags"] |= events.EXT_FLAG_FLOW_ID
+        if attrType == events.IOAM6_EVENT_ATTR_DEX_SEQ_NUM:
+            fields["extFlags"] |= events.EXT_FLAG_SEQ_NUM
+        field, kind = events.ATTRIBUTES.get(attrType, (None, None))
+        if field is None or (attrType == events.IOAM6_ATTR_PAD and not payload):
+            continue
+        if kind == "oss":
+            fields["ossData"] = bytes(payload)
+        else:
+            fields[field] = struct.unpack_from(formats[kind], payload)[0]
+    return fields
+
+def with_trailing(message : bytes, length : int) -> bytes:
+    """Return `message` followed by `length` zero bytes, counted in its length."""
+
+    return struct.pack("=I", len(message) + length) + message[4:] + b"\x00" * length
+
+class TestDecode(unittest.TestCase):
+
+    def replay(self, records : list, size : int = events.BATCH_SIZE) -> np.ndarray:
+        """Return events of replaying `records`, all in one batch."""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.rec")
+            with open(path, "wb") as f:
+                f.write(b"".join(records))
+            batch = events.Batch(size)
+            return np.concatenate([evts.copy() for evts in events.replay(path, batch)])
+
+    def check(self, evts : np.ndarray, msgs : list, batch : events.Batch = None):
+        """Check `evts` against the reference decoding of `msgs`, and their OSS data held by `batch`."""
+
+        self.assertEqual(len(evts), len(msgs))
+        for evt, message in zip(evts, msgs):
+            expected = reference(message)
+            if "ossData" in expected:
+                self.assertEqual(batch.oss(evt), expected["ossData"])
+            else:
+                self.assertEqual(int(evt["ossLen"]), 0)
+            for field, value in expected.items():
+                if field != "ossData":
+                    self.assertEqual(int(evt[field]), value, field)
+
+    def test_homogeneous(self):
+        for name, corpus in bench.CORPORA.items():
+            with self.subTest(name):
+                batch = bench.synthetic_batch(*corpus, 256)
+                msgs = messages(batch)
+                self.check(events.decode(batch), msgs, batch)
+
+    def test_mixed(self):
+        # messages of all corpora interleaved, replayed in batches smaller than the recording
+        corpora = [messages(bench.synthetic_batch(*corpus, 64, seed=i)) for i, corpus in enumerate(bench.CORPORA.values())]
+        msgs = [m for group in zip(*corpora) for m in group]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.rec")
+            with open(path, "wb") as f:
+                f.write(b"".join(record(m) for m in msgs))
+
+            batch = events.Batch(100)
+            offset = 0
+            for evts in events.replay(path, batch):
+                self.check(evts, msgs[offset:offset + len(evts)], batch)
+                offset += len(evts)
+            self.assertEqual(offset, len(msgs))
+
+    def test_not_dex(self):
+        msgs = messages(bench.synthetic_batch(*bench.CORPORA["0x800000_FLOW_SEQ"], 4))
+        other = bytearray(msgs[1])
+        other[events.NLMSGHDR_SIZE] = events.IOAM6_EVENT_DEX + 1
+
+        evts = self.replay([record(msgs[0]), record(bytes(other)), record(msgs[2]), record(msgs[3])])
+        self.check(evts, [msgs[0], msgs[2], msgs[3]])
+
+    def test_truncated(self):
+        message = messages(bench.synthetic_batch(*bench.CORPORA["0x800000_FLOW_SEQ"], 1))[0]
+        with self.assertRaises(RuntimeError):
+            self.replay([record(message)[:-8]])
+
+    def test_trailing_bytes(self):
+        # layout of a plan, but not its length
+        message = messages(bench.synthetic_batch(*bench.CORPORA["0x800000_FLOW_SEQ"], 2))
+        expected = self.replay([record(m) for m in message])
+
+        for first in ([with_trailing(message[0], 4), message[1]], [message[0], with_trailing(message[1], 4)]):
+            evts = self.replay([record(m) for m in first])
+            self.assertEqual(len(evts), 2)
+            for field in ["namespace", "flowId", "seqNum", "traceType", "extFlags", "hopLimNodeId"]:
+                self.assertTrue(np.array_equal(evts[field], expected[field]), field)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Usage: python3 -m unittest discover -s dex/tests
+
+Check the counters of the flow table of `flows.py` against a reference
+accounting the events one by one.
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import events
+import flows
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+NB_FLOWS = 16
+NB_BATCHES = 8
+BATCH_SIZE = 512
+
+COUNTERS = ["received", "lost", "reordered", "duplicates", "late"]
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def reference(batches : list) -> dict:
+    """Return counters of each flow (namespace, Flow ID) of `batches`, accounted one event at a time."""
+
+    state = {}
+    for evts in batches:
+        # the window of the previous batches is relative to the highest sequence number before the batch
+        before = {}
+        for evt in evts:
+            key = (int(evt["namespace"]), int(evt["flowId"]))
+            seq = int(evt["seqNum"])
+            if key not in state:
+                state[key] = {"last": seq - 1, "seen": set(), **{c: 0 for c in COUNTERS}}
+            flow = state[key]
+            if key not in before:
+                before[key] = (flow["last"], set())
+            oldLast, batchSeen = before[key]
+
+            flow["received"] += 1
+            if seq > flow["last"]:
+                flow["lost"] += seq - flow["last"] - 1
+                flow["last"] = seq
+            elif seq in batchSeen or (seq in flow["seen"] and 0 <= oldLast - seq < flows.WINDOW):
+                flow["duplicates"] += 1
+            else:
+                flow["reordered"] += 1
+                flow["lost"] -= 1
+                flow["late"] += oldLast - seq >= flows.WINDOW
+            batchSeen.add(seq)
+
+        for key, (_, batchSeen) in before.items():
+            state[key]["seen"] |= batchSeen
+
+    return {key: {c: flow[c] for c in COUNTERS} for key, flow in state.items()}
+
+def synthetic_batches(seed : int) -> list:
+    """Return batches of events of `NB_FLOWS` flows with lost, reordered, duplicated and late packets."""
+
+    rng = np.random.default_rng(seed)
+    batches = []
+    nextSeq = np.full(NB_FLOWS, 1000, dtype=np.int64)
+    for _ in range(NB_BATCHES):
+        evts = np.zeros(BATCH_SIZE, dtype=events.EVENT_DTYPE)
+        flow = rng.integers(0, NB_FLOWS, BATCH_SIZE)
+        seq = np.empty(BATCH_SIZE, dtype=np.int64)
+        for i, f in enumerate(flow):
+            # mostly in order, with gaps, duplicates, and packets a few or many packets late
+            seq[i] = nextSeq[f]
+            nextSeq[f] += rng.choice([1, 2, 5], p=[0.9, 0.08, 0.02])
+            kind = rng.random()
+            if kind < 0.05:
+                seq[i] -= rng.integers(1, 10)
+            elif kind < 0.07:
+                seq[i] -= rng.integers(flows.WINDOW, 2 * flows.WINDOW)
+            elif kind < 0.1 and i and flow[i - 1] == f:
+                seq[i] = seq[i - 1]
+
+        evts["namespace"] = 123 + flow % 2
+        evts["flowId"] = flow
+        evts["seqNum"] = seq
+        evts["extFlags"] = flows.EXT_FLAGS
+        batches.append(evts)
+
+    return batches
+
+class TestFlowTable(unittest.TestCase):
+
+    def check(self, table : flows.FlowTable, expected : dict):
+        rows = table.flows()
+        self.assertEqual(len(rows), len(expected))
+        for row in rows:
+            counters = expected[(int(row["namespace"]), int(row["flowId"]))]
+            self.assertEqual({c: int(row[c]) for c in COUNTERS}, counters)
+
+    def test_reference(self):
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                batches = synthetic_batches(seed)
+                table = flows.FlowTable(maxFlows=64)
+                for evts in batches:
+                    table.update(evts, now=0)
+                self.check(table, reference(batches))
+
+    def test_untracked(self):
+        evts = synthetic_batches(0)[0]
+        evts["extFlags"][::2] = events.EXT_FLAG_FLOW_ID
+        table = flows.FlowTable(maxFlows=64)
+        table.update(evts, now=0)
+
+        self.assertEqual(table.ignored, len(evts[::2]))
+        self.check(table, reference([evts[1::2]]))
+
+    def test_wrap(self):
+        evts = np.zeros(4, dtype=events.EVENT_DTYPE)
+        evts["flowId"] = 1
+        evts["seqNum"] = [0xFFFFFFFE, 0xFFFFFFFF, 1, 0]
+        evts["extFlags"] = flows.EXT_FLAGS
+        table = flows.FlowTable(maxFlows=4)
+        table.update(evts, now=0)
+
+        (row,) = table.flows()
+        self.assertEqual({c: int(row[c]) for c in COUNTERS}, {"received": 4, "lost": 0, "reordered": 1, "duplicates": 0, "late": 0})
+
+if __name__ == "__main__":
+    unittest.main()
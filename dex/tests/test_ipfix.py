@@ -0,0 +1,121 @@
+"""
+Usage: python3 -m unittest discover -s dex/tests
+
+Check the IPFIX records of `ipfix.py` decoded by `collector.py`, against the
+events they were built from.
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import events
+import ipfix
+import collector
+import bench
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# lengths of the OSS data, the longest ones with the long form of the variable length (4 + length >= 255)
+OSS_LENGTHS = [8, 250, 251, 260, 1020]
+
+# fields of the events compared with the columns
+EVENT_FIELDS = set(events.EVENT_DTYPE.names)
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def synthetic(corpus : str, size : int, ossLen : int = bench.OSS_LEN) -> tuple:
+    """Return batch of `size` messages of `corpus` with `ossLen` bytes of OSS data, and its events."""
+
+    default = bench.OSS_LEN
+    bench.OSS_LEN = ossLen
+    try:
+        batch = bench.synthetic_batch(*bench.CORPORA[corpus], size)
+    finally:
+        bench.OSS_LEN = default
+    return batch, events.decode(batch)
+
+def expected_oss(evts : np.ndarray, batch : events.Batch) -> bytes:
+    """Return IOAM_OSS of `evts`: schema ID, then OSS data."""
+
+    return b"".join(int(e["ossSchemaId"]).to_bytes(4, "big") + batch.oss(e) for e in evts)
+
+class TestRoundtrip(unittest.TestCase):
+
+    def roundtrip(self, exporter : ipfix.Exporter, evts : np.ndarray, batch : events.Batch) -> tuple:
+        """Return collector fed with the messages of `evts`, and columns of each trace type."""
+
+        messages = exporter.encode(evts, batch)
+        c = collector.Collector()
+        for message in messages:
+            c.feed(memoryview(message))
+        self.assertEqual((c.malformed, c.lost, c.unknown), (0, 0, 0))
+
+        templates = {}
+        counted = sum(ipfix.count_message(m, templates) for m in messages)
+        self.assertEqual(counted, c.records)
+
+        # trace type followed by the reserved byte, as in the DEX header
+        columns = {int(cols[ipfix.TYPE_ELEMENT][0]) >> 8: cols for cols in c.drain().values() if ipfix.TYPE_ELEMENT in cols}
+        return c, columns
+
+    def check_fields(self, columns : dict, evts : np.ndarray):
+        self.assertEqual(set(columns), set(np.unique(evts["traceType"]).tolist()))
+        for traceType, cols in columns.items():
+            same = evts[evts["traceType"] == traceType]
+            for name, values in cols.items():
+                field, _ = ipfix.ELEMENT_FIELDS.get(name, (None, None))
+                if field == "traceType":
+                    self.assertTrue((values == traceType << 8).all(), name)
+                elif field in EVENT_FIELDS:
+                    self.assertTrue(np.array_equal(values, same[field]), name)
+
+    def test_corpora(self):
+        for name in bench.CORPORA:
+            with self.subTest(name):
+                batch, evts = synthetic(name, 512)
+                c, columns = self.roundtrip(ipfix.Exporter(), evts, batch)
+                self.assertEqual(c.records, len(evts))
+                self.check_fields(columns, evts)
+
+    def test_long_oss(self):
+        for ossLen in OSS_LENGTHS:
+            with self.subTest(ossLen):
+                batch, evts = synthetic("0xfff002_FLOW_SEQ_OSS", 8, ossLen)
+                c, columns = self.roundtrip(ipfix.Exporter(), evts, batch)
+                self.check_fields(columns, evts)
+
+                (cols,) = columns.values()
+                lengths, _, data = cols[ipfix.OSS_ELEMENT]
+                self.assertTrue((lengths == 4 + ossLen).all())
+                self.assertEqual(data.tobytes(), expected_oss(evts, batch))
+
+    def test_dedup(self):
+        for ossLen in [8, 1020]:
+            with self.subTest(ossLen):
+                batch, evts = synthetic("0xfff002_FLOW_SEQ_OSS", 8, ossLen)
+                evts["ossSchemaId"] = np.arange(len(evts)) % 3
+                exporter = ipfix.Exporter(dedup=True)
+                c, columns = self.roundtrip(exporter, evts, batch)
+                self.check_fields(columns, evts)
+
+                # each record resolves its reference to the schema ID and OSS data of its event
+                (cols,) = columns.values()
+                resolved = [c.schemas[(0, int(ref))] for ref in cols[ipfix.OSS_REF_ELEMENT]]
+                self.assertEqual([schemaId for schemaId, _ in resolved], evts["ossSchemaId"].tolist())
+                self.assertEqual(b"".join(data for _, data in resolved), b"".join(batch.oss(e) for e in evts))
+
+                # schemas already sent are not sent again
+                records = c.records
+                for message in exporter.encode(evts, batch):
+                    c.feed(memoryview(message))
+                self.assertEqual(c.records - records, len(evts))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Usage: python3 injection.py [-c <captures_dir>] [-t <tolerance>] [-f]
+
+Verify the rate at which the DUT really injects DEX in each test, against
+the frequency k/n of its route.
+
+The DEX packets of a test are counted from its evidence, named after its
+`*_stats.txt` file and looked up next to it (or in `-c`):
+- `*_capture.pcap` or `*_capture.pcapng`: capture of the egress of the DUT,
+  analyzed with `dex/capture.py`. The lengths of the bursts of DEX packets
+  and of the gaps between them are checked against k and n - k;
+- `*_events.rec`: recording of the IOAM6 events of the kernel (see
+  `dex/events.py`), compared to the packets received by the generator.
+
+The measured rate is written in `*_injection.txt`, next to the stats, from
+which the results store takes the `measuredFreq` of the test. The plots
+then label the frequencies with the measured rates.
+Tests whose rate is already up to date with their evidence are skipped,
+unless `-f` is given. Exits with -1 if a rate is off by more than the tolerance.
+"""
+
+import os
+import sys
+import argparse
+
+import results_store
+
+# decoding of the DEX packets and events
+sys.path.append(os.path.join(results_store.EVALUATION_DIR, "..", "dex"))
+import capture
+import events
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# maximum relative error between the measured and the configured rates
+TOLERANCE = 0.01
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# suffixes of the evidence of a test
+CAPTURE_SUFFIXES = ["_capture.pcap", "_capture.pcapng"]
+EVENTS_SUFFIX = "_events.rec"
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def find_evidence(path : str, capturesDir : str = None) -> tuple:
+    """Return kind ("capture" or "events") and path of the evidence of the test whose raw data is in `path`. None if missing."""
+
+    prefix = os.path.basename(path).removesuffix(results_store.STATS_SUFFIX)
+    dirs = [os.path.dirname(path)] + ([capturesDir] if capturesDir is not None else [])
+
+    for dirPath in dirs:
+        for suffix in CAPTURE_SUFFIXES:
+            candidate = os.path.join(dirPath, prefix + suffix)
+            if os.path.isfile(candidate):
+                return "capture", candidate
+        candidate = os.path.join(dirPath, prefix + EVENTS_SUFFIX)
+        if os.path.isfile(candidate):
+            return "events", candidate
+
+    return None, None
+
+def count_capture(path : str, freq : tuple) -> dict:
+    """Return number of IPv6 and DEX packets of the capture at `path`, and their bursts."""
+
+    totals = capture.analyze(path, freq).totals()
+    names = ["bursts", "burstMean", "burstMin", "burstMax", "burstConforming", "gaps", "gapMean", "gapMin", "gapMax", "gapConforming"]
+    return {"packets": totals["ipv6"], "dex": totals["dex"], **{k: totals[k] for k in names if k in totals}}
+
+def count_events(path : str, statsPath : str, experiment : str) -> dict:
+    """Return number of packets received by the generator during the test, and of events in the recording at `path`."""
+
+    batch = events.Batch()
+    nbEvents = sum(len(e) for e in events.replay(path, batch))
+    nbPackets = sum(results_store.parse_file(statsPath, experiment)["ipackets"])
+    return {"packets": nbPackets, "dex": nbEvents}
+
+def measure(source : str, capturesDir : str = None, force : bool = False) -> dict:
+    """
+    Measure the injection rate of test `source` (relative to `EVALUATION_DIR`) and write it next to its stats.
+
+    Return the measured rate, as read by the results store, or None if the test has no evidence.
+    """
+
+    path = os.path.join(results_store.EVALUATION_DIR, source)
+    output = results_store.injection_path(path)
+    kind, evidence = find_evidence(path, capturesDir)
+    if evidence is None:
+        return None
+
+    if not force and os.path.isfile(output) and os.path.getmtime(output) >= max(os.path.getmtime(evidence), os.path.getmtime(path)):
+        return results_store.read_injection(path)
+
+    params = results_store.parse_filename(os.path.basename(path))
+    k, n = params["nbIOAM"], params["nbMTU"] + params["nbIOAM"]
+    freq = (k, n) if k > 0 else None
+
+    if kind == "capture":
+        counts = count_capture(evidence, freq)
+    else:
+        counts = count_events(evidence, path, os.path.dirname(source))
+
+    measured = counts["dex"] / counts["packets"] if counts["packets"] else 0.0
+    configured = k / n
+    error = (measured - configured) / configured if configured else measured
+
+    values = {
+        "evidence": kind, **counts, "measured": f"{measured:.6f}", "configured": f"{configured:.6f}", "error": f"{error:.6f}",
+    }
+    with open(output, "w") as f:
+        f.write(results_store.SEPARATOR.join(f"{k}={v}" for k, v in values.items() if v is not None) + "\n")
+
+    return results_store.read_injection(path)
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="injection",
+        description="Verify the measured DEX injection rate of the tests",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-c", type=str, required=False, default=None, help="Directory with the evidence of the tests, besides the data directories")
+    parser.add_argument("-t", type=float, required=False, default=TOLERANCE, help="Maximum relative error of the injection rate")
+    parser.add_argument("-f", action="store_true", help="Measure all tests again")
+    args = parser.parse_args()
+
+    if args.c is not None and not os.path.isdir(args.c):
+        print(f"Directory {args.c} does not exist")
+        sys.exit(-1)
+
+    if args.t < 0:
+        print("<tolerance> cannot be < 0")
+        sys.exit(-1)
+
+    return args.c, args.t, args.f
+
+if __name__ == "__main__":
+    capturesDir, tolerance, force = check_arguments()
+
+    nbMismatches = 0
+    for source in sorted(results_store.list_files()):
+        try:
+            values = measure(source, capturesDir, force)
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"Cannot measure {source}: {e}")
+            continue
+        if values is None:
+            continue
+
+        error = float(values["error"])
+        mismatch = abs(error) > tolerance
+        nbMismatches += mismatch
+        bursts = f" bursts={values.get('burstMean')} gaps={values.get('gapMean')}" if "bursts" in values else ""
+        print(f"{'MISMATCH ' if mismatch else ''}{source}: measured={values['measured']} configured={values['configured']} error={error:+.2%}{bursts}")
+
+    if nbMismatches:
+        print(f"{nbMismatches} tests with an injection rate off by more than {tolerance:.2%}")
+        sys.exit(-1)
+
+    sys.exit(0)
@@ -0,0 +1,167 @@
+"""
+Usage: python3 render_all.py [-j <nb_jobs>] [-f]
+
+Render all figures of the evaluation concurrently.
+
+Each figure is rendered by its `plot_*.py` script, in its own directory,
+inside a pool of processes using a headless matplotlib backend.
+Figures whose input data and plot script did not change since the last
+rendering are skipped, unless `-f` is given.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import results_store
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# fingerprints of the figures rendered previously
+FINGERPRINTS_FILE = os.path.join(results_store.STORE_DIR, "figures.json")
+
+# modules shared by the plot scripts, part of the plot parameters
+SHARED_MODULES = ["GenericPlotting.py", "results_store.py", "summary.py"]
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# script, function to call, input data and output files, relative to `EVALUATION_DIR`
+FIGURES = [
+    ("encap/plot_data.py", "plot_data", ["encap/data/data"], ["encap/encap_data.csv", "encap/encap_data.pdf"]),
+    ("encap/plot_mode.py", "plot_mode", ["encap/data/mode"], ["encap/encap_mode.csv", "encap/encap_mode.pdf"]),
+    ("encap/plot_extflag.py", "plot_extflag", ["encap/data/extflags"], ["encap/encap_extflags.csv", "encap/encap_extflags.pdf"]),
+    ("transit/plot_data.py", "plot_data", ["transit/data"], ["transit/transit_data.csv", "transit/transit_data.pdf"]),
+    ("transit/plot_extflag.py", "plot_extflag", ["transit/data"], ["transit/transit_extflag.csv", "transit/transit_extflag.pdf"]),
+    ("decap/plot_data.py", "plot_data", ["decap/data"], ["decap/dacap_data.csv", "decap/dacap_data.pdf"]),
+    ("decap/plot_extflag.py", "plot_extflag", ["decap/data"], ["decap/dacap_extflag.csv", "decap/dacap_extflag.pdf"]),
+    ("drop/plot_drop.py", "plot", ["drop/drop.txt"], ["drop/drop.pdf"]),
+]
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def fingerprint(script : str, inputs : list, manifest : dict) -> str:
+    """Return fingerprint of the plot `script`, the shared modules and the `inputs` of a figure."""
+
+    h = hashlib.sha1()
+
+    for path in [script, *SHARED_MODULES]:
+        absPath = os.path.join(results_store.EVALUATION_DIR, path)
+        if os.path.isfile(absPath):
+            h.update(f"{path}:{results_store.hash_file(absPath)}\n".encode())
+
+    for path in inputs:
+        if path in results_store.DATA_DIRS:
+            # content of the raw data already hashed by the results store
+            for source in sorted(s for s in manifest if s.startswith(f"{path}/")):
+                h.update(f"{source}:{manifest[source]}\n".encode())
+        else:
+            absPath = os.path.join(results_store.EVALUATION_DIR, path)
+            h.update(f"{path}:{results_store.hash_file(absPath)}\n".encode())
+
+    return h.hexdigest()
+
+def render(script : str, function : str):
+    """Render figure by calling `function` of `script` from the directory of the script."""
+
+    import matplotlib
+    matplotlib.use("Agg")
+
+    absPath = os.path.join(results_store.EVALUATION_DIR, script)
+    os.chdir(os.path.dirname(absPath))
+    if results_store.EVALUATION_DIR not in sys.path:
+        sys.path.append(results_store.EVALUATION_DIR)
+
+    name = script.replace("/", "_").replace(".py", "")
+    spec = importlib.util.spec_from_file_location(name, absPath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    getattr(module, function)()
+
+    matplotlib.pyplot.close("all")
+
+def load_fingerprints() -> dict:
+    """Load fingerprints of the figures rendered previously."""
+
+    try:
+        with open(FINGERPRINTS_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_fingerprints(fingerprints : dict):
+    """Save fingerprints of the rendered figures."""
+
+    os.makedirs(results_store.STORE_DIR, exist_ok=True)
+    with open(FINGERPRINTS_FILE, "w") as f:
+        json.dump(fingerprints, f, indent=4, sort_keys=True)
+
+def render_all(nbJobs : int, force : bool) -> int:
+    """Render outdated figures using `nbJobs` processes. Return number of failures."""
+
+    # bring the store up to date before workers read it concurrently
+    results_store.ingest()
+    _, manifest = results_store.read_store()
+    manifest = {row.source: row.hash for row in manifest.itertuples(index=False)}
+
+    previous = load_fingerprints()
+    current = dict(previous)
+
+    todo = {}
+    for script, function, inputs, outputs in FIGURES:
+        fp = fingerprint(script, inputs, manifest)
+        missing = any(not os.path.exists(os.path.join(results_store.EVALUATION_DIR, o)) for o in outputs)
+        if not force and not missing and previous.get(script) == fp:
+            print(f"Skipping {script} (up to date)")
+            continue
+        todo[script] = (function, fp)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=nbJobs) as pool:
+        futures = {pool.submit(render, script, function): script for script, (function, _) in todo.items()}
+        for future in as_completed(futures):
+            script = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                current.pop(script, None)
+                print(f"\033[91m[ERROR] Could not render {script}: {e}\033[0m")
+                continue
+            current[script] = todo[script][1]
+            print(f"Rendered {script}")
+
+    save_fingerprints(current)
+    return failures
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="render_all",
+        description="Render all figures of the evaluation",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-j", type=int, required=False, default=os.cpu_count(), help="Number of processes")
+    parser.add_argument("-f", action="store_true", help="Render all figures even if up to date")
+    args = parser.parse_args()
+
+    if args.j <= 0:
+        print("<nb_jobs> cannot be <= 0")
+        sys.exit(-1)
+
+    return args.j, args.f
+
+if __name__ == "__main__":
+    nbJobs, force = check_arguments()
+    sys.exit(-1 if render_all(nbJobs, force) else 0)
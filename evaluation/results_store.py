@@ -0,0 +1,301 @@
+"""
+Columnar store of the results of the evaluation.
+
+Parse once all `*_stats.txt` files found in the `data` directories of the
+encapsulating, transit and decapsulating nodes, and keep them in a typed
+Parquet table (one row per iteration of a test).
+
+Only the files whose mtime/size changed, and whose content hash differs,
+are parsed again when the store is loaded.
+
+The injection rate measured by `injection.py` for a test, if any, is read
+from the `*_injection.txt` file next to its stats.
+
+Usage: python3 results_store.py
+"""
+
+import os
+import re
+import sys
+import hashlib
+import pandas
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# root of the evaluation
+EVALUATION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# directories containing raw data, relative to `EVALUATION_DIR`
+DATA_DIRS = ["encap/data/data", "encap/data/mode", "encap/data/extflags", "transit/data", "decap/data"]
+
+# location of the store
+STORE_DIR = os.path.join(EVALUATION_DIR, ".cache")
+STORE_FILE = os.path.join(STORE_DIR, "results.parquet")
+MANIFEST_FILE = os.path.join(STORE_DIR, "manifest.parquet")
+
+# separator of columns in raw data
+SEPARATOR = ";"
+
+# suffixes of the raw data of a test and of its measured injection rate
+STATS_SUFFIX = "_stats.txt"
+INJECTION_SUFFIX = "_injection.txt"
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# default trace type and extension flags when not part of the name of the file
+DEFAULT_TRACE_TYPE = 0x800000
+DEFAULT_EXT_FLAGS = 0x00
+
+# extension flags as named in the IOAM packets of `var_freq_dex.py`
+EXT_FLAGS_NAMES = {"NO_EXT": 0x00, "FLOW": 0x80, "FLOW_SEQ": 0xC0}
+
+# columns of the store and their types
+COLUMNS = {
+    "experiment": "category", "source": "string", "role": "category", "mode": "category",
+    "extFlags": "uint8", "traceType": "uint32", "nbMTU": "int64", "nbIOAM": "int64", "freq": "float64",
+    "measuredFreq": "float64", "nbFlows": "int64", "sizes": "category", "nbQueues": "int64", "pinning": "category",
+    "iteration": "int64", "pps": "float64", "bps": "float64", "ipackets": "int64", "opackets": "int64",
+    "stable": "bool",
+}
+
+MANIFEST_COLUMNS = {"source": "string", "mtime": "int64", "size": "int64", "hash": "string"}
+
+# traffic of the tests without number of flows and sizes in the name of the file
+DEFAULT_NB_FLOWS = 1
+DEFAULT_SIZES = "MTU"
+
+# RX queues of the DUT of the tests without number of queues and pinning in the name of the file, left unchanged
+DEFAULT_NB_QUEUES = 0
+DEFAULT_PINNING = "default"
+
+# e.g. encap_data_0x800000_99_1_stats.txt, transit_INLINE_FLOW_SEQ_800000_f1000_IMIX_0_1_stats.txt,
+# encap_extflag_0x80_q4_spread_99_1_stats.txt
+FILENAME_REGEX = re.compile(
+    r"^(?P<role>encap|transit|decap)_(?P<variant>.+?)(?:_f(?P<nbFlows>\d+)_(?P<sizes>[A-Z]+))?"
+    r"(?:_q(?P<nbQueues>\d+)_(?P<pinning>[a-z]+))?_(?P<nbMTU>\d+)_(?P<nbIOAM>\d+)_stats\.txt$"
+)
+PACKET_REGEX = re.compile(r"^(?P<mode>INLINE|ENCAP)_(?P<extflags>NO_EXT|FLOW_SEQ|FLOW)_(?P<type>[0-9a-fA-F]+)$")
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def parse_filename(filename : str) -> dict:
+    """
+    Extract the parameters of a test from `filename`.
+
+    The names of the files are built by the scripts in `scripts/dut`.
+    """
+
+    match = FILENAME_REGEX.match(filename)
+    if match is None:
+        raise RuntimeError(f"Invalid name of file with stats {filename}")
+
+    role = match.group("role")
+    variant = match.group("variant")
+    nbMTU = int(match.group("nbMTU"))
+    nbIOAM = int(match.group("nbIOAM"))
+    nbFlows = int(match.group("nbFlows") or DEFAULT_NB_FLOWS)
+    sizes = match.group("sizes") or DEFAULT_SIZES
+    nbQueues = int(match.group("nbQueues") or DEFAULT_NB_QUEUES)
+    pinning = match.group("pinning") or DEFAULT_PINNING
+
+    mode = "INLINE"
+    extFlags = DEFAULT_EXT_FLAGS
+    traceType = DEFAULT_TRACE_TYPE
+
+    if role == "encap":
+        test, value = variant.split("_", 1)
+        if test == "data":
+            traceType = int(value, 16)
+        elif test == "extflag":
+            extFlags = int(value, 16)
+        elif test == "mode":
+            mode = value.split(".", 1)[1]
+        else:
+            raise RuntimeError(f"Unknown test {test} in {filename}")
+    else:
+        packet = PACKET_REGEX.match(variant)
+        if packet is None:
+            raise RuntimeError(f"Unknown IOAM packet {variant} in {filename}")
+        mode = packet.group("mode")
+        extFlags = EXT_FLAGS_NAMES[packet.group("extflags")]
+        traceType = int(packet.group("type"), 16)
+
+    return {
+        "role": role, "mode": mode, "extFlags": extFlags, "traceType": traceType,
+        "nbMTU": nbMTU, "nbIOAM": nbIOAM, "freq": float(nbIOAM) / float(nbMTU + nbIOAM),
+        "nbFlows": nbFlows, "sizes": sizes, "nbQueues": nbQueues, "pinning": pinning,
+    }
+
+def injection_path(path : str) -> str:
+    """Return path of the measured injection rate of the test whose raw data is in `path`."""
+
+    return path.removesuffix(STATS_SUFFIX) + INJECTION_SUFFIX
+
+def read_injection(path : str) -> dict:
+    """Return measured injection rate of the test whose raw data is in `path`, as written by `injection.py`. Empty if none."""
+
+    try:
+        with open(injection_path(path), "r") as f:
+            content = f.read().strip()
+    except FileNotFoundError:
+        return {}
+
+    return dict(item.split("=", 1) for item in content.split(SEPARATOR) if item)
+
+def parse_file(path : str, experiment : str) -> dict:
+    """Parse raw data in `path` into columns, one row per iteration."""
+
+    filename = os.path.basename(path)
+    params = parse_filename(filename)
+    params["measuredFreq"] = float(read_injection(path).get("measured", "nan"))
+
+    with open(path, "r") as f:
+        lines = [l.rstrip("\n").split(SEPARATOR) for l in f if l.strip()]
+
+    nbRows = len(lines)
+    columns = {k: [v] * nbRows for k, v in params.items()}
+    columns["experiment"] = [experiment] * nbRows
+    columns["source"] = [filename] * nbRows
+    columns["iteration"] = list(range(nbRows))
+    # first column contains the extra data given to `test_profile_dex.py`
+    columns["pps"] = [float(l[1]) for l in lines]
+    columns["bps"] = [float(l[2]) for l in lines]
+    columns["ipackets"] = [int(l[3]) for l in lines]
+    columns["opackets"] = [int(l[4]) for l in lines]
+    # older data has no stability flag
+    columns["stable"] = [l[5] != "0" if len(l) > 5 else True for l in lines]
+
+    return columns
+
+def hash_file(path : str) -> str:
+    """Return hash of the content of the file at `path`."""
+
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def hash_test(path : str) -> str:
+    """Return hash of the raw data in `path` and of the measured injection rate of the test."""
+
+    digest = hash_file(path)
+    if os.path.isfile(injection_path(path)):
+        digest = hashlib.sha1(f"{digest}:{hash_file(injection_path(path))}".encode()).hexdigest()
+    return digest
+
+def empty_frame(columns : dict) -> pandas.DataFrame:
+    """Return empty dataframe with given `columns` and their types."""
+
+    return pandas.DataFrame({k: pandas.Series(dtype=v) for k, v in columns.items()})
+
+def read_store() -> tuple:
+    """Read store and its manifest from disk. Return empty ones if missing or unreadable."""
+
+    try:
+        runs = pandas.read_parquet(STORE_FILE)
+        manifest = pandas.read_parquet(MANIFEST_FILE)
+    except (OSError, ValueError):
+        return empty_frame(COLUMNS), empty_frame(MANIFEST_COLUMNS)
+
+    # store written with other columns is built again
+    if list(runs.columns) != list(COLUMNS):
+        return empty_frame(COLUMNS), empty_frame(MANIFEST_COLUMNS)
+
+    return runs, manifest
+
+def write_store(runs : pandas.DataFrame, manifest : pandas.DataFrame):
+    """Write store and its manifest on disk."""
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    runs.to_parquet(STORE_FILE, index=False)
+    manifest.to_parquet(MANIFEST_FILE, index=False)
+
+def list_files() -> dict:
+    """
+    Return stat of all raw data files indexed by their path relative to `EVALUATION_DIR`.
+
+    The measured injection rate of a test is part of its stat, so that the
+    test is parsed again when it changes.
+    """
+
+    files = {}
+    for dirPath in DATA_DIRS:
+        absDir = os.path.join(EVALUATION_DIR, dirPath)
+        if not os.path.isdir(absDir):
+            continue
+        entries = {entry.name: entry for entry in os.scandir(absDir) if entry.is_file()}
+        for name, entry in entries.items():
+            if not name.endswith(STATS_SUFFIX):
+                continue
+            stat = entry.stat()
+            mtime, size = stat.st_mtime_ns, stat.st_size
+            injection = entries.get(injection_path(name))
+            if injection is not None:
+                mtime = max(mtime, injection.stat().st_mtime_ns)
+                size += injection.stat().st_size
+            files[f"{dirPath}/{name}"] = (mtime, size)
+    return files
+
+def ingest() -> pandas.DataFrame:
+    """Bring the store up to date with raw data and return all runs."""
+
+    runs, manifest = read_store()
+    files = list_files()
+
+    known = {row.source: (row.mtime, row.size, row.hash) for row in manifest.itertuples(index=False)}
+
+    changed = []
+    newManifest = []
+    dirty = False
+    for source, (mtime, size) in sorted(files.items()):
+        previous = known.get(source)
+        if previous is not None and previous[:2] == (mtime, size):
+            newManifest.append((source, mtime, size, previous[2]))
+            continue
+
+        # touched files with identical content are not parsed again
+        dirty = True
+        digest = hash_test(os.path.join(EVALUATION_DIR, source))
+        newManifest.append((source, mtime, size, digest))
+        if previous is None or previous[2] != digest:
+            changed.append(source)
+
+    removed = set(known) - set(files)
+    if not dirty and not removed:
+        return runs
+
+    # drop outdated rows and parse new data
+    paths = runs["experiment"].astype("string") + "/" + runs["source"]
+    runs = runs[~paths.isin(changed) & ~paths.isin(removed)]
+
+    parsed = []
+    for source in changed:
+        experiment = os.path.dirname(source)
+        parsed.append(pandas.DataFrame(parse_file(os.path.join(EVALUATION_DIR, source), experiment)))
+
+    runs = pandas.concat([runs.astype("object"), *parsed], ignore_index=True).astype(COLUMNS)
+    runs = runs.sort_values(["experiment", "source", "iteration"], ignore_index=True)
+
+    manifest = pandas.DataFrame(newManifest, columns=list(MANIFEST_COLUMNS)).astype(MANIFEST_COLUMNS)
+    write_store(runs, manifest)
+
+    return runs
+
+def load(dirPath : str) -> pandas.DataFrame:
+    """Return runs whose raw data is in directory `dirPath` (relative to the current directory)."""
+
+    experiment = os.path.relpath(os.path.abspath(dirPath), EVALUATION_DIR).replace(os.sep, "/")
+    if experiment not in DATA_DIRS:
+        raise RuntimeError(f"Directory {dirPath} is not part of the store")
+
+    runs = ingest()
+    return runs[runs["experiment"] == experiment].reset_index(drop=True)
+
+if __name__ == "__main__":
+    runs = ingest()
+    print(runs.groupby("experiment", observed=True).size())
+    sys.exit(0)
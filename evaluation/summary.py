@@ -0,0 +1,112 @@
+"""
+Statistics on the results of the evaluation.
+
+Compute, in a single pass over the runs of the results store, the mean,
+variance, standard deviation and 95% student-t confidence interval of
+each test, and arrange them as Frequency x variant matrices for plotting.
+Frequencies are labelled with the injection rates measured by
+`injection.py` when known.
+
+Usage: python3 summary.py
+"""
+
+import sys
+import numpy as np
+import pandas
+import scipy.stats as st
+
+import results_store
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# confidence level of the intervals
+CONFIDENCE = 0.95
+
+# pps are plotted in 10^5
+SCALE = 10**5
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def summarize(runs : pandas.DataFrame, by : list, column : str = "pps", scale : float = SCALE) -> pandas.DataFrame:
+    """
+    Compute statistics of `column` of `runs` for each group of the columns `by`.
+
+    Return one row per group with `n`, `mean`, `var`, `std`, `ciLow` and `ciHigh`.
+    Like the former per-file computation, `var` and `std` are population
+    statistics while the confidence interval relies on the sample standard error.
+    """
+
+    values = runs[column].to_numpy(dtype=np.float64) / scale
+    groups = runs.assign(_value=values).groupby(by, observed=True, sort=True)["_value"]
+
+    n = groups.size()
+    mean = groups.mean().to_numpy()
+    var = groups.var(ddof=0).to_numpy()
+    count = n.to_numpy(dtype=np.float64)
+
+    # student-t quantiles for all groups at once
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sem = np.sqrt(var / (count - 1))
+        halfWidth = st.t.ppf((1 + CONFIDENCE) / 2, count - 1) * sem
+
+    summary = pandas.DataFrame({
+        "n": n.to_numpy(), "mean": mean, "var": var, "std": np.sqrt(var),
+        "ciLow": mean - halfWidth, "ciHigh": mean + halfWidth,
+    }, index=n.index)
+
+    return summary.reset_index()
+
+def default_runs(runs : pandas.DataFrame) -> pandas.DataFrame:
+    """Return stable `runs` with a single flow of MTU packets and the queues of the DUT left unchanged."""
+
+    default = (runs["nbFlows"] == results_store.DEFAULT_NB_FLOWS) & (runs["sizes"] == results_store.DEFAULT_SIZES)
+    default &= (runs["nbQueues"] == results_store.DEFAULT_NB_QUEUES) & (runs["pinning"] == results_store.DEFAULT_PINNING)
+    return runs[default & runs["stable"]]
+
+def build_matrices(runs : pandas.DataFrame, variant : str, variants : list, labels : list,
+                   frequencies : list, frequenciesStr : list) -> tuple:
+    """
+    Build Frequency x variant matrices of means and standard deviations from `runs`.
+
+    `variants` are the values of column `variant` to keep, in the order of the
+    columns, and `labels` their names. Missing tests are left to 0. Only the runs
+    with a single flow of MTU packets and the queues of the DUT left unchanged are
+    kept, and runs flagged as unstable by the generator are left out.
+    """
+
+    summary = summarize(default_runs(runs), ["experiment", "freq", variant])
+
+    matrices = []
+    for value in ["mean", "std"]:
+        df = summary.pivot_table(index="freq", columns=variant, values=value, aggfunc="first", observed=True)
+        df = df.reindex(index=frequencies, columns=variants, fill_value=0.0).fillna(0.0)
+        df.index = pandas.Index(frequenciesStr, name="Frequency")
+        df.columns = pandas.Index(labels)
+        matrices.append(df.astype(np.float64))
+
+    return matrices[0], matrices[1]
+
+def injection_labels(runs : pandas.DataFrame, frequencies : list, frequenciesStr : list) -> list:
+    """
+    Return labels (in %) of `frequencies` with the mean injection rate measured for the runs kept in the matrices.
+
+    Frequencies without measured rate keep their label in `frequenciesStr`.
+    """
+
+    measured = default_runs(runs).groupby("freq")["measuredFreq"].mean()
+    labels = []
+    for freq, label in zip(frequencies, frequenciesStr):
+        rate = measured.get(freq, np.nan)
+        labels.append(label if np.isnan(rate) else f"{rate * 100:.3g}")
+    return labels
+
+if __name__ == "__main__":
+    runs = results_store.ingest()
+    summary = summarize(runs, ["experiment", "mode", "extFlags", "traceType", "nbFlows", "sizes", "nbQueues", "pinning", "nbMTU", "nbIOAM"])
+    with pandas.option_context("display.max_rows", None, "display.width", 200):
+        print(summary)
+    sys.exit(0)
@@ -0,0 +1,243 @@
+"""
+Asynchronous runner for the test campaigns of the DUT.
+
+A single shell is kept open on the generator (the control channel) and
+receives all the commands of the campaign, instead of opening a new SSH
+connection for each command.
+
+While the stats of a test are retrieved from the generator, the routes (and
+RX queues, see `queues.py`) of the DUT are already reconfigured for the next test. The stats of each test
+are streamed back as soon as they are available.
+
+When the DUT is the local machine, the IOAM routes are programmed through
+rtnetlink and atomically replaced, see `rtnetlink.py`.
+
+For testing without generator, the control channel can be any local shell,
+e.g. `ControlChannel("sh")`.
+"""
+
+import sys
+import uuid
+import asyncio
+
+from utilities import *
+from rtnetlink import Ioam6Route, RouteSocket
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# persistent shell on the generator
+CONTROL_CHANNEL_REMOTE = EXEC_CMD_REMOTE.format("sh")
+
+# suffixes of the files of a test on the generator
+STATS_SUFFIX = "_stats.txt"
+SERIES_SUFFIX = "_series.txt"
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Cell:
+    """Single test of a campaign."""
+
+    def __init__(self, description : str, extra : str, statsFile : str, route : str = None, queues = None) -> None:
+        """
+        Parameters:
+        - `description`: printed when the test starts.
+        - `extra`: extra data given to `test_profile_dex.py`, see `build_extra_data`.
+        - `statsFile`: name of the file in which the stats are saved on the generator.
+        - `route`: `Ioam6Route`, or command, configuring the route of the DUT before the test. If None, the route is unchanged.
+        - `queues`: `QueueConfig` of the RX queues of the DUT during the test. If None, the queues are unchanged.
+        """
+
+        if queues is not None:
+            description = f"{description} [{queues}]"
+
+        self.description = description
+        self.extra = extra
+        self.statsFile = statsFile
+        self.seriesFile = statsFile.removesuffix(STATS_SUFFIX) + SERIES_SUFFIX
+        self.route = route
+        self.queues = queues
+
+class ControlChannel:
+    """Persistent shell executing commands one at a time."""
+
+    def __init__(self, command : str = CONTROL_CHANNEL_REMOTE) -> None:
+        """`command` launches the shell, e.g. through SSH on the generator."""
+
+        self.command = command
+        self.process = None
+        self.lock = asyncio.Lock()
+        self.marker = f"__CAMPAIGN_{uuid.uuid4().hex}__"
+
+    async def open(self):
+        self.process = await asyncio.create_subprocess_shell(
+            self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+
+    async def stream(self, cmd : str):
+        """Execute `cmd` and yield its output line by line. Last item is its exit status."""
+
+        async with self.lock:
+            if self.process is None or self.process.returncode is not None:
+                raise RuntimeError("Control channel is closed")
+
+            self.process.stdin.write(f"{cmd} </dev/null\necho \"{self.marker} $?\"\n".encode())
+            await self.process.stdin.drain()
+
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    raise RuntimeError(f"Control channel closed while running: {cmd}")
+
+                line = line.decode().rstrip("\n")
+                if line.startswith(self.marker):
+                    yield int(line.split()[1])
+                    return
+
+                yield line
+
+    async def run(self, cmd : str) -> tuple:
+        """Execute `cmd` and return its exit status and output lines."""
+
+        lines = []
+        async for line in self.stream(cmd):
+            lines.append(line)
+
+        return lines.pop(), lines
+
+    async def close(self):
+        if self.process is None:
+            return
+
+        if self.process.returncode is None:
+            self.process.stdin.write(b"exit\n")
+            await self.process.stdin.drain()
+            self.process.stdin.close()
+            await self.process.wait()
+
+        self.process = None
+
+async def run_local(cmd : str) -> int:
+    """Run `cmd` on the DUT and return its exit status."""
+
+    process = await asyncio.create_subprocess_shell(cmd)
+    return await process.wait()
+
+async def run_dut(cmd : str, dut : ControlChannel = None) -> int:
+    """Run `cmd` on the `dut` (local machine if None) and return its exit status."""
+
+    if dut is None:
+        return await run_local(cmd)
+
+    status, _ = await dut.run(cmd)
+    return status
+
+async def configure(cell : Cell, dut : ControlChannel = None, routes : RouteSocket = None):
+    """Configure the RX queues and route of the `dut` for `cell`, through `routes` if the DUT is local."""
+
+    if cell.queues is not None:
+        for cmd in cell.queues.commands():
+            if await run_dut(cmd, dut) != 0:
+                raise RuntimeError(f"Could not configure RX queues for test {cell.description}")
+
+    if cell.route is None:
+        return
+
+    if isinstance(cell.route, Ioam6Route) and routes is not None:
+        # previous route is replaced without removing it first
+        routes.replace([cell.route])
+        return
+
+    route = cell.route.command() if isinstance(cell.route, Ioam6Route) else cell.route
+
+    await run_dut(REMOVE_IP_ROUTE, dut)
+    if await run_dut(route, dut) != 0:
+        raise RuntimeError(f"Could not add route for test {cell.description}")
+
+async def run_campaign(cells, nbIters : int, channel : ControlChannel, dut : ControlChannel = None,
+                       runProfile : str = RUN_PROFILE_FILE):
+    """
+    Run all `cells` with `nbIters` iterations each, using `channel` to control the generator.
+
+    `cells` can be any iterable, possibly shared with other campaigns running concurrently.
+    The routes are configured on `dut`, or on the local machine if None.
+
+    Yield each cell with the lines of its stats as soon as they are retrieved.
+    """
+
+    cells = iter(cells)
+
+    cell = next(cells, None)
+    if cell is None:
+        return
+
+    # route socket opened on first use, only for a local DUT
+    routes = RouteSocket() if dut is None else None
+    pending = asyncio.ensure_future(configure(cell, dut, routes))
+
+    try:
+        while cell is not None:
+            await pending
+
+            print(f"\n\n~ {cell.description} ~\n")
+
+            # launch trex on remote machine, discarding stats of an interrupted test
+            status, _ = await channel.run(f"rm -f stats.txt series.txt && python3 {runProfile} -n {nbIters} -e {cell.extra}")
+            if status != 0:
+                raise RuntimeError(f"Could not launch TRex for test {cell.description}")
+
+            # retrieve stats of this test while configuring the next one, samples are kept on the generator
+            retrieve = asyncio.ensure_future(channel.run(
+                f"mv stats.txt {cell.statsFile} && {{ mv -f series.txt {cell.seriesFile} 2>/dev/null; cat {cell.statsFile}; }}"
+            ))
+            nextCell = next(cells, None)
+            pending = asyncio.ensure_future(configure(nextCell, dut, routes)) if nextCell is not None else None
+
+            try:
+                status, stats = await retrieve
+            except BaseException:
+                if pending is not None:
+                    pending.cancel()
+                raise
+
+            if status != 0:
+                if pending is not None:
+                    pending.cancel()
+                raise RuntimeError(f"Could not save the stats on the remote machine for test {cell.description}")
+
+            yield cell, stats
+            cell = nextCell
+    finally:
+        if routes is not None:
+            routes.close()
+
+async def run_cells(cells : list, nbIters : int, channelCmd : str = CONTROL_CHANNEL_REMOTE):
+    """Run all `cells` through a new control channel and print the stats of each test."""
+
+    channel = ControlChannel(channelCmd)
+    await channel.open()
+
+    try:
+        async for cell, stats in run_campaign(cells, nbIters, channel):
+            print(f"Stats of {cell.statsFile}:")
+            for line in stats:
+                print(f"  {line}")
+    finally:
+        await channel.close()
+
+def run(cells : list, nbIters : int, dryRun : bool):
+    """Run all `cells` and exit on error. Only print the tests if `dryRun`."""
+
+    if dryRun:
+        for cell in cells:
+            print(f"\n\n~ {cell.description} ~\n")
+        return
+
+    try:
+        asyncio.run(run_cells(cells, nbIters))
+    except RuntimeError as e:
+        print_error(str(e))
+        sys.exit(-2)
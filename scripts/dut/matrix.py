@@ -0,0 +1,238 @@
+"""
+Usage: sudo python3 matrix.py <matrix.json> [-d] [-r]
+
+Run the test matrix described in <matrix.json>. See `matrices` for examples.
+
+The matrix contains:
+- role=encap|transit|decap: operation of the DUT under test;
+- nbIters: number of runs of each test;
+- nbMTUs and nbIOAMs: frequencies of IOAM;
+- modes, extFlags and dataFields: tests of the encapsulating node (see `test_encap_dex.py`);
+- packetNames: tests of the transit and decapsulating nodes (see `test_transit_dex.py`);
+- nbFlows and sizes (optional): numbers of flows and mixes of sizes of the packets, each
+  test is run with all of them (default: a single flow of MTU packets);
+- nbQueues and pinnings (optional): numbers of RX queues of the DUT and pinnings of their
+  IRQs (spread|single, default: spread), see `queues.py`. Each test is run with all of
+  them (default: queues left unchanged);
+- pairs: list of generator/DUT pairs sharing the tests. `generator` and `dut` are the
+  commands launching a shell on each machine. If null, the generator is the one of
+  `utilities.py` and the DUT is the local machine.
+
+Each completed test is recorded in a journal next to <matrix.json>. If the campaign
+is interrupted, running it again resumes after the last completed tests, unless `-r`
+is given.
+
+With `-d`, only print the tests that remain to be run.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+from utilities import *
+from campaign import ControlChannel, CONTROL_CHANNEL_REMOTE, run_campaign, run_dut
+from queues import QueueConfig, PINNINGS
+import test_encap_dex
+import test_transit_dex
+import test_decap_dex
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# configuration of the DUT before/after the tests of each role
+SETUP = {
+    "encap": [],
+    "transit": [DEL_SCHEMA, ADD_NAMESPACE, REMOVE_IP_ROUTE, VANILLA_IP_ROUTE],
+    "decap": [DEL_SCHEMA, ADD_NAMESPACE, REMOVE_IP_ROUTE, VANILLA_IP_ROUTE, "modprobe ip6_tunnel", "ip link set ip6tnl0 up"],
+}
+TEARDOWN = {
+    "encap": [],
+    "transit": [],
+    "decap": ["ip link set ip6tnl0 down"],
+}
+
+# extension of the journal of a matrix
+JOURNAL_EXT = ".journal"
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Journal:
+    """Append-only record of the completed tests of a campaign."""
+
+    def __init__(self, path : str, restart : bool) -> None:
+        """Load journal at `path`. Forget previous tests if `restart`."""
+
+        self.path = path
+        self.done = set()
+
+        if restart and os.path.exists(path):
+            os.remove(path)
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.done = {l.strip() for l in f if l.strip()}
+
+        self.file = None
+
+    def __contains__(self, cell) -> bool:
+        return cell.statsFile in self.done
+
+    def record(self, cell):
+        """Record `cell` as completed, durably."""
+
+        if self.file is None:
+            self.file = open(self.path, "a")
+
+        self.file.write(f"{cell.statsFile}\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done.add(cell.statsFile)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def load_matrix(path : str) -> dict:
+    """Load and check matrix in `path`."""
+
+    with open(path, "r") as f:
+        matrix = json.load(f)
+
+    if matrix.get("role") not in SETUP:
+        raise RuntimeError(f"Invalid role {matrix.get('role')} in {path}")
+    if len(matrix["nbMTUs"]) != len(matrix["nbIOAMs"]):
+        raise RuntimeError("Cannot have nbIOAMs and nbMTUs with different length")
+    if matrix.get("nbIters", 0) <= 0:
+        raise RuntimeError("nbIters cannot be <= 0")
+    if any(f <= 0 for f in matrix.get("nbFlows", [1])):
+        raise RuntimeError("nbFlows cannot be <= 0")
+    if any(q <= 0 for q in matrix.get("nbQueues", [1])):
+        raise RuntimeError("nbQueues cannot be <= 0")
+    if any(p not in PINNINGS for p in matrix.get("pinnings", [])):
+        raise RuntimeError(f"pinnings must be in {PINNINGS}")
+    if not matrix.get("pairs"):
+        matrix["pairs"] = [{"generator": None, "dut": None}]
+
+    return matrix
+
+def expand(matrix : dict) -> list:
+    """Expand `matrix` into the list of its tests, in the order of the test scripts."""
+
+    frequencies = list(zip(matrix["nbMTUs"], matrix["nbIOAMs"]))
+
+    # queues changed as rarely as possible, since it resets the interface
+    queues = [None]
+    if "nbQueues" in matrix:
+        queues = [QueueConfig(q, p) for q in matrix["nbQueues"] for p in matrix.get("pinnings", ["spread"])]
+
+    traffics = [(f, s, q) for q in queues for f in matrix.get("nbFlows", [1]) for s in matrix.get("sizes", ["MTU"])]
+    cells = []
+
+    for traffic in traffics:
+        if matrix["role"] == "encap":
+            for nbMTU, nbIOAM in frequencies:
+                for mode in matrix.get("modes", []):
+                    cells.append(test_encap_dex.cell_mode(test_encap_dex.Mode[mode], nbMTU, nbIOAM, *traffic))
+            for nbMTU, nbIOAM in frequencies:
+                for extflag in matrix.get("extFlags", []):
+                    cells.append(test_encap_dex.cell_extflag(extflag, nbMTU, nbIOAM, *traffic))
+            for nbMTU, nbIOAM in frequencies:
+                for field in matrix.get("dataFields", []):
+                    cells.append(test_encap_dex.cell_trace_type(field, nbMTU, nbIOAM, *traffic))
+        else:
+            module = test_transit_dex if matrix["role"] == "transit" else test_decap_dex
+            for name in matrix["packetNames"]:
+                for nbMTU, nbIOAM in frequencies:
+                    cells.append(module.build_cell(name, nbMTU, nbIOAM, *traffic))
+
+    return cells
+
+async def run_pair(pair : dict, cells, matrix : dict, journal : Journal):
+    """Run `cells`, shared with the other pairs, on the generator/DUT `pair`."""
+
+    generator = ControlChannel(pair.get("generator") or CONTROL_CHANNEL_REMOTE)
+    dut = ControlChannel(pair["dut"]) if pair.get("dut") else None
+
+    await generator.open()
+    if dut is not None:
+        await dut.open()
+
+    try:
+        for cmd in SETUP[matrix["role"]]:
+            if await run_dut(cmd, dut) != 0:
+                print_error(f"Command failed while configuring DUT: {cmd}")
+
+        async for cell, stats in run_campaign(cells, matrix["nbIters"], generator, dut):
+            journal.record(cell)
+            print(f"Completed {cell.statsFile} ({len(stats)} runs)")
+
+        for cmd in TEARDOWN[matrix["role"]]:
+            if await run_dut(cmd, dut) != 0:
+                print_error(f"Command failed while restoring DUT: {cmd}")
+    finally:
+        await generator.close()
+        if dut is not None:
+            await dut.close()
+
+async def run_matrix(matrix : dict, journal : Journal, dryRun : bool):
+    """Run the tests of `matrix` not yet in `journal`, spread across all pairs."""
+
+    cells = expand(matrix)
+    remaining = [c for c in cells if c not in journal]
+
+    print(f"{len(cells) - len(remaining)}/{len(cells)} tests already completed")
+
+    if dryRun:
+        for cell in remaining:
+            print(f"\n\n~ {cell.description} ~\n")
+        return
+
+    # pairs pull the next test from the same iterator
+    shared = iter(remaining)
+    await asyncio.gather(*(run_pair(pair, shared, matrix, journal) for pair in matrix["pairs"]))
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="matrix",
+        description="Run a test matrix",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("matrix", type=str, help="File describing the test matrix")
+    parser.add_argument("-d", action="store_true", help="Dry run")
+    parser.add_argument("-r", action="store_true", help="Restart from scratch, ignoring the journal")
+    args = parser.parse_args()
+
+    return args.matrix, args.d, args.r
+
+if __name__ == "__main__":
+    path, dryRun, restart = check_arguments()
+
+    if not dryRun and not check_root():
+        print_error("Must be running as root")
+        sys.exit(-1)
+
+    try:
+        matrix = load_matrix(path)
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        print_error(f"Invalid matrix {path}: {e}")
+        sys.exit(-1)
+
+    journal = Journal(path + JOURNAL_EXT, restart)
+
+    try:
+        asyncio.run(run_matrix(matrix, journal, dryRun))
+    except RuntimeError as e:
+        print_error(str(e))
+        sys.exit(-2)
+    finally:
+        journal.close()
+
+    sys.exit(0)
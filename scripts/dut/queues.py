@@ -0,0 +1,136 @@
+"""
+Usage: python3 queues.py <nb_queues> <pinning>
+
+Configuration of the RX queues of the DUT and of the CPUs handling them.
+
+The number of queues (combined channels) of the ingress interface is set with
+ethtool, and the IRQ of each queue is pinned on the CPUs of `CPUS`:
+- spread: queue i on the i-th CPU, to measure how DEX scales with the cores;
+- single: all queues on the first CPU.
+irqbalance is stopped so that the pinning is kept.
+
+The configuration is given as shell commands, so that it can be run on a
+remote DUT, and does nothing if the queues are already configured.
+When run directly, print the commands.
+"""
+
+import sys
+import argparse
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# interface receiving the traffic of the generator
+INGRESS_DEV = "ens6f0"
+
+# CPUs handling the queues, in order
+CPUS = "0-15"
+
+# pattern of the names of the IRQs of the queues in /proc/interrupts, e.g. i40e-ens6f0-TxRx-0
+IRQ_PATTERN = "{dev}-TxRx-"
+
+# maximum time for the interface to be up again after changing the queues, in seconds
+LINK_TIMEOUT = 10
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+PINNINGS = ["spread", "single"]
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def parse_cpus(cpus : str) -> list:
+    """Return list of CPUs in `cpus`, e.g. 0-3,8 -> [0, 1, 2, 3, 8]."""
+
+    result = []
+    for part in cpus.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+class QueueConfig:
+    """Number of RX queues of the DUT and pinning of their IRQs."""
+
+    def __init__(self, nbQueues : int, pinning : str = "spread", dev : str = INGRESS_DEV, cpus : str = CPUS) -> None:
+        if nbQueues <= 0:
+            raise RuntimeError("Number of queues cannot be <= 0")
+        if pinning not in PINNINGS:
+            raise RuntimeError(f"Invalid pinning {pinning}, must be one of {PINNINGS}")
+
+        self.nbQueues = nbQueues
+        self.pinning = pinning
+        self.dev = dev
+        self.cpus = parse_cpus(cpus)
+
+        if pinning == "spread" and nbQueues > len(self.cpus):
+            raise RuntimeError(f"Cannot spread {nbQueues} queues on {len(self.cpus)} CPUs")
+
+    def __str__(self) -> str:
+        return f"{self.nbQueues} RX queues, {self.pinning}"
+
+    def suffix(self) -> str:
+        """Return suffix of the variant in the name of the stats."""
+
+        return f"_q{self.nbQueues}_{self.pinning}"
+
+    def queue_cpus(self) -> list:
+        """Return CPU of each queue."""
+
+        if self.pinning == "single":
+            return [self.cpus[0]] * self.nbQueues
+        return self.cpus[:self.nbQueues]
+
+    def commands(self) -> list:
+        """Return commands applying the configuration."""
+
+        current = f"$(ethtool -l {self.dev} | awk '/^Combined/ {{v=$2}} END {{print v}}')"
+        pattern = IRQ_PATTERN.format(dev=self.dev)
+        cpus = " ".join(str(c) for c in self.queue_cpus())
+
+        return [
+            "systemctl stop irqbalance 2>/dev/null; true",
+            # changing the queues resets the interface
+            f"[ \"{current}\" = \"{self.nbQueues}\" ] || "
+            f"{{ ethtool -L {self.dev} combined {self.nbQueues} && "
+            f"timeout {LINK_TIMEOUT} sh -c 'until ip link show {self.dev} | grep -q \"state UP\"; do sleep 0.1; done'; }}",
+            # IRQ of queue i is the i-th of the interface, queue_cpus()[i] is its CPU
+            # in a subshell, to keep the persistent shell of the DUT intact
+            f"( set -- {cpus}; for irq in $(awk -F: '/{pattern}/ {{print $1}}' /proc/interrupts | head -n {self.nbQueues}); "
+            f"do echo $1 > /proc/irq/$irq/smp_affinity_list || exit 1; shift; done )",
+        ]
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="queues",
+        description="Print the commands configuring the RX queues of the DUT",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("nbQueues", type=int, help="Number of RX queues")
+    parser.add_argument("pinning", type=str, choices=PINNINGS, help="Pinning of the queues on the CPUs")
+    args = parser.parse_args()
+
+    return args.nbQueues, args.pinning
+
+if __name__ == "__main__":
+    nbQueues, pinning = check_arguments()
+
+    try:
+        config = QueueConfig(nbQueues, pinning)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(-1)
+
+    for cmd in config.commands():
+        print(cmd)
+
+    sys.exit(0)
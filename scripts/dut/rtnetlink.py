@@ -0,0 +1,287 @@
+"""
+Usage: python3 rtnetlink.py
+
+Program the IOAM DEX routes of the DUT through rtnetlink instead of `ip`.
+
+The ioam6 lightweight tunnel attributes added by `patches/iproute.patch`
+(option type, freq k/n, mode, tunsrc/tundst and DEX header) are encoded
+directly in RTM_NEWROUTE/RTM_DELROUTE messages. All messages of a batch are
+sent at once on a single persistent socket. A route is changed with an
+atomic replace (NLM_F_REPLACE), so there is no window without route between
+two tests.
+
+The encoding does not depend on the kernel: running this file prints the
+messages built for the routes of `utilities.py`, to be compared with the
+ones sent by `ip` (e.g. with `strace -e trace=sendmsg -xx`).
+"""
+
+import os
+import sys
+import socket
+import struct
+
+from utilities import *
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# route of the DUT, see `utilities.py`
+ROUTE_PREFIX = "cd00::"
+ROUTE_PREFIX_LEN = 64
+ROUTE_GATEWAY = "db02::1"
+ROUTE_DEV = "ens6f1"
+ROUTE_NAMESPACE = 123
+ROUTE_TUNSRC = "db02::2"
+ROUTE_TUNDST = "db02::1"
+
+# size of the buffer receiving the acknowledgements
+RECV_SIZE = 65536
+
+# ---------------------------------------
+#           NETLINK
+# ---------------------------------------
+
+# linux/netlink.h
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLA_F_NESTED = 0x8000
+
+# linux/rtnetlink.h
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_NOWHERE = 255
+RTN_UNICAST = 1
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_ENCAP_TYPE = 21
+RTA_ENCAP = 22
+
+# linux/lwtunnel.h
+LWTUNNEL_ENCAP_IOAM6 = 9
+
+# linux/ioam6_iptunnel.h (patched)
+IOAM6_IPTUNNEL_MODE = 1
+IOAM6_IPTUNNEL_DST = 2
+IOAM6_IPTUNNEL_FREQ_K = 4
+IOAM6_IPTUNNEL_FREQ_N = 5
+IOAM6_IPTUNNEL_SRC = 6
+IOAM6_OPTION_TYPE = 7
+IOAM6_IPTUNNEL_DEX = 8
+
+IOAM6_OPTION_TYPE_DEX = 2
+
+IOAM6_IPTUNNEL_MODES = {"inline": 1, "encap": 2, "auto": 3}
+
+# struct nlmsghdr, struct rtmsg and struct rtattr, in host byte order
+NLMSGHDR = struct.Struct("=IHHII")
+RTMSG = struct.Struct("=BBBBBBBBI")
+RTATTR = struct.Struct("=HH")
+
+# struct ioam6_dex_hdr: namespace, flags, extension flags, trace type and reserved byte, in network byte order
+IOAM6_DEX_HDR = struct.Struct("!HBBI")
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Ioam6Route:
+    """Route of the DUT inserting IOAM DEX options."""
+
+    def __init__(self, freqK : int, freqN : int, mode : str = "inline", traceType=0x800000, extFlags=0x00,
+                 tunsrc : str = None, tundst : str = None, namespace : int = ROUTE_NAMESPACE,
+                 prefix : str = ROUTE_PREFIX, prefixLen : int = ROUTE_PREFIX_LEN,
+                 gateway : str = ROUTE_GATEWAY, dev : str = ROUTE_DEV) -> None:
+        """
+        Parameters, as given to `ip -6 route add <prefix>/<prefixLen> encap ioam6 ... via <gateway> dev <dev>`:
+        - `freqK`/`freqN`: IOAM is inserted in `freqK` packets out of `freqN`.
+        - `mode`: inline, encap or auto. `tunsrc` and `tundst` are only used by encap and auto.
+        - `traceType` and `extFlags`: int or string such as "0x800000".
+        """
+
+        if mode not in IOAM6_IPTUNNEL_MODES:
+            raise RuntimeError(f"Invalid ioam6 mode {mode}")
+        if mode != "inline" and tundst is None:
+            raise RuntimeError(f"Mode {mode} requires tundst")
+
+        self.freqK = freqK
+        self.freqN = freqN
+        self.mode = mode
+        self.traceType = int(traceType, 0) if isinstance(traceType, str) else traceType
+        self.extFlags = int(extFlags, 0) if isinstance(extFlags, str) else extFlags
+        self.tunsrc = tunsrc
+        self.tundst = tundst
+        self.namespace = namespace
+        self.prefix = prefix
+        self.prefixLen = prefixLen
+        self.gateway = gateway
+        self.dev = dev
+
+    def command(self) -> str:
+        """Return equivalent `ip` command, for DUTs only reachable through a shell."""
+
+        tunnel = ""
+        if self.mode != "inline":
+            tunnel = f" tunsrc {self.tunsrc}" if self.tunsrc is not None else ""
+            tunnel += f" tundst {self.tundst}"
+
+        return (f"sudo /usr/bin/ip -6 r a {self.prefix}/{self.prefixLen} encap ioam6 freq {self.freqK}/{self.freqN}"
+                f" mode {self.mode}{tunnel} dex ns {self.namespace} trace-type {self.traceType:#x}"
+                f" ext-flags {self.extFlags:#04x} via {self.gateway} dev {self.dev}")
+
+def attr(type : int, payload : bytes) -> bytes:
+    """Encode netlink attribute, padded to 4 bytes."""
+
+    length = RTATTR.size + len(payload)
+    return RTATTR.pack(length, type) + payload + b"\x00" * (-length % 4)
+
+def encode_ioam6_encap(route : Ioam6Route) -> bytes:
+    """Encode the attributes of the ioam6 lightweight tunnel of `route`, in the order of `ip`."""
+
+    dex = IOAM6_DEX_HDR.pack(route.namespace, 0, route.extFlags, route.traceType << 8)
+
+    attrs = attr(IOAM6_OPTION_TYPE, struct.pack("=B", IOAM6_OPTION_TYPE_DEX))
+    attrs += attr(IOAM6_IPTUNNEL_FREQ_K, struct.pack("=I", route.freqK))
+    attrs += attr(IOAM6_IPTUNNEL_FREQ_N, struct.pack("=I", route.freqN))
+    attrs += attr(IOAM6_IPTUNNEL_MODE, struct.pack("=B", IOAM6_IPTUNNEL_MODES[route.mode]))
+    if route.mode != "inline":
+        if route.tunsrc is not None:
+            attrs += attr(IOAM6_IPTUNNEL_SRC, socket.inet_pton(socket.AF_INET6, route.tunsrc))
+        attrs += attr(IOAM6_IPTUNNEL_DST, socket.inet_pton(socket.AF_INET6, route.tundst))
+    attrs += attr(IOAM6_IPTUNNEL_DEX, dex)
+
+    return attrs
+
+def encode_message(type : int, flags : int, seq : int, rtmsg : bytes, attrs : bytes) -> bytes:
+    """Encode netlink message with header, `rtmsg` and `attrs`."""
+
+    payload = rtmsg + attrs
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), type, flags, seq, 0) + payload
+
+def encode_new_route(route : Ioam6Route, seq : int, oif : int, replace : bool = True) -> bytes:
+    """
+    Encode RTM_NEWROUTE message adding `route` through interface index `oif`.
+
+    If `replace`, an existing route to the same prefix is atomically replaced.
+    """
+
+    flags = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | (NLM_F_REPLACE if replace else NLM_F_EXCL)
+    rtmsg = RTMSG.pack(socket.AF_INET6, route.prefixLen, 0, 0, RT_TABLE_MAIN, RTPROT_BOOT, RT_SCOPE_UNIVERSE, RTN_UNICAST, 0)
+
+    attrs = attr(RTA_DST, socket.inet_pton(socket.AF_INET6, route.prefix))
+    attrs += attr(RTA_ENCAP | NLA_F_NESTED, encode_ioam6_encap(route))
+    attrs += attr(RTA_ENCAP_TYPE, struct.pack("=H", LWTUNNEL_ENCAP_IOAM6))
+    attrs += attr(RTA_GATEWAY, socket.inet_pton(socket.AF_INET6, route.gateway))
+    attrs += attr(RTA_OIF, struct.pack("=I", oif))
+
+    return encode_message(RTM_NEWROUTE, flags, seq, rtmsg, attrs)
+
+def encode_del_route(prefix : str, prefixLen : int, seq : int) -> bytes:
+    """Encode RTM_DELROUTE message removing the route to `prefix`/`prefixLen`."""
+
+    rtmsg = RTMSG.pack(socket.AF_INET6, prefixLen, 0, 0, RT_TABLE_MAIN, 0, RT_SCOPE_NOWHERE, 0, 0)
+    attrs = attr(RTA_DST, socket.inet_pton(socket.AF_INET6, prefix))
+
+    return encode_message(RTM_DELROUTE, NLM_F_REQUEST | NLM_F_ACK, seq, rtmsg, attrs)
+
+def decode_acks(data : bytes) -> dict:
+    """Return error code (0 for success) of each acknowledgement in `data`, indexed by sequence number."""
+
+    acks = {}
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        if type == NLMSG_ERROR:
+            acks[seq] = -struct.unpack_from("=i", data, offset + NLMSGHDR.size)[0]
+        offset += (length + 3) & ~3
+
+    return acks
+
+class RouteSocket:
+    """Persistent rtnetlink socket applying batches of route changes."""
+
+    def __init__(self) -> None:
+        self.sock = None
+        self.seq = 0
+        self.ifindexes = {}
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def next_seq(self) -> int:
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return self.seq
+
+    def ifindex(self, dev : str) -> int:
+        """Return index of interface `dev`, resolved once."""
+
+        if dev not in self.ifindexes:
+            self.ifindexes[dev] = socket.if_nametoindex(dev)
+        return self.ifindexes[dev]
+
+    def send(self, messages : dict, ignore : set = frozenset()) -> dict:
+        """
+        Send `messages` (indexed by sequence number) in a single batch and wait for all acknowledgements.
+
+        Errors whose code is in `ignore` are tolerated. Return error code of each message.
+        """
+
+        if self.sock is None:
+            self.open()
+
+        self.sock.sendall(b"".join(messages.values()))
+
+        acks = {}
+        while len(acks) < len(messages):
+            acks.update({s: e for s, e in decode_acks(self.sock.recv(RECV_SIZE)).items() if s in messages})
+
+        # the kernel processes the following messages of a batch even if one fails
+        for seq, error in acks.items():
+            if error != 0 and error not in ignore:
+                raise RuntimeError(f"rtnetlink request {seq} failed: {os.strerror(error)}")
+
+        return acks
+
+    def replace(self, routes : list):
+        """Atomically add or replace all `routes`."""
+
+        self.send({(s := self.next_seq()): encode_new_route(r, s, self.ifindex(r.dev)) for r in routes})
+
+    def delete(self, prefixes : list, missingOk : bool = True):
+        """Remove the routes to `prefixes`, list of (prefix, prefixLen). Missing routes are ignored if `missingOk`."""
+
+        ignore = {3} if missingOk else set()  # ESRCH
+        self.send({(s := self.next_seq()): encode_del_route(p, l, s) for p, l in prefixes}, ignore)
+
+if __name__ == "__main__":
+    routes = [
+        Ioam6Route(1, 10, "inline", "0x800000", "0x00"),
+        Ioam6Route(1, 10, "encap", "0x800000", "0x00", tundst=ROUTE_TUNDST),
+        Ioam6Route(1, 10, "encap", "0x800000", "0x00", tunsrc=ROUTE_TUNSRC, tundst=ROUTE_TUNDST),
+    ]
+
+    for seq, route in enumerate(routes, 1):
+        print(route.command())
+        print(encode_new_route(route, seq, 1).hex())
+    print(REMOVE_IP_ROUTE)
+    print(encode_del_route(ROUTE_PREFIX, ROUTE_PREFIX_LEN, len(routes) + 1).hex())
+
+    sys.exit(0)
@@ -9,6 +9,8 @@ To run on DUT.
 """
 
 from utilities import *
+from campaign import Cell, run
+from queues import QueueConfig
 import os, sys
 
 # ---------------------------------------
@@ -25,6 +27,14 @@ NB_ITERS = 10
 # Enable dry run mode
 DRY_RUN = True
 
+# Numbers of flows and mixes of sizes of the packets (see `var_freq_dex.py`)
+NB_FLOWS = [1]
+SIZES = ["MTU"]
+
+# Configurations of the RX queues of the DUT (see `queues.py`), None to leave them unchanged
+# e.g. [QueueConfig(n) for n in (1, 2, 4, 8)]
+QUEUES = [None]
+
 # ---------------------------------------
 #           PARAMETERS
 # ---------------------------------------
@@ -41,24 +51,15 @@ PACKET_NAMES = [
 #           CODE
 # ---------------------------------------
 
-def test(name: str, nbMTU: int, nbIOAM: int):
-    """Test with given packet `name`."""
-
-    print(f"\n\n~ Test decap with pkt {name} and frequencies {nbMTU}/{nbIOAM} ~\n")
-
-    if DRY_RUN:
-        return
-
-    # launch trex on remote machine
-    data = build_extra_data(name, nbMTU, nbIOAM, False, False)
-    if os.system(EXEC_CMD_REMOTE.format(f"python3 {RUN_PROFILE_FILE} -n {NB_ITERS} -e {data}")) != 0:
-        print_error(f"Error while launching TRex with packet {name} with nbMTU = {nbMTU} and nbIOAM = {nbIOAM}")
-        sys.exit(-2)
+def build_cell(name: str, nbMTU: int, nbIOAM: int, nbFlows: int = 1, sizes: str = "MTU", queues: QueueConfig = None) -> Cell:
+    """Build test with given packet `name`, in `nbFlows` flows of packets of `sizes`, with the RX `queues` of the DUT."""
 
-    # save stats on remote machine
-    if os.system(EXEC_CMD_REMOTE.format(f"mv stats.txt decap_{name}_{nbMTU}_{nbIOAM}_stats.txt")) != 0:
-        print_error(f"Error while saving the stats on the remote machine for packet {name} with nbMTU = {nbMTU} and nbIOAM = {nbIOAM}")
-        sys.exit(-3)
+    return Cell(
+        f"Test decap with pkt {name}, frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}",
+        build_extra_data(name, nbMTU, nbIOAM, False, False, nbFlows, sizes),
+        f"decap_{name}{traffic_suffix(nbFlows, sizes)}{queues_suffix(queues)}_{nbMTU}_{nbIOAM}_stats.txt",
+        queues=queues
+    )
 
 if __name__ == "__main__":
     if not check_root():
@@ -81,9 +82,11 @@ if __name__ == "__main__":
         print_error("Cannot set interface for tunnel")
 
     # test different options
-    for name in PACKET_NAMES:
-        for i in range(len(NB_MTUS)):
-            test(name, NB_MTUS[i], NB_IOAMS[i])
+    cells = [
+        build_cell(name, NB_MTUS[i], NB_IOAMS[i], nbFlows, sizes, queues)
+        for queues in QUEUES for nbFlows in NB_FLOWS for sizes in SIZES for name in PACKET_NAMES for i in range(len(NB_MTUS))
+    ]
+    run(cells, NB_ITERS, DRY_RUN)
 
     # stop tunnel
     if os.system("ip link set ip6tnl0 down"):
@@ -8,6 +8,9 @@ To run on DUT.
 """
 
 from utilities import *
+from campaign import Cell, run
+from queues import QueueConfig
+from rtnetlink import Ioam6Route, ROUTE_TUNSRC, ROUTE_TUNDST
 from enum import Enum
 import os, sys
 
@@ -25,6 +28,14 @@ NB_ITERS = 10
 # Enable dry run mode
 DRY_RUN = True
 
+# Numbers of flows and mixes of sizes of the packets (see `var_freq_dex.py`)
+NB_FLOWS = [1]
+SIZES = ["MTU"]
+
+# Configurations of the RX queues of the DUT (see `queues.py`), None to leave them unchanged
+# e.g. [QueueConfig(n) for n in (1, 2, 4, 8)] to measure how the encap scales with the cores
+QUEUES = [None]
+
 # Enable/disable individual test
 TEST_MODE = True
 TEST_EXT_FLAG = True
@@ -51,107 +62,57 @@ class Mode(Enum):
 
 # --- TEST METHODS ---
 
-def run_tests_mode(mode : Mode, nbMTU : int, nbIOAM : int):
+def cell_mode(mode : Mode, nbMTU : int, nbIOAM : int, nbFlows : int = 1, sizes : str = "MTU", queues : QueueConfig = None) -> Cell:
     """
     Test in different modes with a single data field (bit 0) and no extension flags.
     """
 
     if mode == Mode.INLINE:
-        print(f"Running test on mode inline with and frequencies {nbMTU}/{nbIOAM}...")
+        description = f"Running test on mode inline with and frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}..."
+        route = Ioam6Route(nbIOAM, nbIOAM+nbMTU, "inline", "0x800000", "0x00")
     elif mode == Mode.ENCAP:
-        print(f"Running test on mode encap with and frequencies {nbMTU}/{nbIOAM}...")
+        description = f"Running test on mode encap with and frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}..."
+        route = Ioam6Route(nbIOAM, nbIOAM+nbMTU, "encap", "0x800000", "0x00", tundst=ROUTE_TUNDST)
     elif mode == Mode.ENCAP_TUNSRC:
-        print(f"Running test on mode encap tunsrc with and frequencies {nbMTU}/{nbIOAM}...")
+        description = f"Running test on mode encap tunsrc with and frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}..."
+        route = Ioam6Route(nbIOAM, nbIOAM+nbMTU, "encap", "0x800000", "0x00", tunsrc=ROUTE_TUNSRC, tundst=ROUTE_TUNDST)
     else:
         print_error("Unexpected mode!")
         sys.exit(-1)
 
-    if DRY_RUN:
-        return
-
-    os.system(REMOVE_IP_ROUTE)
-
-    if mode == Mode.INLINE and os.system(INLINE_IP_ROUTE.format(nbIOAM, nbIOAM+nbMTU, "0x800000", "0x00")):
-        print_error(f"Could not add route with extflag 0x00 in {mode} mode")
-        sys.exit(-1)
-    elif mode == Mode.ENCAP and os.system(ENCAP_IP_ROUTE.format(nbIOAM, nbIOAM+nbMTU, "0x800000", "0x00")):
-        print_error(f"Could not add route with extflag 0x00 in {mode} mode")
-        sys.exit(-1)
-    elif mode == Mode.ENCAP_TUNSRC and os.system(ENCAP_TUNSRC_IP_ROUTE.format(nbIOAM, nbIOAM+nbMTU, "0x800000", "0x00")):
-        print_error(f"Could not add route with extflag 0x00 in {mode} mode")
-        sys.exit(-1)
-
-    # launch trex on remote machine
     # name of packet does not matter because it will be replaced by another one inside var_freq_dex.py
     encap = True if mode == Mode.ENCAP or mode == Mode.ENCAP_TUNSRC else False
-    data = build_extra_data("", nbMTU, nbIOAM, True, encap)
-    if os.system(EXEC_CMD_REMOTE.format(f"python3 {RUN_PROFILE_FILE} -n {NB_ITERS} -e {data}")) != 0:
-        print_error(f"Could not launch TRex with mode {mode} and extflag 0x00")
-        sys.exit(-2)
-
-    # save stats on remote machine
-    destFilename = f"encap_mode_{mode}_{nbMTU}_{nbIOAM}_stats.txt"
-    if os.system(EXEC_CMD_REMOTE.format(f"mv stats.txt {destFilename}")) != 0:
-        print_error(f"Could not save the stats on the remote machine for {mode} with extflag 0x00")
-        sys.exit(-3)
-
-def run_tests_extflag(extflag : str, nbMTU : int, nbIOAM : int):
+    data = build_extra_data("", nbMTU, nbIOAM, True, encap, nbFlows, sizes)
+
+    return Cell(description, data, f"encap_mode_{mode}{traffic_suffix(nbFlows, sizes)}{queues_suffix(queues)}_{nbMTU}_{nbIOAM}_stats.txt", route, queues)
+
+def cell_extflag(extflag : str, nbMTU : int, nbIOAM : int, nbFlows : int = 1, sizes : str = "MTU", queues : QueueConfig = None) -> Cell:
     """
     Test in inline mode with a single data field (bit 0) and different extension flags.
     """
 
-    print(f"Running test on extflag {extflag} and frequencies {nbMTU}/{nbIOAM}...")
-
-    if DRY_RUN:
-        return
-
-    os.system(REMOVE_IP_ROUTE)
-
-    if os.system(INLINE_IP_ROUTE.format(nbIOAM, nbIOAM+nbMTU, "0x800000", extflag)):
-        print_error(f"Could not add route with extflag {extflag} in inline mode")
-        sys.exit(-1)
-
-    # launch trex on remote machine
     # name of packet does not matter because it will be replaced by another one inside var_freq_dex.py
-    data = build_extra_data("", nbMTU, nbIOAM, True, False)
-    if os.system(EXEC_CMD_REMOTE.format(f"python3 {RUN_PROFILE_FILE} -n {NB_ITERS} -e {data}")) != 0:
-        print_error(f"Could not launch TRex with mode inline and extflag {extflag}")
-        sys.exit(-2)
-
-    # save stats on remote machine
-    destFilename = f"encap_extflag_{extflag}_{nbMTU}_{nbIOAM}_stats.txt"
-    if os.system(EXEC_CMD_REMOTE.format(f"mv stats.txt {destFilename}")) != 0:
-        print_error(f"Could not save the stats on the remote machine for mode inline with extflag {extflag}")
-        sys.exit(-3)
-
-def run_tests_trace_type(field : str, nbMTU : int, nbIOAM : int):
+    return Cell(
+        f"Running test on extflag {extflag} and frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}...",
+        build_extra_data("", nbMTU, nbIOAM, True, False, nbFlows, sizes),
+        f"encap_extflag_{extflag}{traffic_suffix(nbFlows, sizes)}{queues_suffix(queues)}_{nbMTU}_{nbIOAM}_stats.txt",
+        Ioam6Route(nbIOAM, nbIOAM+nbMTU, "inline", "0x800000", extflag),
+        queues
+    )
+
+def cell_trace_type(field : str, nbMTU : int, nbIOAM : int, nbFlows : int = 1, sizes : str = "MTU", queues : QueueConfig = None) -> Cell:
     """
     Test in inline mode with different data fields and no extension flag.
     """
 
-    print(f"Running test on data field {field} and frequencies {nbMTU}/{nbIOAM}...")
-
-    if DRY_RUN:
-        return
-
-    os.system(REMOVE_IP_ROUTE)
-
-    if os.system(INLINE_IP_ROUTE.format(nbIOAM, nbIOAM+nbMTU, field, "0x00")):
-        print_error(f"Could not add route with data field {field} in inline mode")
-        sys.exit(-1)
-
-    # launch trex on remote machine
     # name of packet does not matter because it will be replaced by another one inside var_freq_dex.py
-    data = build_extra_data("", nbMTU, nbIOAM, True, False)
-    if os.system(EXEC_CMD_REMOTE.format(f"python3 {RUN_PROFILE_FILE} -n {NB_ITERS} -e {data}")) != 0:
-        print_error(f"Could not launch TRex with mode inline and data field {field}")
-        sys.exit(-2)
-
-    # save stats on remote machine
-    destFilename = f"encap_data_{field}_{nbMTU}_{nbIOAM}_stats.txt"
-    if os.system(EXEC_CMD_REMOTE.format(f"mv stats.txt {destFilename}")) != 0:
-        print_error(f"Could not save the stats on the remote machine for mode inline with data field {field}")
-        sys.exit(-3)
+    return Cell(
+        f"Running test on data field {field} and frequencies {nbMTU}/{nbIOAM}, {nbFlows} flows and sizes {sizes}...",
+        build_extra_data("", nbMTU, nbIOAM, True, False, nbFlows, sizes),
+        f"encap_data_{field}{traffic_suffix(nbFlows, sizes)}{queues_suffix(queues)}_{nbMTU}_{nbIOAM}_stats.txt",
+        Ioam6Route(nbIOAM, nbIOAM+nbMTU, "inline", field, "0x00"),
+        queues
+    )
 
 # --- MAIN ---
 
@@ -163,26 +124,31 @@ if __name__ == "__main__":
     if not len(NB_IOAMS) == len(NB_MTUS):
         raise RuntimeError("Cannot have NB_IOAMS and NB_MTUS with different length")
 
-    # run test on mode
-    if TEST_MODE:
-        print("\n~ Test on mode... ~\n")
-        for i in range(len(NB_MTUS)):
-            run_tests_mode(Mode.INLINE, NB_MTUS[i], NB_IOAMS[i])
-            run_tests_mode(Mode.ENCAP, NB_MTUS[i], NB_IOAMS[i])
-            run_tests_mode(Mode.ENCAP_TUNSRC, NB_MTUS[i], NB_IOAMS[i])
-
-    # run test on extflag
-    if TEST_EXT_FLAG:
-        print("\n~ Test on extension flags... ~\n")
-        for i in range(len(NB_MTUS)):
-            for extflag in EXT_FLAGS:
-                run_tests_extflag(extflag, NB_MTUS[i], NB_IOAMS[i])
-
-    # run test on data field
-    if TEST_DATA_FIELD:
-        print("\n~ Test on data fields... ~\n")
-        for i in range(len(NB_MTUS)):
-            for field in DATA_FIELDS:
-                run_tests_trace_type(field, NB_MTUS[i], NB_IOAMS[i])
+    cells = []
+
+    # queues changed as rarely as possible, since it resets the interface
+    traffics = [(f, s, q) for q in QUEUES for f in NB_FLOWS for s in SIZES]
+
+    for traffic in traffics:
+        # test on mode
+        if TEST_MODE:
+            for i in range(len(NB_MTUS)):
+                cells.append(cell_mode(Mode.INLINE, NB_MTUS[i], NB_IOAMS[i], *traffic))
+                cells.append(cell_mode(Mode.ENCAP, NB_MTUS[i], NB_IOAMS[i], *traffic))
+                cells.append(cell_mode(Mode.ENCAP_TUNSRC, NB_MTUS[i], NB_IOAMS[i], *traffic))
+
+        # test on extflag
+        if TEST_EXT_FLAG:
+            for i in range(len(NB_MTUS)):
+                for extflag in EXT_FLAGS:
+                    cells.append(cell_extflag(extflag, NB_MTUS[i], NB_IOAMS[i], *traffic))
+
+        # test on data field
+        if TEST_DATA_FIELD:
+            for i in range(len(NB_MTUS)):
+                for field in DATA_FIELDS:
+                    cells.append(cell_trace_type(field, NB_MTUS[i], NB_IOAMS[i], *traffic))
+
+    run(cells, NB_ITERS, DRY_RUN)
 
     sys.exit(0)
@@ -0,0 +1,70 @@
+"""
+Usage: python3 -m unittest discover -s scripts/dut/tests
+
+Check the rtnetlink messages of `rtnetlink.py` byte for byte against golden
+buffers (`golden/*.hex`, one 32-bit word per group), whose fields follow the
+structures of `patches/iproute.patch`. They can also be compared with the
+messages sent by the patched `ip` (`strace -e trace=sendmsg -xx`). Netlink is
+in host byte order, the golden buffers are little endian.
+"""
+
+import os
+import sys
+import struct
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rtnetlink import *
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+# interface index of the routes
+OIF = 5
+
+# golden buffer of each RTM_NEWROUTE message: route, sequence number and replace
+NEW_ROUTES = {
+    "new_route_inline": (Ioam6Route(1, 10, "inline", "0x800000", "0x00"), 1, True),
+    "new_route_encap": (Ioam6Route(1, 10, "encap", "0x800000", "0x00", tundst=ROUTE_TUNDST), 2, True),
+    "new_route_encap_tunsrc": (Ioam6Route(1, 10, "encap", "0x800000", "0x00", tunsrc=ROUTE_TUNSRC, tundst=ROUTE_TUNDST), 3, True),
+    "new_route_auto_dex": (Ioam6Route(3, 7, "auto", 0xc00000, 0x80, namespace=0xabcd, tundst=ROUTE_TUNDST), 4, True),
+    "new_route_inline_excl": (Ioam6Route(1, 10, "inline", "0x800000", "0x00"), 1, False),
+}
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def golden(name : str) -> bytes:
+    with open(os.path.join(GOLDEN_DIR, f"{name}.hex")) as f:
+        return bytes.fromhex(f.read())
+
+@unittest.skipIf(sys.byteorder != "little", "golden buffers are little endian")
+class TestRtnetlink(unittest.TestCase):
+
+    def test_new_route(self):
+        for name, (route, seq, replace) in NEW_ROUTES.items():
+            with self.subTest(name):
+                self.assertEqual(encode_new_route(route, seq, OIF, replace).hex(" ", 4), golden(name).hex(" ", 4))
+
+    def test_del_route(self):
+        self.assertEqual(encode_del_route(ROUTE_PREFIX, ROUTE_PREFIX_LEN, 9).hex(" ", 4), golden("del_route").hex(" ", 4))
+
+    def test_dex_header(self):
+        # namespace 123, flags, extension flags and trace type 0x800000 followed by the reserved byte
+        message = golden("new_route_inline")
+        dex = struct.pack("=HH", RTATTR.size + IOAM6_DEX_HDR.size, IOAM6_IPTUNNEL_DEX) + bytes.fromhex("007b0000 80000000")
+        self.assertIn(dex, message)
+
+    def test_header(self):
+        length, type, flags, seq, pid = NLMSGHDR.unpack_from(golden("new_route_encap"))
+        self.assertEqual((length, type, flags, seq, pid), (len(golden("new_route_encap")), RTM_NEWROUTE, 0x505, 2, 0))
+
+        length, type, flags, seq, pid = NLMSGHDR.unpack_from(golden("del_route"))
+        self.assertEqual((length, type, flags, seq, pid), (len(golden("del_route")), RTM_DELROUTE, 0x005, 9, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,8 +29,9 @@ EXEC_CMD_REMOTE = "ssh -i id_ed25519 -oStrictHostKeyChecking=no clt@merry.run.mo
 def check_root():
     return os.geteuid() == 0
 
-def build_extra_data(ioamPacketName : str, nbMTU : int, nbIOAM : int, insertionDEX : bool, encapMode : bool):
-    """Build parameters for `test_profile_dex.py`."""
+def build_extra_data(ioamPacketName : str, nbMTU : int, nbIOAM : int, insertionDEX : bool, encapMode : bool,
+                     nbFlows : int = 1, sizes : str = "MTU"):
+    """Build parameters for `test_profile_dex.py`. A single flow of MTU packets is the default traffic."""
 
     if ioamPacketName == "" and not insertionDEX:
         raise RuntimeError("ioam packet name cannot be empty")
@@ -38,6 +39,8 @@ def build_extra_data(ioamPacketName : str, nbMTU : int, nbIOAM : int, insertionD
         raise RuntimeError("nbMTU and nbIOAM cannot be < 0")
     if nbMTU == 0 and nbIOAM == 0:
         raise RuntimeError("Cannot have both nbMTU and nbIOAM set to 0")
+    if nbFlows <= 0:
+        raise RuntimeError("nbFlows cannot be <= 0")
 
     extra = ""
     extra+=f"ioamPacketName={ioamPacketName},"
@@ -46,7 +49,23 @@ def build_extra_data(ioamPacketName : str, nbMTU : int, nbIOAM : int, insertionD
     extra+=f"insertionDEX={insertionDEX},"
     extra+=f"encapMode={encapMode}"
 
+    if not is_default_traffic(nbFlows, sizes):
+        extra+=f",nbFlows={nbFlows},sizes={sizes}"
+
     return extra
 
+def is_default_traffic(nbFlows : int, sizes : str) -> bool:
+    return nbFlows == 1 and sizes == "MTU"
+
+def traffic_suffix(nbFlows : int, sizes : str) -> str:
+    """Return suffix of the variant in the name of the stats, empty for the default traffic."""
+
+    return "" if is_default_traffic(nbFlows, sizes) else f"_f{nbFlows}_{sizes}"
+
+def queues_suffix(queues) -> str:
+    """Return suffix of the `QueueConfig` in the name of the stats, empty if the queues are unchanged."""
+
+    return "" if queues is None else queues.suffix()
+
 def print_error(text: str):
     print(f"\033[91m[ERROR] {text}\033[0m")
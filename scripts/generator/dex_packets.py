@@ -0,0 +1,311 @@
+"""
+Usage: python3 dex_packets.py
+
+Builder of the packets carrying an IOAM DEX option (RFC 9326) in a Hop-by-Hop
+header, used by `var_freq_dex.py`.
+
+The packets are built directly as raw bytes, for any trace type, extension
+flags, namespace and frame length, in inline mode (Ethernet/IPv6/HbH/ICMPv6)
+or encap mode (Ethernet/IPv6/HbH/IPv6/ICMPv6), and memoized. The payload of
+the ICMPv6 echo request fills the frame up to the given length.
+
+Names of packets are <INLINE|ENCAP>_<NO_EXT|FLOW|SEQ|FLOW_SEQ>_<trace type in hex>,
+e.g. INLINE_FLOW_SEQ_800000.
+
+When run directly, the packets are checked against the packets previously
+defined in `var_freq_dex.py` with Scapy (required for the check only).
+
+To put into `/opt/trex/v3.04/stl` on machine running TRex, next to `var_freq_dex.py`.
+"""
+
+import re
+import sys
+import socket
+import struct
+import functools
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# addresses of the packets
+SRC = "ab00::1"
+DST = "cd00::1"
+
+# destination of the outer header in encap mode
+ENCAP_DST = "db01::2"
+
+# values in the DEX option
+NAMESPACE = 0x7b
+FLOW_ID = 0x0bdbe40d
+SEQ_NUM = 1
+
+# length of the frames, without FCS
+FRAME_LEN = 1500
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+ETH_HEADER_LEN = 14
+IPV6_HEADER_LEN = 40
+ICMPV6_HEADER_LEN = 8
+
+ETH_TYPE_IPV6 = 0x86dd
+NH_HOP_BY_HOP = 0
+NH_IPV6 = 41
+NH_ICMPV6 = 58
+ICMPV6_ECHO_REQUEST = 128
+HOP_LIMIT = 64
+
+# option type of IOAM in Hop-by-Hop, and IOAM option type of DEX
+IOAM_OPTION_TYPE = 0x31
+IOAM_DEX = 4
+
+PAD1 = 0
+PADN = 1
+
+EXT_FLAG_FLOW_ID = 0x80
+EXT_FLAG_SEQ_NUM = 0x40
+
+# extension flags as named in the packets
+EXT_FLAGS_NAMES = {"NO_EXT": 0x00, "FLOW": EXT_FLAG_FLOW_ID, "SEQ": EXT_FLAG_SEQ_NUM, "FLOW_SEQ": EXT_FLAG_FLOW_ID | EXT_FLAG_SEQ_NUM}
+
+NAME_REGEX = re.compile(r"^(?P<mode>INLINE|ENCAP)_(?P<extflags>NO_EXT|FLOW_SEQ|FLOW|SEQ)_(?P<type>[0-9a-fA-F]{1,6})$")
+
+# offsets in the frames of the first word of the (outer) IPv6 header, ending with the flow
+# label, and of the last 32 bits of its source address
+FLOW_LABEL_OFFSET = ETH_HEADER_LEN
+SRC_LOW_OFFSET = ETH_HEADER_LEN + 8 + 12
+
+# broadcast destination and null source, as the MAC addresses are set by TRex
+ETH_DST = b"\xff" * 6
+ETH_SRC = b"\x00" * 6
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def address(addr : str) -> bytes:
+    return socket.inet_pton(socket.AF_INET6, addr)
+
+def padding(length : int) -> bytes:
+    """Return Pad1 or PadN option of `length` bytes."""
+
+    if length == 0:
+        return b""
+    if length == 1:
+        return bytes([PAD1])
+    return bytes([PADN, length - 2]) + bytes(length - 2)
+
+def dex_option(traceType : int, extFlags : int = 0x00, namespace : int = NAMESPACE,
+               flowId : int = FLOW_ID, seqNum : int = SEQ_NUM, flags : int = 0x00) -> bytes:
+    """Return IOAM DEX option, with its type and length."""
+
+    if not 0 <= traceType < 1 << 24:
+        raise RuntimeError(f"Invalid trace type {traceType:#x}")
+
+    # reserved, IOAM option type, then DEX header
+    data = struct.pack("!BBHBBI", 0, IOAM_DEX, namespace, flags, extFlags, traceType << 8)
+    if extFlags & EXT_FLAG_FLOW_ID:
+        data += struct.pack("!I", flowId)
+    if extFlags & EXT_FLAG_SEQ_NUM:
+        data += struct.pack("!I", seqNum)
+
+    return struct.pack("!BB", IOAM_OPTION_TYPE, len(data)) + data
+
+def hop_by_hop(nextHeader : int, option : bytes) -> bytes:
+    """Return Hop-by-Hop header with `option`, aligned to 4n+2 and padded to 8n."""
+
+    options = padding(2) + option
+    options += padding(-(2 + len(options)) % 8)
+
+    return struct.pack("!BB", nextHeader, (2 + len(options)) // 8 - 1) + options
+
+def ipv6(src : bytes, dst : bytes, nextHeader : int, payloadLen : int) -> bytes:
+    """Return IPv6 header."""
+
+    return struct.pack("!IHBB", 6 << 28, payloadLen, nextHeader, HOP_LIMIT) + src + dst
+
+def checksum(data : bytes) -> int:
+    """Return internet checksum of `data`."""
+
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def echo_request(src : bytes, dst : bytes, dataLen : int) -> bytes:
+    """Return ICMPv6 echo request with `dataLen` bytes of data."""
+
+    message = struct.pack("!BBHHH", ICMPV6_ECHO_REQUEST, 0, 0, 0, 0) + b"x" * dataLen
+    pseudo = src + dst + struct.pack("!I3xB", len(message), NH_ICMPV6)
+
+    return message[:2] + struct.pack("!H", checksum(pseudo + message)) + message[4:]
+
+def frame(headers : list, frameLen : int) -> bytes:
+    """
+    Return Ethernet frame of `frameLen` bytes made of IPv6 `headers` and an echo request.
+
+    `headers` are (source, destination, option) of each IPv6 header, from the outer one.
+    The option, if any, is carried in a Hop-by-Hop header.
+    """
+
+    # length of the data of the echo request filling the frame
+    lengths = [IPV6_HEADER_LEN + (len(hop_by_hop(0, opt)) if opt is not None else 0) for _, _, opt in headers]
+    dataLen = frameLen - ETH_HEADER_LEN - sum(lengths) - ICMPV6_HEADER_LEN
+    if dataLen < 0:
+        raise RuntimeError(f"Frame of {frameLen} bytes too small for the headers")
+
+    src, dst, _ = headers[-1]
+    packet = echo_request(src, dst, dataLen)
+    nextHeader = NH_ICMPV6
+
+    for src, dst, option in reversed(headers):
+        if option is not None:
+            packet = hop_by_hop(nextHeader, option) + packet
+            nextHeader = NH_HOP_BY_HOP
+        packet = ipv6(src, dst, nextHeader, len(packet)) + packet
+        nextHeader = NH_IPV6
+
+    return ETH_DST + ETH_SRC + struct.pack("!H", ETH_TYPE_IPV6) + packet
+
+@functools.lru_cache(maxsize=None)
+def dex_packet(mode : str, traceType : int, extFlags : int = 0x00, namespace : int = NAMESPACE,
+               flowId : int = FLOW_ID, seqNum : int = SEQ_NUM, frameLen : int = FRAME_LEN) -> bytes:
+    """Return frame of `frameLen` bytes with a DEX option, in `mode` inline or encap."""
+
+    option = dex_option(traceType, extFlags, namespace, flowId, seqNum)
+
+    if mode == "inline":
+        return frame([(address(SRC), address(DST), option)], frameLen)
+    elif mode == "encap":
+        return frame([(address(SRC), address(ENCAP_DST), option), (address(SRC), address(DST), None)], frameLen)
+
+    raise RuntimeError(f"Invalid mode {mode}")
+
+@functools.lru_cache(maxsize=None)
+def plain_packet(frameLen : int = FRAME_LEN) -> bytes:
+    """Return frame of `frameLen` bytes without IOAM."""
+
+    return frame([(address(SRC), address(DST), None)], frameLen)
+
+def with_flow(pkt : bytes, flow : int) -> bytes:
+    """Return `pkt` with the outer source address and flow label of `flow`, as written by the TRex VM."""
+
+    pkt = bytearray(pkt)
+    word = struct.unpack_from("!I", pkt, FLOW_LABEL_OFFSET)[0]
+    struct.pack_into("!I", pkt, FLOW_LABEL_OFFSET, (word & ~0xFFFFF) | (flow & 0xFFFFF))
+    struct.pack_into("!I", pkt, SRC_LOW_OFFSET, flow)
+    return bytes(pkt)
+
+def insertion_room(mode : str, traceType : int = 0x800000, extFlags : int = 0x00) -> int:
+    """Return number of bytes added by the DUT when inserting DEX in `mode`."""
+
+    room = len(hop_by_hop(0, dex_option(traceType, extFlags)))
+    return room + IPV6_HEADER_LEN if mode == "encap" else room
+
+def min_frame_len(mode : str = None, traceType : int = 0x800000, extFlags : int = 0x00) -> int:
+    """Return length of the smallest frame with a DEX option in `mode`, or without IOAM if None."""
+
+    length = ETH_HEADER_LEN + IPV6_HEADER_LEN + ICMPV6_HEADER_LEN
+    if mode is None:
+        return length
+    return length + insertion_room(mode, traceType, extFlags)
+
+def parse_name(name : str) -> tuple:
+    """Return mode, trace type and extension flags of the packet called `name`."""
+
+    match = NAME_REGEX.match(name)
+    if match is None:
+        raise RuntimeError(f"Invalid IOAM packet name {name}")
+
+    return match.group("mode").lower(), int(match.group("type"), 16), EXT_FLAGS_NAMES[match.group("extflags")]
+
+def named_packet(name : str, frameLen : int = FRAME_LEN) -> bytes:
+    """Return frame of the packet called `name`."""
+
+    mode, traceType, extFlags = parse_name(name)
+    return dex_packet(mode, traceType, extFlags, frameLen=frameLen)
+
+# packets previously written by hand in `var_freq_dex.py`: option bytes and length of the data
+LEGACY_PACKETS = {
+    "INLINE_NO_EXT_800000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x80\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_400000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x40\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_200000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x20\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_100000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x10\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_40000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x04\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_20000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x02\x00\x00\x00', 1422),
+    "INLINE_NO_EXT_8000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x80\x00\x00', 1422),
+    "INLINE_NO_EXT_4000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x40\x00\x00', 1422),
+    "INLINE_NO_EXT_2000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x20\x00\x00', 1422),
+    "INLINE_FLOW_800000": (b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\x80\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x01\x02\x00\x00', 1414),
+    "INLINE_FLOW_SEQ_800000": (b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\xc0\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x00\x00\x00\x01', 1414),
+    "ENCAP_NO_EXT_800000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x80\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_400000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x40\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_200000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x20\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_100000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x10\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_40000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x04\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_20000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x02\x00\x00\x00', 1382),
+    "ENCAP_NO_EXT_8000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x80\x00\x00', 1382),
+    "ENCAP_NO_EXT_4000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x40\x00\x00', 1382),
+    "ENCAP_NO_EXT_2000": (b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x20\x00\x00', 1382),
+    "ENCAP_FLOW_800000": (b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\x80\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x01\x02\x00\x00', 1382),
+    "ENCAP_FLOW_SEQ_800000": (b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\xc0\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x00\x00\x00\x01', 1382),
+}
+
+# previous packets with only the Flow ID counted their padding in the length of the IOAM option
+LEGACY_OPTION_LENGTH = {"INLINE_FLOW_800000", "ENCAP_FLOW_800000"}
+
+# offset of the length of the IOAM option in the frames without MAC addresses: Ethernet
+# type, IPv6 header, Hop-by-Hop header and PadN before the option
+LEGACY_OPTION_LENGTH_OFFSET = 2 + IPV6_HEADER_LEN + 2 + 2 + 1
+
+def legacy_counterpart(name : str, legacyLen : int) -> bytes:
+    """Return frame built for the legacy packet called `name` of `legacyLen` bytes."""
+
+    if name == "PKT_MTU":
+        return plain_packet()
+    if name.startswith("DEX_"):
+        return plain_packet(FRAME_LEN - insertion_room(name[4:].lower()))
+    # frames were sized the same in encap mode, whatever the extension flags
+    return named_packet(name, legacyLen)
+
+def check_legacy() -> int:
+    """Compare the packets with the ones built by Scapy as previously. Return number of differences."""
+
+    from scapy.all import Ether, IPv6, IPv6ExtHdrHopByHop, HBHOptUnknown, ICMPv6EchoRequest
+
+    def legacy(name, option, dataLen):
+        if name.startswith("INLINE"):
+            pkt = Ether()/IPv6(src=SRC,dst=DST)/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(option)])/ICMPv6EchoRequest(data='x'*dataLen)
+        else:
+            pkt = Ether()/IPv6(src=SRC,dst=ENCAP_DST)/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(option)])/IPv6(src=SRC, dst=DST)/ICMPv6EchoRequest(data='x'*dataLen)
+        return bytes(pkt)
+
+    legacyPackets = {name: legacy(name, option, dataLen) for name, (option, dataLen) in LEGACY_PACKETS.items()}
+    legacyPackets["PKT_MTU"] = bytes(Ether()/IPv6(src=SRC,dst=DST)/ICMPv6EchoRequest(data='x'*1438))
+    legacyPackets["DEX_INLINE"] = bytes(Ether()/IPv6(src=SRC,dst=DST)/ICMPv6EchoRequest(data='x'*(1438-16)))
+    legacyPackets["DEX_ENCAP"] = bytes(Ether()/IPv6(src=SRC,dst=DST)/ICMPv6EchoRequest(data='x'*(1438-16-40)))
+
+    nbDiffs = 0
+    for name, expected in legacyPackets.items():
+        built = legacy_counterpart(name, len(expected))
+
+        # MAC addresses are set by TRex
+        built, expected = bytearray(built[12:]), bytearray(expected[12:])
+        note = ""
+        if name in LEGACY_OPTION_LENGTH:
+            built[LEGACY_OPTION_LENGTH_OFFSET] = expected[LEGACY_OPTION_LENGTH_OFFSET]
+            note = " (except length of the option)"
+
+        same = built == expected
+        nbDiffs += not same
+        print(f"{name}: {len(built) + 12} bytes {'ok' if same else 'DIFFERENT'}{note}")
+
+    return nbDiffs
+
+if __name__ == "__main__":
+    sys.exit(check_legacy())
@@ -7,10 +7,11 @@ import argparse
 
 class STLS1(object):
 
-    def create_stream (self):
+    def create_stream (self, port = 0):
+        # each port sends its own flow
         return STLStream( 
             packet = STLPktBuilder(
-                pkt = Ether()/IPv6(src="ab00::1",dst="cd00::1")/Raw((1514-54)*'x')
+                pkt = Ether()/IPv6(src=f"ab00::{port+1:x}",dst="cd00::1")/Raw((1514-54)*'x')
             ),
             mode = STLTXCont()
         )
@@ -20,7 +21,7 @@ class STLS1(object):
                                          formatter_class=argparse.ArgumentDefaultsHelpFormatter)
         args = parser.parse_args(tunables)
         # create 1 stream 
-        return [ self.create_stream() ]
+        return [ self.create_stream(kwargs.get('port_id', 0)) ]
 
 
 # dynamic load - used for trex console or simulator
@@ -0,0 +1,106 @@
+"""
+Sampling of the stats of TRex during a run.
+
+The stats are polled every `INTERVAL` seconds while the traffic is active and
+kept in a ring buffer. The steady-state throughput of the run is the mean of
+the samples after `WARMUP` seconds and before the last `TAIL` seconds. A run
+whose samples vary by more than `MAX_VARIATION` (coefficient of variation), or
+with too few samples, is flagged as unstable.
+
+To put next to `test_profile_dex.py` on the machine running TRex.
+"""
+
+import math
+import time
+import collections
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# period of the samples, in seconds
+INTERVAL = 0.5
+
+# samples ignored at the start and at the end of a run, in seconds
+WARMUP = 5
+TAIL = 1
+
+# highest coefficient of variation of the pps of a stable run
+MAX_VARIATION = 0.02
+
+# fewest samples in the steady state of a stable run
+MIN_SAMPLES = 10
+
+# time allowed after the end of the traffic, in seconds
+GRACE = 5
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+Sample = collections.namedtuple("Sample", ["time", "pps", "bps", "ipackets", "opackets"])
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class Sampler:
+    """Ring buffer of the samples of a run, returned by `poll()` as (pps, bps, ipackets, opackets)."""
+
+    def __init__(self, poll, duration : float, interval : float = INTERVAL) -> None:
+        self.poll = poll
+        self.duration = duration
+        self.interval = interval
+        self.samples = collections.deque(maxlen=math.ceil((duration + GRACE) / interval) + 1)
+        self.start = None
+
+    def sample(self) -> Sample:
+        """Poll the stats once and keep them."""
+
+        sample = Sample(time.monotonic() - self.start, *self.poll())
+        self.samples.append(sample)
+        return sample
+
+    def run(self, active) -> bool:
+        """Sample until `active()` is False. Return False if the traffic did not end in time."""
+
+        self.samples.clear()
+        self.start = time.monotonic()
+        deadline = self.start + self.duration + GRACE
+
+        while active():
+            if time.monotonic() >= deadline:
+                return False
+            self.sample()
+            time.sleep(self.interval - (time.monotonic() - self.start) % self.interval)
+
+        return True
+
+    def steady(self, warmup : float = WARMUP, tail : float = TAIL) -> list:
+        """Return samples of the steady state."""
+
+        # short runs keep their second half
+        if warmup + tail >= self.duration:
+            warmup, tail = self.duration / 2, 0
+
+        return [s for s in self.samples if warmup <= s.time <= self.duration - tail]
+
+    def throughput(self, warmup : float = WARMUP, tail : float = TAIL) -> tuple:
+        """Return mean pps, mean bps and whether the run is stable."""
+
+        steady = self.steady(warmup, tail)
+        if not steady:
+            return 0.0, 0.0, False
+
+        pps = sum(s.pps for s in steady) / len(steady)
+        bps = sum(s.bps for s in steady) / len(steady)
+        std = math.sqrt(sum((s.pps - pps) ** 2 for s in steady) / len(steady))
+
+        stable = len(steady) >= MIN_SAMPLES and pps > 0 and std / pps <= MAX_VARIATION
+        return pps, bps, stable
+
+    def write(self, file, run : int):
+        """Write samples of the run with index `run` to `file`."""
+
+        for s in self.samples:
+            file.write(f"{run};{s.time:.3f};{s.pps};{s.bps};{s.ipackets};{s.opackets}\n")
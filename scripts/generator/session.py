@@ -0,0 +1,420 @@
+"""
+Usage: python3 session.py [-s <socket>] [-m] [-d <duration>] [-p <nb_ports>]
+
+Long-lived TRex session of the generator.
+
+A single STL client is connected, reset and put in service mode once, and
+the streams of `var_freq_dex.py` are compiled once for each
+(packet name, nbMTU, nbIOAM, insertionDEX, encapMode, nbFlows, sizes) and port. Tests are then run on
+request, received as JSON lines on a local Unix socket:
+- {"op": "run", "extra": <extraData>, "nbRuns": <n>, "stats": <file>, "series": <file>}
+- {"op": "info"}: number of requests, runs and cached profiles;
+- {"op": "stop"}: stop the session.
+Each request gets a single JSON line with `status` (0 on success) in return.
+
+The acquired ports are paired (0 -> 1, 2 -> 3, ...): the first port of each
+pair sends its own streams, with distinct flows, and the second one receives
+the traffic forwarded by the DUT. `MULT` is the total rate, shared by the
+sending ports, and the stats are summed over the pairs.
+
+`test_profile_dex.py` forwards its runs to the session when it is running, and runs them itself if the session does not answer.
+
+With `-m`, a mock client with `-p` ports replaces TRex, with runs of `-d`
+seconds, to test the session without traffic generator.
+
+To put next to `test_profile_dex.py` on the machine running TRex.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import pprint
+import random
+import socket
+import argparse
+import socketserver
+
+from sampler import Sampler
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# duration in seconds of each test
+DURATION = 30
+
+# trex multiplicator - set to limit before dropping packets when Linux forwarding packets
+# total over the sending ports
+MULT = "1150000pps"
+
+# number of pairs of ports used, None for all the acquired ports
+NB_PAIRS = None
+
+# profile to use to generate traffic
+PROFILE = "var_freq_dex.py"
+
+# socket of the session
+SOCKET_PATH = "/tmp/trex_session.sock"
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# fields of the extra data identifying a profile, with their type
+PROFILE_FIELDS = [
+    ("ioamPacketName", str), ("nbMTU", int), ("nbIOAM", int),
+    ("insertionDEX", lambda x: str(x).lower() == "true"), ("encapMode", lambda x: str(x).lower() == "true"),
+    ("nbFlows", int), ("sizes", str),
+]
+
+# values of the fields missing from the extra data, as in `var_freq_dex.py`
+PROFILE_DEFAULTS = {"insertionDEX": "False", "encapMode": "False", "nbFlows": "1", "sizes": "MTU"}
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def profile_key(extra : str) -> tuple:
+    """Return key of the profile of `extra` data."""
+
+    values = dict(PROFILE_DEFAULTS)
+    for pair in extra.split(","):
+        key, value = pair.split("=")
+        values[key] = value
+
+    return tuple(convert(values[name]) for name, convert in PROFILE_FIELDS)
+
+def port_pairs(acquiredPorts : list, nbPairs : int = NB_PAIRS) -> list:
+    """Return (sending port, receiving port) of the pairs of `acquiredPorts`."""
+
+    ports = sorted(acquiredPorts)
+    pairs = [(tx, tx + 1) for tx in ports if tx % 2 == 0 and tx + 1 in ports]
+    if not pairs:
+        raise RuntimeError(f"No pair of ports in {ports}")
+    if nbPairs is not None:
+        if nbPairs > len(pairs):
+            raise RuntimeError(f"Cannot use {nbPairs} pairs of ports, only {len(pairs)} acquired")
+        pairs = pairs[:nbPairs]
+
+    return pairs
+
+def port_mult(mult : str, nbPorts : int) -> str:
+    """Return multiplicator of each of `nbPorts` ports for a total of `mult`."""
+
+    match = re.fullmatch(r"([0-9.]+)([a-z%]*)", mult)
+    if match is None or match.group(2) == "%":
+        raise RuntimeError(f"Invalid multiplicator {mult}")
+
+    return f"{float(match.group(1)) / nbPorts:g}{match.group(2)}"
+
+def trex_client() -> tuple:
+    """Return TRex client and function loading the streams of the extra data. Requires TRex."""
+
+    import stl_path
+    from trex.stl.api import STLClient, STLProfile
+
+    profileFile = os.path.join(stl_path.STL_PROFILES_PATH, PROFILE)
+
+    def load(extra : str, port : int):
+        return STLProfile.load_py(profileFile, port_id=port, **{"extra": extra}).get_streams()
+
+    return STLClient(verbose_level = 'info'), load
+
+class TrexSession:
+    """Connected TRex client running tests of `PROFILE`, with the compiled streams cached."""
+
+    def __init__(self, client, load, duration : float = DURATION, mult : str = MULT) -> None:
+        """`load(extra, port)` returns the streams of the profile for the `extra` data sent by `port`."""
+
+        self.client = client
+        self.load = load
+        self.duration = duration
+        self.mult = mult
+        self.profiles = {}
+        self.nbRequests = 0
+        self.nbRuns = 0
+
+    def open(self):
+        self.client.connect()
+        self.client.reset()
+        self.client.set_service_mode()
+
+        print(f"Is connected? {self.client.is_connected()}")
+        print(f"Nb ports: {self.client.get_port_count()}")
+
+        self.acquiredPorts = self.client.get_acquired_ports()
+        print(f"Acquired ports: {self.acquiredPorts}")
+
+        self.pairs = port_pairs(self.acquiredPorts)
+        self.txPorts = [tx for tx, _ in self.pairs]
+        self.rxPorts = [rx for _, rx in self.pairs]
+        print(f"Pairs of ports: {self.pairs}")
+
+    def close(self):
+        self.client.disconnect()
+
+    def get_stats(self, ports : list, print : bool):
+        stats = self.client.get_stats(ports)
+
+        if print:
+            pp = pprint.PrettyPrinter(depth=4)
+            pp.pprint(stats)
+
+        return stats
+
+    def extract_stats(self):
+        """Return pps and bps received, packets received and sent, over all the pairs of ports."""
+
+        stats = self.get_stats(self.txPorts + self.rxPorts, False)
+        pps = sum(stats[rx]['rx_pps'] for rx in self.rxPorts)
+        bps = sum(stats[rx]['rx_bps'] for rx in self.rxPorts)
+        ipackets = sum(stats[rx]['ipackets'] for rx in self.rxPorts)
+        opackets = sum(stats[tx]['opackets'] for tx in self.txPorts)
+        return pps, bps, ipackets, opackets
+
+    def streams(self, extra : str, port : int):
+        """Return streams of `extra` data sent by `port`, compiled once."""
+
+        key = (profile_key(extra), port)
+        if key not in self.profiles:
+            self.profiles[key] = self.load(extra, port)
+        return self.profiles[key]
+
+    def test_profile(self, extra : str, fileStats, fileSeries, run : int):
+        """Launch test using `extra` data. Write stats to `fileStats` and samples to `fileSeries`."""
+
+        # clean before running test
+        self.client.clear_stats(self.acquiredPorts)
+        self.client.remove_all_streams(self.acquiredPorts)
+
+        # launch test, each sending port with its own streams
+        for tx in self.txPorts:
+            self.client.add_streams(self.streams(extra, tx), ports=[tx])
+        self.client.start(ports=self.txPorts, mult=port_mult(self.mult, len(self.txPorts)), duration=self.duration)
+
+        # sample stats until the end
+        sampler = Sampler(self.extract_stats, self.duration)
+        ended = sampler.run(lambda: self.client.is_traffic_active(ports=self.acquiredPorts))
+        if not ended:
+            print(f"Traffic still active after {self.duration}s, stopping it")
+            self.client.stop(ports=self.acquiredPorts)
+
+        # steady-state throughput, packets counted until the end
+        pps, bps, stable = sampler.throughput()
+        last = sampler.sample()
+        stable = stable and ended
+        if not stable:
+            print(f"Unstable run: {pps} pps")
+
+        # write stats and samples to files
+        fileStats.write(f"{extra};{pps};{bps};{last.ipackets};{last.opackets};{int(stable)}\n")
+        sampler.write(fileSeries, run)
+
+    def run(self, extra : str, nbRuns : int, statsFile : str, seriesFile : str):
+        """Run test of `extra` data `nbRuns` times, appending to `statsFile` and `seriesFile`."""
+
+        self.nbRequests += 1
+
+        # ports start clean for each test, the streams are compiled before the first run
+        self.client.reset(ports=self.acquiredPorts)
+        for tx in self.txPorts:
+            self.streams(extra, tx)
+
+        with open(statsFile, "a") as fileStats, open(seriesFile, "a") as fileSeries:
+            for i in range(nbRuns):
+                print(f"Run {i+1}/{nbRuns}...")
+                self.test_profile(extra, fileStats, fileSeries, i)
+                fileStats.flush()
+                self.nbRuns += 1
+
+class MockClient:
+    """Stand-in for the STL client, with `nbPorts` ports and traffic lasting the requested duration."""
+
+    def __init__(self, capacity : float = 1e6, nbPorts : int = 2) -> None:
+        self.capacity = capacity
+        self.nbPorts = nbPorts
+        self.random = random.Random(0)
+        self.connected = False
+        self.streams = {}
+        self.txPorts = []
+        self.end = 0
+        self.started = 0
+        self.calls = {}
+
+    def record(self, name : str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def connect(self):
+        self.record("connect")
+        self.connected = True
+
+    def disconnect(self):
+        self.record("disconnect")
+        self.connected = False
+
+    def reset(self, ports=None):
+        self.record("reset")
+        self.streams = {}
+        self.end = 0
+
+    def set_service_mode(self, ports=None):
+        self.record("set_service_mode")
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def get_port_count(self) -> int:
+        return self.nbPorts
+
+    def get_acquired_ports(self) -> list:
+        return list(range(self.nbPorts))
+
+    def clear_stats(self, ports=None):
+        self.record("clear_stats")
+
+    def remove_all_streams(self, ports=None):
+        self.streams = {}
+
+    def add_streams(self, streams, ports=None):
+        self.record("add_streams")
+        for port in ports:
+            self.streams[port] = list(streams)
+
+    def start(self, ports=None, mult=None, duration=-1):
+        self.record("start")
+        self.txPorts = list(ports)
+        self.started = time.monotonic()
+        self.end = self.started + duration
+
+    def stop(self, ports=None):
+        self.end = 0
+
+    def is_traffic_active(self, ports=None) -> bool:
+        return time.monotonic() < self.end
+
+    def get_stats(self, ports=None) -> dict:
+        """Return stats of `ports`, each sending port forwarded to the next one at an equal share of the capacity."""
+
+        elapsed = min(time.monotonic(), self.end or time.monotonic()) - self.started
+        share = self.capacity / max(1, len(self.txPorts))
+        packets = int(share * max(0, elapsed))
+
+        stats = {}
+        for port in ports:
+            tx = port in self.txPorts
+            rx = port - 1 in self.txPorts and port % 2 == 1
+            pps = share * (1 + self.random.gauss(0, 0.002)) if rx and self.is_traffic_active() else 0.0
+            stats[port] = {
+                "rx_pps": pps, "rx_bps": pps * 1500 * 8,
+                "ipackets": packets if rx else 0, "opackets": packets if tx else 0,
+            }
+        return stats
+
+def mock_client(nbPorts : int = 2) -> tuple:
+    """Return mock client with `nbPorts` ports and function loading fake streams."""
+
+    return MockClient(nbPorts=nbPorts), lambda extra, port: [f"streams of {extra} on port {port}"]
+
+class Handler(socketserver.StreamRequestHandler):
+    """Requests of a connection to the session, one JSON object per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"status": -1, "error": f"{type(e).__name__}: {e}"}
+
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            if not self.server.running:
+                break
+
+class SessionServer(socketserver.UnixStreamServer):
+    """Serve requests to `session`, one at a time since TRex is shared."""
+
+    def __init__(self, session : TrexSession, path : str = SOCKET_PATH) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, Handler)
+        self.session = session
+        self.path = path
+        self.running = True
+
+    def dispatch(self, request : dict) -> dict:
+        op = request.get("op")
+
+        if op == "run":
+            self.session.run(request["extra"], int(request["nbRuns"]), request["stats"], request["series"])
+            return {"status": 0, "runs": int(request["nbRuns"])}
+        elif op == "info":
+            return {
+                "status": 0, "requests": self.session.nbRequests, "runs": self.session.nbRuns,
+                "profiles": len(self.session.profiles),
+            }
+        elif op == "stop":
+            self.running = False
+            return {"status": 0}
+
+        raise RuntimeError(f"Unknown operation {op}")
+
+    def serve(self):
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.remove(self.path)
+
+def request(message : dict, path : str = SOCKET_PATH) -> dict:
+    """Send `message` to the session listening on `path` and return its response."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile("r") as f:
+            return json.loads(f.readline())
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="session",
+        description="Run a persistent TRex session",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-s", type=str, required=False, default=SOCKET_PATH, help="Socket of the session")
+    parser.add_argument("-m", action="store_true", help="Use a mock client instead of TRex")
+    parser.add_argument("-d", type=float, required=False, default=DURATION, help="Duration in seconds of each test")
+    parser.add_argument("-p", type=int, required=False, default=2, help="Number of ports of the mock client")
+    args = parser.parse_args()
+
+    if args.d <= 0:
+        print("<duration> cannot be <= 0")
+        sys.exit(-1)
+
+    if args.p < 2:
+        print("<nb_ports> cannot be < 2")
+        sys.exit(-1)
+
+    return args.s, args.m, args.d, args.p
+
+if __name__ == "__main__":
+    path, mock, duration, nbPorts = check_arguments()
+
+    client, load = mock_client(nbPorts) if mock else trex_client()
+    session = TrexSession(client, load, duration)
+    session.open()
+
+    server = SessionServer(session, path)
+    print(f"Listening on {path}")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.close()
+
+    sys.exit(0)
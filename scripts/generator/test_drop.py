@@ -1,12 +1,19 @@
 """
-Usage: python3 test_drop.py
+Usage: python3 test_drop.py [-l]
 
 Tests for the max forwaded pps before drop.
 
+By default, the rate is found by the adaptive search of `throughput_search.py`.
+With `-l`, all rates from `MIN_PPS` to `MAX_PPS` are tested, by steps of `STEP`.
+
+The first port of each pair of acquired ports (0 -> 1, 2 -> 3, ...) sends the
+traffic, the rate being shared by the sending ports, and the drop rate is
+computed over all the pairs.
+
 Profile files must be in `/opt/trex/v3.04/stl` on the machine running TRex.
 
 To put into /opt/trex/v3.04/automation/trex_control_plane/interactive/trex/examples/stl
-on the machine running TRex.
+on the machine running TRex, with `throughput_search.py`, `session.py` and `sampler.py`.
 """
 
 import stl_path
@@ -14,6 +21,10 @@ from trex.stl.api import *
 import sys
 import pprint
 import os
+import argparse
+
+from throughput_search import ThroughputSearch
+from session import port_pairs, port_mult
 
 MIN_PPS = 100000
 MAX_PPS = 1500000+1
@@ -42,8 +53,13 @@ class TrexTestIOAM:
         self.acquiredPorts = self.client.get_acquired_ports()
         print(f"Acquired ports: {self.acquiredPorts}")
 
-    def get_stats(self, port, print : bool):
-        stats = self.client.get_stats([port])
+        self.pairs = port_pairs(self.acquiredPorts)
+        self.txPorts = [tx for tx, _ in self.pairs]
+        self.rxPorts = [rx for _, rx in self.pairs]
+        print(f"Pairs of ports: {self.pairs}")
+
+    def get_stats(self, ports : list, print : bool):
+        stats = self.client.get_stats(ports)
 
         if print:
             pp = pprint.PrettyPrinter(depth=4)
@@ -52,35 +68,36 @@ class TrexTestIOAM:
         return stats
 
     def extract_stats(self):
-        stats = self.get_stats(0, False)
-        rxPps = stats['total']['rx_pps']
-        txPps = stats['total']['tx_pps']
-        ipackets = stats['total']['ipackets']
-        opackets = stats['total']['opackets']
-        dropRate = 1.0 - (stats['total']['ipackets']/stats['total']['opackets'])
+        stats = self.get_stats(self.txPorts + self.rxPorts, False)
+        rxPps = sum(stats[rx]['rx_pps'] for rx in self.rxPorts)
+        txPps = sum(stats[tx]['tx_pps'] for tx in self.txPorts)
+        ipackets = sum(stats[rx]['ipackets'] for rx in self.rxPorts)
+        opackets = sum(stats[tx]['opackets'] for tx in self.txPorts)
+        dropRate = 1.0 - (ipackets/opackets)
         return rxPps, txPps, ipackets, opackets, dropRate
 
-    def test_profile(self, filename : str, ppsLimit : int):
+    def test_profile(self, filename : str, ppsLimit : int, duration : float = DURATION) -> float:
         """
-        Launch test using given profile file.
+        Launch test using given profile file. Return drop rate.
         """
         # clean before running test
         self.clear_stats()
         self.client.reset(ports=self.acquiredPorts)
 
-        # load profile file
+        # load profile file, for each sending port
         profile_file = os.path.join(stl_path.STL_PROFILES_PATH, filename)
-        try:
-            profile = STLProfile.load(profile_file)
-        except STLError as e:
-            print("\nError while loading profile'{0}'\n".format(profile_file))
-            print(e.brief() + "\n")
-            sys.exit(-1)
-
-        # launch test for 30s
         self.client.remove_all_streams(self.acquiredPorts)
-        self.client.add_streams(profile.get_streams(), ports=[0])
-        self.client.start(ports=[0], mult=f"{ppsLimit}pps", duration=DURATION)
+        for tx in self.txPorts:
+            try:
+                profile = STLProfile.load(profile_file, port_id=tx)
+            except STLError as e:
+                print("\nError while loading profile'{0}'\n".format(profile_file))
+                print(e.brief() + "\n")
+                sys.exit(-1)
+            self.client.add_streams(profile.get_streams(), ports=[tx])
+
+        # launch test for `duration` seconds, `ppsLimit` shared by the sending ports
+        self.client.start(ports=self.txPorts, mult=port_mult(f"{ppsLimit}pps", len(self.txPorts)), duration=duration)
 
         # wait for end
         self.client.wait_on_traffic(ports=self.acquiredPorts)
@@ -89,6 +106,7 @@ class TrexTestIOAM:
         rx, tx, ipkts, opkts, dropRate  = self.extract_stats()
         print(f"pps = {ppsLimit} | rx = {rx} | tx = {tx} | ipkts = {ipkts} | opkts = {opkts} | drop = {dropRate}")
         self.file.write(f"{ppsLimit};{rx};{tx};{ipkts};{opkts};{dropRate}\n")
+        return dropRate
 
     def clear_stats(self):
         self.client.clear_stats(self.acquiredPorts)
@@ -110,10 +128,40 @@ def test_profile(filename : str):
 
     t.disconnect()
 
+def search_profile(filename : str):
+    """Search max pps before drop of `filename` profile."""
+
+    t = TrexTestIOAM(f"/home/clt/stats_{filename}.txt")
+
+    search = ThroughputSearch(lambda pps, duration: t.test_profile(filename, pps, duration),
+                              minPps=MIN_PPS, maxPps=MAX_PPS - 1, maxDuration=DURATION, maxTrials=NB_ITERS)
+    pps = search.run()
+    print(f"\nMax pps before drop: {pps} ({search.nbTrials} runs, {search.duration:.0f}s of traffic)")
+
+    t.disconnect()
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="test_drop",
+        description="Test for the max forwarded pps before drop",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-l", action="store_true", help="Linear sweep instead of adaptive search")
+    args = parser.parse_args()
+
+    return args.l
+
 if __name__ == "__main__":
+    linear = check_arguments()
 
     for profile in PROFILES:
         print(f"\n\n~~ Testing profile {profile} ~~\n")
-        test_profile(profile)
+        if linear:
+            test_profile(profile)
+        else:
+            search_profile(profile)
 
     sys.exit(0)
@@ -13,107 +13,33 @@ Run tests <nb_run> times.
 Example of usage:
 python3 test_profile_dex.py -n 30 -e ioamPacketName=INLINE_PKT_OPTION0,nbMTU=10,nbIOAM=1,insertionDEX=False,encapMode=False
 
+Each run appends `extra;pps;bps;ipackets;opackets;stable` to the stats, where pps and bps
+are the steady-state throughput computed by `sampler.py`. Its samples are appended to the series.
+
 The file `var_freq_dex.py` must be in `/opt/trex/v3.04/stl`.
 
 To put into /opt/trex/v3.04/automation/trex_control_plane/interactive/trex/examples/stl
-on machine running TRex.
+on machine running TRex, with `session.py` and `sampler.py`.
+
+If `session.py` is running, the runs are forwarded to it.
 """
 
 import stl_path
 from trex.stl.api import *
 import sys
-import pprint
 import os
 import argparse
 
-# duration in seconds of each test
-DURATION = 30
+from session import DURATION, SOCKET_PATH, TrexSession, trex_client, request
 
 # default number of runs
 NB_RUNS_DEFAULT = 30
 
-# trex multiplicator - set to limit before dropping packets when Linux forwarding packets
-MULT = "1150000pps"
-
-# profile to use to generate traffic
-PROFILE = "var_freq_dex.py"
-
 # file in which to write the stats
 OUTPUT_FILE = "/home/clt/stats.txt"
 
-class TrexTestIOAM:
-    """Represent TRex client. Wrapper on TRex client API."""
-
-    def __init__(self, fileStats : str) -> None:
-        """Save statistics inside `fileStats`."""
-
-        self.file = open(fileStats, "a")
-        self.client = STLClient(verbose_level = 'info')
-        self.client.connect()
-        self.client.reset()
-        self.client.set_service_mode()
-
-        print(f"Is connected? {self.client.is_connected()}")
-        print(f"Nb ports: {self.client.get_port_count()}")
-
-        self.acquiredPorts = self.client.get_acquired_ports()
-        print(f"Acquired ports: {self.acquiredPorts}")
-
-    def get_stats(self, port, print : bool):
-        stats = self.client.get_stats([port])
-
-        if print:
-            pp = pprint.PrettyPrinter(depth=4)
-            pp.pprint(stats)
-
-        return stats
-
-    def extract_stats(self):
-        stats = self.get_stats(0, False)
-        pps = stats[1]['rx_pps']
-        bps = stats[1]['rx_bps']
-        ipackets = stats['total']['ipackets']
-        opackets = stats['total']['opackets']
-        return pps, bps, ipackets, opackets
-
-    def test_profile(self, extra : str):
-        """Launch test using optional `extra` data."""
-
-        # clean before running test
-        self.clear_stats()
-        self.client.reset(ports=self.acquiredPorts)
-
-        # load var_freq.py profile file
-        profile_file = os.path.join(stl_path.STL_PROFILES_PATH, PROFILE)
-        profile=None
-        try:
-            profile = STLProfile.load_py(profile_file, **{"extra": extra})
-        except STLError as e:
-            print("\nError while loading profile'{0}'\n".format(profile_file))
-            print(e.brief() + "\n")
-            sys.exit(-1)
-
-        # launch test for 30s
-        self.client.remove_all_streams(self.acquiredPorts)
-        self.client.add_streams(profile.get_streams(), ports=[0])
-        self.client.start(ports=[0], mult=MULT, duration=DURATION)
-
-        # wait for end
-        try:
-            self.client.wait_on_traffic(ports=self.acquiredPorts, timeout=DURATION)
-        except:
-            pass
-
-        # get stats and write to file
-        pps, bps, ipackets, opackets = self.extract_stats()
-        self.file.write(f"{extra};{pps};{bps};{ipackets};{opackets}\n")
-
-    def clear_stats(self):
-        self.client.clear_stats(self.acquiredPorts)
-
-    def disconnect(self):
-        self.file.close()
-        self.client.disconnect()
+# file in which to write the samples of each run
+SERIES_FILE = "/home/clt/series.txt"
 
 def check_arguments():
     """Check and parse arguments."""
@@ -140,11 +66,29 @@ def check_arguments():
 if __name__ == "__main__":
     nbRun, extra = check_arguments()
 
-    t = TrexTestIOAM(OUTPUT_FILE)
+    # runs are forwarded to the persistent session if running, else run directly (e.g. socket left by a killed session)
+    if os.path.exists(SOCKET_PATH):
+        print(f"\n\nForwarding {nbRun} runs of {DURATION}s each to the session...")
+        try:
+            response = request({"op": "run", "extra": extra, "nbRuns": nbRun, "stats": OUTPUT_FILE, "series": SERIES_FILE})
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            print(f"Session not running ({e}), running directly")
+        else:
+            if response["status"] != 0:
+                print(f"Error of the session: {response.get('error')}")
+                sys.exit(-1)
+            sys.exit(0)
+
+    client, load = trex_client()
+    t = TrexSession(client, load)
+    t.open()
 
     print(f"\n\nStarting {nbRun} runs of {DURATION}s each...")
-    for i in range(nbRun):
-        print(f"Run {i+1}/{nbRun}...")
-        t.test_profile(extra)
-
-    t.disconnect()
+    try:
+        t.run(extra, nbRun, OUTPUT_FILE, SERIES_FILE)
+    except STLError as e:
+        print(f"\nError while loading profile with {extra}\n")
+        print(e.brief() + "\n")
+        sys.exit(-1)
+    finally:
+        t.close()
@@ -0,0 +1,86 @@
+"""
+Usage: python3 -m unittest discover -s scripts/generator/tests
+
+Check the packets of `dex_packets.py` byte for byte against the packets
+previously built with Scapy in `var_freq_dex.py` (see `LEGACY_PACKETS`),
+frozen below so that Scapy is not needed.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dex_packets import *
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# legacy frames without MAC addresses (set by TRex): headers in hex, then length of the data
+# of the echo request ("x" bytes)
+LEGACY_FRAMES = {
+    "INLINE_NO_EXT_800000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00008000000080006b9500000000", 1422),
+    "INLINE_NO_EXT_400000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00004000000080006b9500000000", 1422),
+    "INLINE_NO_EXT_200000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00002000000080006b9500000000", 1422),
+    "INLINE_NO_EXT_100000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00001000000080006b9500000000", 1422),
+    "INLINE_NO_EXT_40000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00000400000080006b9500000000", 1422),
+    "INLINE_NO_EXT_20000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00000200000080006b9500000000", 1422),
+    "INLINE_NO_EXT_8000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00000080000080006b9500000000", 1422),
+    "INLINE_NO_EXT_4000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00000040000080006b9500000000", 1422),
+    "INLINE_NO_EXT_2000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a010100310a0004007b00000020000080006b9500000000", 1422),
+    "INLINE_FLOW_800000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a02010031120004007b0080800000000bdbe40d0102000080004d7f00000000", 1414),
+    "INLINE_FLOW_SEQ_800000": ("86dd6000000005a60040ab000000000000000000000000000001cd0000000000000000000000000000013a02010031120004007b00c0800000000bdbe40d0000000180004d7f00000000", 1414),
+    "ENCAP_NO_EXT_800000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00008000000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_400000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00004000000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_200000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00002000000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_100000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00001000000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_40000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00000400000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_20000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00000200000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_8000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00000080000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_4000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00000040000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_NO_EXT_2000": ("86dd6000000005a60040ab000000000000000000000000000001db01000000000000000000000000000229010100310a0004007b00000020000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_FLOW_800000": ("86dd6000000005ae0040ab000000000000000000000000000001db0100000000000000000000000000022902010031120004007b0080800000000bdbe40d0102000060000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "ENCAP_FLOW_SEQ_800000": ("86dd6000000005ae0040ab000000000000000000000000000001db0100000000000000000000000000022902010031120004007b00c0800000000bdbe40d0000000160000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+    "PKT_MTU": ("86dd6000000005a63a40ab000000000000000000000000000001cd0000000000000000000000000000018000a7c100000000", 1438),
+    "DEX_INLINE": ("86dd6000000005963a40ab000000000000000000000000000001cd00000000000000000000000000000180006b9500000000", 1422),
+    "DEX_ENCAP": ("86dd60000000056e3a40ab000000000000000000000000000001cd0000000000000000000000000000018000d52600000000", 1382),
+}
+
+# only expected difference: the length of the IOAM option counted the padding of the Flow ID
+EXPECTED_DIFFS = {
+    "INLINE_FLOW_800000": {LEGACY_OPTION_LENGTH_OFFSET: (0x12, 0x0e)},
+    "ENCAP_FLOW_800000": {LEGACY_OPTION_LENGTH_OFFSET: (0x12, 0x0e)},
+}
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def legacy_frame(name : str) -> bytes:
+    headers, dataLen = LEGACY_FRAMES[name]
+    return bytes.fromhex(headers) + b"x" * dataLen
+
+class TestLegacyPackets(unittest.TestCase):
+
+    def test_frozen(self):
+        self.assertEqual(set(LEGACY_FRAMES), set(LEGACY_PACKETS) | {"PKT_MTU", "DEX_INLINE", "DEX_ENCAP"})
+        self.assertEqual(set(EXPECTED_DIFFS), LEGACY_OPTION_LENGTH)
+
+        for name, (option, dataLen) in LEGACY_PACKETS.items():
+            with self.subTest(name):
+                self.assertIn(option, legacy_frame(name))
+                self.assertEqual(LEGACY_FRAMES[name][1], dataLen)
+
+    def test_legacy(self):
+        for name in LEGACY_FRAMES:
+            with self.subTest(name):
+                expected = legacy_frame(name)
+                built = legacy_counterpart(name, 12 + len(expected))[12:]
+                self.assertEqual(len(built), len(expected))
+
+                diffs = {i: (expected[i], built[i]) for i in range(len(built)) if built[i] != expected[i]}
+                self.assertEqual(diffs, EXPECTED_DIFFS.get(name, {}))
+
+if __name__ == "__main__":
+    unittest.main()
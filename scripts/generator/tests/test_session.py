@@ -0,0 +1,112 @@
+"""
+Usage: python3 -m unittest discover -s scripts/generator/tests
+
+Check the requests served by `session.py` on its socket, with the mock client
+instead of TRex.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from session import TrexSession, SessionServer, mock_client, request
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# duration in seconds of each run
+DURATION = 0.5
+
+# number of ports of the mock client
+NB_PORTS = 4
+
+EXTRA = "ioamPacketName=INLINE_PKT_OPTION0,nbMTU=10,nbIOAM=1,insertionDEX=False,encapMode=False"
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "session.sock")
+        self.stats = os.path.join(self.tmp.name, "stats.txt")
+        self.series = os.path.join(self.tmp.name, "series.txt")
+
+        # streams loaded by the session, to check that they are compiled once
+        self.client, load = mock_client(NB_PORTS)
+        self.loads = []
+
+        def counted(extra : str, port : int):
+            self.loads.append((extra, port))
+            return load(extra, port)
+
+        self.session = TrexSession(self.client, counted, DURATION)
+        self.output = io.StringIO()
+        with contextlib.redirect_stdout(self.output):
+            self.session.open()
+
+        self.server = SessionServer(self.session, self.path)
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        with contextlib.redirect_stdout(self.output):
+            self.server.serve()
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            request({"op": "stop"}, self.path)
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def run_request(self, extra : str = EXTRA, nbRuns : int = 1) -> dict:
+        return request({"op": "run", "extra": extra, "nbRuns": nbRuns, "stats": self.stats, "series": self.series}, self.path)
+
+    def test_profile_cached(self):
+        self.assertEqual(self.run_request(), {"status": 0, "runs": 1})
+        self.assertEqual(self.run_request(EXTRA.replace("nbMTU=10", "nbMTU=010")), {"status": 0, "runs": 1})
+
+        # the second request has the same profile, its streams are not compiled again
+        txPorts = list(range(0, NB_PORTS, 2))
+        self.assertEqual(self.loads, [(EXTRA, tx) for tx in txPorts])
+        self.assertEqual(request({"op": "info"}, self.path), {"status": 0, "requests": 2, "runs": 2, "profiles": len(txPorts)})
+
+        # each sending port had the streams of the profile, and each run wrote its stats
+        self.assertEqual(self.client.calls["start"], 2)
+        self.assertEqual(sorted(self.client.streams), txPorts)
+        with open(self.stats) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(line.split(";")[1] != "0" for line in lines))
+
+    def test_other_profile(self):
+        self.run_request()
+        self.run_request(EXTRA.replace("nbMTU=10", "nbMTU=20"))
+        self.assertEqual(len(self.loads), NB_PORTS)
+        self.assertEqual(len(self.session.profiles), NB_PORTS)
+
+    def test_error(self):
+        response = self.run_request("ioamPacketName")
+        self.assertEqual(response["status"], -1)
+        self.assertIn("ValueError", response["error"])
+
+        # the session keeps serving after an error
+        self.assertEqual(request({"op": "info"}, self.path)["status"], 0)
+
+    def test_stop(self):
+        self.assertEqual(request({"op": "stop"}, self.path), {"status": 0})
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
+        with self.assertRaises((ConnectionRefusedError, FileNotFoundError)):
+            request({"op": "info"}, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
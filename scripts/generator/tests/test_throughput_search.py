@@ -0,0 +1,56 @@
+"""
+Usage: python3 -m unittest discover -s scripts/generator/tests
+
+Check the adaptive search of `throughput_search.py` against the linear sweep
+on simulated DUTs.
+"""
+
+import io
+import os
+import sys
+import unittest
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from throughput_search import *
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# capacities of the simulated DUTs, in pps, and seeds of the searches
+CAPACITIES = [SIM_CAPACITY, 253700, 1432100]
+SEEDS = range(1, 6)
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+class TestThroughputSearch(unittest.TestCase):
+
+    def test_same_as_sweep(self):
+        for capacity in CAPACITIES:
+            dut = SimulatedDUT(capacity, seed=0)
+            expected = linear_sweep(dut.trial)
+            sweepTime = dut.elapsed
+
+            for seed in SEEDS:
+                with self.subTest(capacity=capacity, seed=seed):
+                    dut = SimulatedDUT(capacity, seed=seed)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        found = ThroughputSearch(dut.trial).run()
+
+                    self.assertIsNotNone(found)
+                    self.assertLessEqual(abs(found - expected), RESOLUTION)
+                    self.assertLess(dut.elapsed, sweepTime)
+
+    def test_all_rejected(self):
+        dut = SimulatedDUT(MIN_PPS // 2, seed=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = ThroughputSearch(dut.trial).run()
+
+        self.assertIsNone(found)
+        self.assertIsNone(linear_sweep(SimulatedDUT(MIN_PPS // 2, seed=0).trial))
+
+if __name__ == "__main__":
+    unittest.main()
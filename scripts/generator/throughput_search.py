@@ -0,0 +1,235 @@
+"""
+Usage: python3 throughput_search.py [-c <capacity>] [-n <nb_searches>]
+
+Adaptive search of the highest rate (pps) forwarded without drop, in the
+spirit of the throughput test of RFC 2544. Used by `test_drop.py`.
+
+The search bisects the interval of rates between the highest rate accepted
+and the lowest rate rejected, rounded to `RESOLUTION`:
+- a rate is accepted if its drop rate is below `LOSS_THRESHOLD`;
+- trials at a rate are repeated only until the confidence interval of the
+  mean drop rate no longer contains `LOSS_THRESHOLD` (at least `MIN_TRIALS`,
+  at most `MAX_TRIALS`);
+- trials are short while the interval is wide and lengthen up to
+  `MAX_DURATION` as the search converges.
+
+The search only needs a function running a trial and returning its drop rate.
+When run directly, it is compared to the linear sweep on a simulated DUT.
+"""
+
+import sys
+import math
+import random
+import argparse
+
+# ---------------------------------------
+#           SETTINGS
+# ---------------------------------------
+
+# range of rates searched, in pps
+MIN_PPS = 100000
+MAX_PPS = 1500000
+
+# precision of the result, in pps
+RESOLUTION = 10000
+
+# highest drop rate of an accepted rate
+LOSS_THRESHOLD = 0.001
+
+# duration of the trials, in seconds, from the first to the last steps
+MIN_DURATION = 2
+MAX_DURATION = 30
+
+# number of trials at each rate
+MIN_TRIALS = 2
+MAX_TRIALS = 10
+
+# ---------------------------------------
+#           PARAMETERS
+# ---------------------------------------
+
+# 0.975 quantile of the student t distribution, by degree of freedom
+T_QUANTILES = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+               2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086]
+T_QUANTILE_INF = 1.960
+
+# simulated DUT, fitted on `evaluation/drop/drop.txt` (1 CPU core)
+SIM_CAPACITY = 1011500
+SIM_JITTER = 0.0015
+SIM_FLOOR = 0.00003
+
+# time to reset the ports and load the profile before each trial, in seconds
+SIM_OVERHEAD = 2
+
+# ---------------------------------------
+#           CODE
+# ---------------------------------------
+
+def t_quantile(df : int) -> float:
+    """Return 0.975 quantile of the student t distribution with `df` degrees of freedom."""
+
+    return T_QUANTILES[df - 1] if df <= len(T_QUANTILES) else T_QUANTILE_INF
+
+def confidence_interval(samples : list) -> tuple:
+    """Return mean and half width of the 95% confidence interval of `samples`."""
+
+    n = len(samples)
+    mean = sum(samples) / n
+    if n < 2:
+        return mean, math.inf
+
+    var = sum((s - mean) ** 2 for s in samples) / (n - 1)
+    return mean, t_quantile(n - 1) * math.sqrt(var / n)
+
+class ThroughputSearch:
+    """Search of the highest rate without drop, `trial(pps, duration)` returning the drop rate."""
+
+    def __init__(self, trial, minPps : int = MIN_PPS, maxPps : int = MAX_PPS,
+                 resolution : int = RESOLUTION, threshold : float = LOSS_THRESHOLD,
+                 minDuration : float = MIN_DURATION, maxDuration : float = MAX_DURATION,
+                 minTrials : int = MIN_TRIALS, maxTrials : int = MAX_TRIALS) -> None:
+        self.trial = trial
+        self.minPps = minPps
+        self.maxPps = maxPps
+        self.resolution = resolution
+        self.threshold = threshold
+        self.minDuration = minDuration
+        self.maxDuration = maxDuration
+        self.minTrials = minTrials
+        self.maxTrials = maxTrials
+
+        # pps -> (accepted, drop rates)
+        self.results = {}
+        self.nbTrials = 0
+        self.duration = 0
+
+    def trial_duration(self, lo : int, hi : int) -> float:
+        """Return duration of the trials when the result is between `lo` and `hi`."""
+
+        # geometric from min to max duration, reached at the last bisection
+        steps = math.log2(max(2, (self.maxPps - self.minPps) / (2 * self.resolution)))
+        done = math.log2(max(1, (self.maxPps - self.minPps) / (hi - lo)))
+        progress = min(1, done / steps)
+
+        return round(self.minDuration * (self.maxDuration / self.minDuration) ** progress, 1)
+
+    def test_rate(self, pps : int, duration : float) -> bool:
+        """Return whether `pps` is accepted, with trials of `duration` seconds."""
+
+        drops = []
+        while len(drops) < self.maxTrials:
+            drops.append(self.trial(pps, duration))
+            self.nbTrials += 1
+            self.duration += duration
+
+            if len(drops) < self.minTrials:
+                continue
+
+            mean, width = confidence_interval(drops)
+            if mean + width < self.threshold or mean - width > self.threshold:
+                break
+
+        accepted = sum(drops) / len(drops) <= self.threshold
+        self.results[pps] = (accepted, drops)
+        print(f"pps = {pps} | duration = {duration} | trials = {len(drops)} | drop = {sum(drops) / len(drops):.6f} | {'accepted' if accepted else 'rejected'}")
+
+        return accepted
+
+    def run(self) -> int:
+        """Return highest accepted rate, None if even `minPps` is rejected."""
+
+        # rates are multiples of the resolution from `minPps`
+        lo, hi = self.minPps, self.minPps + (self.maxPps - self.minPps) // self.resolution * self.resolution
+
+        if self.test_rate(hi, self.minDuration):
+            return hi
+
+        while hi - lo > self.resolution:
+            mid = lo + (hi - lo) // 2 // self.resolution * self.resolution
+            if self.test_rate(mid, self.trial_duration(lo, hi)):
+                lo = mid
+            else:
+                hi = mid
+
+        # the lower bound may never have been tried
+        if lo not in self.results and not self.test_rate(lo, self.maxDuration):
+            return None
+
+        return lo
+
+class SimulatedDUT:
+    """Model of the forwarding of the DUT, dropping above `capacity` pps."""
+
+    def __init__(self, capacity : int = SIM_CAPACITY, jitter : float = SIM_JITTER,
+                 floor : float = SIM_FLOOR, seed : int = None) -> None:
+        self.capacity = capacity
+        self.jitter = jitter
+        self.floor = floor
+        self.random = random.Random(seed)
+        self.elapsed = 0
+
+    def trial(self, pps : int, duration : float) -> float:
+        """Return drop rate of a trial at `pps` during `duration` seconds."""
+
+        self.elapsed += duration + SIM_OVERHEAD
+
+        # longer trials average the variations of the capacity
+        capacity = self.capacity * (1 + self.random.gauss(0, self.jitter * math.sqrt(MAX_DURATION / duration)))
+        return max(0, 1 - capacity / pps) + self.random.expovariate(1 / self.floor)
+
+def linear_sweep(trial, minPps : int = MIN_PPS, maxPps : int = MAX_PPS, step : int = RESOLUTION,
+                 nbIters : int = MAX_TRIALS, duration : float = MAX_DURATION,
+                 threshold : float = LOSS_THRESHOLD) -> int:
+    """Return highest rate of the sweep from `minPps` to `maxPps` with mean drop rate below `threshold`."""
+
+    best = None
+    for pps in range(minPps, maxPps + 1, step):
+        drops = [trial(pps, duration) for _ in range(nbIters)]
+        if sum(drops) / nbIters <= threshold:
+            best = pps
+
+    return best
+
+def check_arguments():
+    """Check and parse arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog="throughput_search",
+        description="Compare the adaptive search with the linear sweep on a simulated DUT",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument("-c", type=int, required=False, default=SIM_CAPACITY, help="Capacity of the simulated DUT, in pps")
+    parser.add_argument("-n", type=int, required=False, default=10, help="Number of searches")
+    args = parser.parse_args()
+
+    if not MIN_PPS <= args.c <= MAX_PPS:
+        print(f"Capacity must be between {MIN_PPS} and {MAX_PPS}")
+        sys.exit(-1)
+
+    if args.n <= 0:
+        print("Number of searches cannot be <= 0")
+        sys.exit(-1)
+
+    return args.c, args.n
+
+if __name__ == "__main__":
+    capacity, nbSearches = check_arguments()
+
+    dut = SimulatedDUT(capacity, seed=0)
+    expected = linear_sweep(dut.trial)
+    sweepTime = dut.elapsed
+    print(f"Linear sweep: {expected} pps in {sweepTime / 3600:.1f} h\n")
+
+    nbSame = 0
+    times = []
+    for i in range(nbSearches):
+        dut = SimulatedDUT(capacity, seed=i + 1)
+        found = ThroughputSearch(dut.trial).run()
+        nbSame += found == expected
+        times.append(dut.elapsed)
+        print(f"Search {i}: {found} pps in {dut.elapsed / 60:.1f} min\n")
+
+    print(f"Same result as the sweep: {nbSame}/{nbSearches}")
+    print(f"Mean duration: {sum(times) / len(times) / 60:.1f} min ({sweepTime / (sum(times) / len(times)):.0f}x faster)")
+    sys.exit(0)
@@ -4,75 +4,88 @@ after sending the given amount of MTU packets without IOAM.
 
 Intended to be used with `test_profile_dex.py`.
 
-To put into `/opt/trex/v3.04/stl` on machine running TRex.
+The packets are built by `dex_packets.py`.
+
+To put into `/opt/trex/v3.04/stl` on machine running TRex, with `dex_packets.py`.
 """
 
 from trex_stl_lib.api import *
 import argparse
 
+import dex_packets
+
 class STLS1(object):
 
-    def create_stream (self, ioamPacketName : str, nbMTU = 100, nbIOAM = 1, insertionDEX = False, encapMode = True):
+    def create_stream (self, ioamPacketName : str, nbMTU = 100, nbIOAM = 1, insertionDEX = False, encapMode = True,
+                       nbFlows = 1, sizes = "MTU", port = 0):
         """
         Create stream which generates `nbMTU` MTU packets without IOAM followed by `nbIOAM` IOAM packets.
 
         Parameters:
-        - `ioamPacketName` : which IOAM packet to generate. Must match one of the constants below.
+        - `ioamPacketName` : which IOAM packet to generate, e.g. INLINE_FLOW_SEQ_800000 (see `dex_packets.py`).
         - `nbMTU`: number of MTU packets to generate.
         - `nbIOAM`: number of IOAM packets to generate.
         - `insertionDEX`: DEX will be inserted by DUT.
         - `encapMode`: DUT will insert PTO in encap mode instead of inline mode.
+        - `nbFlows`: number of distinct flows, by source address and flow label.
+        - `sizes`: mix of sizes of the packets, one of `SIZE_MIXES`.
+        - `port`: port sending the streams, whose flows are distinct from the flows of the other ports.
         """
 
         if nbMTU == 0 and nbIOAM == 0:
             raise RuntimeError("Cannot have both nbIOAM and nbMTU equal to 0")
+        if nbFlows <= 0:
+            raise RuntimeError("Cannot have nbFlows <= 0")
+        if sizes not in STLS1.SIZE_MIXES:
+            raise RuntimeError(f"Invalid mix of sizes {sizes}")
 
-        base_pkt = STLS1.PKT_MTU
-
+        # packets as a function of the length of the frame, and their share of the packets
+        base_pkt = lambda frameLen: dex_packets.plain_packet(max(frameLen, dex_packets.min_frame_len()))
         if insertionDEX:
-            ioam_pkt = STLS1.DEX_ENCAP if encapMode else STLS1.DEX_INLINE
+            ioam_pkt = lambda frameLen: STLS1.get_insertion_packet(encapMode, frameLen)
         else:
-            ioam_pkt = STLS1.get_ioam_packet(ioamPacketName)
+            ioam_pkt = lambda frameLen: STLS1.get_ioam_packet(ioamPacketName, frameLen)
 
         if nbMTU == 0 or insertionDEX: # only IOAM packets
-            return STLProfile(
-                [
-                    STLStream(
-                        name       = 'ioam',
-                        packet     = STLPktBuilder(pkt = ioam_pkt),
-                        mode       = STLTXCont(percentage = 100),
-                    ),
-                ]
-            ).get_streams()
+            packets = [('ioam', ioam_pkt, 1)]
         elif nbIOAM == 0: # only mtu packets
-            return STLProfile(
-                [
-                    STLStream(
-                        name       = 'mtu',
-                        packet     = STLPktBuilder(pkt = base_pkt),
-                        mode       = STLTXCont(percentage = 100),
-                    ),
-                ]
-            ).get_streams()
+            packets = [('mtu', base_pkt, 1)]
         else: # mix of ioam and mtu packets
             total = nbMTU + nbIOAM
-            ioamPercent = (nbIOAM/total)*100
-            mtuPercent = (nbMTU/total)*100
-
-            return STLProfile(
-                [
-                    STLStream(
-                        name   = 'mtu',
-                        packet = STLPktBuilder(pkt = base_pkt),
-                        mode   = STLTXCont(percentage = mtuPercent),
-                    ),
-                    STLStream(
-                        name       = 'ioam',
-                        packet     = STLPktBuilder(pkt = ioam_pkt),
-                        mode       = STLTXCont(percentage = ioamPercent),
-                    ),
-                ]
-            ).get_streams()
+            packets = [('mtu', base_pkt, nbMTU/total), ('ioam', ioam_pkt, nbIOAM/total)]
+
+        # rates are relative, the total rate is given when starting the traffic
+        mix = STLS1.SIZE_MIXES[sizes]
+        weights = sum(weight for _, weight in mix)
+
+        streams = []
+        for name, build, share in packets:
+            for frameLen, weight in mix:
+                streams.append(STLStream(
+                    name   = name if len(mix) == 1 else f"{name}_{frameLen}",
+                    packet = STLS1.get_builder(build(frameLen), nbFlows, port),
+                    mode   = STLTXCont(pps = share * weight / weights * STLS1.RELATIVE_PPS),
+                ))
+
+        return STLProfile(streams).get_streams()
+
+    def get_builder(pkt : bytes, nbFlows : int, port : int = 0):
+        """Return builder of `pkt`, with the flows varying if `nbFlows` > 1."""
+
+        # flows differ by the source address and flow label of the outer header, and each port
+        # has its own flows so that the queues of the DUT receiving them can differ
+        # flows are numbered from 1, the source address of the packets
+        first = port * nbFlows + 1
+        if nbFlows == 1:
+            return STLPktBuilder(pkt_buffer = pkt if port == 0 else dex_packets.with_flow(pkt, first))
+
+        # the checksums of ICMPv6 are not updated, forwarding does not check them
+        vm = STLScVmRaw([
+            STLVmFlowVar(name = "flow", min_value = first, max_value = first + nbFlows - 1, size = 4, op = "inc"),
+            STLVmWrFlowVar(fv_name = "flow", pkt_offset = dex_packets.SRC_LOW_OFFSET),
+            STLVmWrMaskFlowVar(fv_name = "flow", pkt_offset = dex_packets.FLOW_LABEL_OFFSET, pkt_cast_size = 4, mask = 0xFFFFF),
+        ])
+        return STLPktBuilder(pkt_buffer = pkt, vm = vm)
 
     def get_streams(self, **kwargs):
         "Called from test_profile_dex.py to get the structure of the packets to generate."
@@ -88,6 +101,8 @@ class STLS1(object):
         parser.add_argument("--nbIOAM", type=int, required=True, help="Number of IOAM packets")
         parser.add_argument('--insertionDEX', default=False, type=lambda x: (str(x).lower() == 'true'), help="Packet with size for insertion of DEX")
         parser.add_argument('--encapMode', default=False, type=lambda x: (str(x).lower() == 'true'), help="Packet with size for insertion of DEX in encap mode")
+        parser.add_argument("--nbFlows", type=int, default=1, help="Number of flows")
+        parser.add_argument("--sizes", type=str, default="MTU", help="Mix of sizes of the packets")
 
         values = []
         for pair in tunables.split(","):
@@ -96,79 +111,40 @@ class STLS1(object):
         args = parser.parse_args(values)
 
         # create one or more streams depending on the options.
-        return self.create_stream(args.ioamPacketName, args.nbMTU, args.nbIOAM, args.insertionDEX, args.encapMode)
-
-    # ~ Simple packets ~
-    PKT_MTU = Ether()/IPv6(src="ab00::1",dst="cd00::1")/ICMPv6EchoRequest(data='x'*1438)
-
-    # Use the following packets for evaluating the IOAM encapsulating node
-    # 2B (IPv6 EH header) + 2B (Padding) + 4B (IOAM header) + 8B (DEX header) = 16B
-    DEX_INLINE = Ether()/IPv6(src="ab00::1",dst="cd00::1")/ICMPv6EchoRequest(data='x'*(1438-16))
-    # Additional 40B due to the extra IPv6 header because encap mode
-    DEX_ENCAP = Ether()/IPv6(src="ab00::1",dst="cd00::1")/ICMPv6EchoRequest(data='x'*(1438-16-40))
-
-    INLINE_NO_EXT_800000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x80\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_400000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x40\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_200000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x20\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_100000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x10\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_40000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x04\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_20000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x02\x00\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_8000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x80\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_4000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x40\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-    INLINE_NO_EXT_2000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x20\x00\x00')])/ICMPv6EchoRequest(data='x'*1422)
-
-    INLINE_FLOW_800000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\x80\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x01\x02\x00\x00')])/ICMPv6EchoRequest(data='x'*1414)
-    INLINE_FLOW_SEQ_800000 = Ether()/IPv6(src="ab00::1",dst="cd00::1")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\xc0\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x00\x00\x00\x01')])/ICMPv6EchoRequest(data='x'*1414)
-
-    ENCAP_NO_EXT_800000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x80\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_400000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x40\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_200000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x20\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_100000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x10\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_40000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x04\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_20000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x02\x00\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_8000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x80\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_4000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x40\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_NO_EXT_2000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x0a\x00\x04\x00\x7b\x00\x00\x00\x20\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-
-    ENCAP_FLOW_800000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\x80\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x01\x02\x00\x00')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-    ENCAP_FLOW_SEQ_800000 = Ether()/IPv6(src="ab00::1",dst="db01::2")/IPv6ExtHdrHopByHop(options=[HBHOptUnknown(b'\x01\x00\x31\x12\x00\x04\x00\x7b\x00\xc0\x80\x00\x00\x00\x0b\xdb\xe4\x0d\x00\x00\x00\x01')])/IPv6(src="ab00::1", dst="cd00::1")/ICMPv6EchoRequest(data='x'*1382)
-
-    # map between packet name and object
-    PACKETS_DICT = {
-        "INLINE_NO_EXT_800000": INLINE_NO_EXT_800000,
-        "INLINE_NO_EXT_400000": INLINE_NO_EXT_400000,
-        "INLINE_NO_EXT_200000": INLINE_NO_EXT_200000,
-        "INLINE_NO_EXT_100000": INLINE_NO_EXT_100000,
-        "INLINE_NO_EXT_40000": INLINE_NO_EXT_40000,
-        "INLINE_NO_EXT_20000": INLINE_NO_EXT_20000,
-        "INLINE_NO_EXT_8000": INLINE_NO_EXT_8000,
-        "INLINE_NO_EXT_4000": INLINE_NO_EXT_4000,
-        "INLINE_NO_EXT_2000": INLINE_NO_EXT_2000,
-
-        "INLINE_FLOW_800000": INLINE_FLOW_800000,
-        "INLINE_FLOW_SEQ_800000": INLINE_FLOW_SEQ_800000,
-
-        "ENCAP_NO_EXT_800000": ENCAP_NO_EXT_800000,
-        "ENCAP_NO_EXT_400000": ENCAP_NO_EXT_400000,
-        "ENCAP_NO_EXT_200000": ENCAP_NO_EXT_200000,
-        "ENCAP_NO_EXT_100000": ENCAP_NO_EXT_100000,
-        "ENCAP_NO_EXT_40000": ENCAP_NO_EXT_40000,
-        "ENCAP_NO_EXT_20000": ENCAP_NO_EXT_20000,
-        "ENCAP_NO_EXT_8000": ENCAP_NO_EXT_8000,
-        "ENCAP_NO_EXT_4000": ENCAP_NO_EXT_4000,
-        "ENCAP_NO_EXT_2000": ENCAP_NO_EXT_2000,
-
-        "ENCAP_FLOW_800000": ENCAP_FLOW_800000,
-        "ENCAP_FLOW_SEQ_800000": ENCAP_FLOW_SEQ_800000,
+        return self.create_stream(args.ioamPacketName, args.nbMTU, args.nbIOAM, args.insertionDEX, args.encapMode,
+                                  args.nbFlows, args.sizes, kwargs.get('port_id', 0))
+
+    # frames previously built 8 bytes longer, kept for comparison with the results
+    FRAME_LEN_EXCEPTIONS = {
+        "ENCAP_FLOW_800000": dex_packets.FRAME_LEN + 8,
+        "ENCAP_FLOW_SEQ_800000": dex_packets.FRAME_LEN + 8,
     }
 
-    def get_ioam_packet(name : str):
-        """Return IOAM packet with given `name`."""
+    # mixes of sizes: length of the frames (without FCS) and their weight
+    # frames too small for the headers are enlarged to fit
+    SIZE_MIXES = {
+        "MTU": [(dex_packets.FRAME_LEN, 1)],
+        "IMIX": [(60, 7), (590, 4), (dex_packets.FRAME_LEN, 1)],
+        "SMALL": [(60, 1)],
+    }
+
+    # rate of the streams before the multiplier, in pps
+    RELATIVE_PPS = 1000000
+
+    def get_ioam_packet(name : str, frameLen : int = dex_packets.FRAME_LEN) -> bytes:
+        """Return IOAM packet with given `name` (see `dex_packets.py`)."""
+
+        if frameLen == dex_packets.FRAME_LEN:
+            frameLen = STLS1.FRAME_LEN_EXCEPTIONS.get(name, frameLen)
+
+        mode, traceType, extFlags = dex_packets.parse_name(name)
+        return dex_packets.named_packet(name, max(frameLen, dex_packets.min_frame_len(mode, traceType, extFlags)))
 
-        if name not in STLS1.PACKETS_DICT:
-            raise RuntimeError(f"Invalid IOAM packet name {name}")
+    def get_insertion_packet(encapMode : bool, frameLen : int = dex_packets.FRAME_LEN) -> bytes:
+        """Return packet leaving room for the DEX inserted by the DUT, in encap or inline mode."""
 
-        return STLS1.PACKETS_DICT[name]
+        room = dex_packets.insertion_room("encap" if encapMode else "inline")
+        return dex_packets.plain_packet(max(frameLen - room, dex_packets.min_frame_len()))
 
 # dynamic load - used for trex console or simulator
 def register():